@@ -0,0 +1,61 @@
+"""
+Check and time shelf-position pruning in calculate_2d_distance on long, densely faced synthetic shelves
+
+    python benchmarks/bench_pruning.py --events 500 --products 300
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import Learn
+from ProductIndex import ProductIndex
+from synthetic import make_products, make_events
+
+class Predictor:
+    """
+    Minimal host object for the Learn prediction functions, which are written as methods
+    """
+    MIN_DISTANCE_SCALAR = 2.0
+    build_product_points = Learn.build_product_points
+    calculate_2d_distance = Learn.calculate_2d_distance
+    calculate_2d_distance_pruned = Learn.calculate_2d_distance_pruned
+    prune_products = Learn.prune_products
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--products", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    products = make_products(args.products, rng)
+    locs, deltas = make_events(args.events, products, rng)
+    product_index = ProductIndex({(1, 1): products})
+    predictor = Predictor()
+
+    for scalar in (1.0, 1.25, 2.0, 4.0):
+        predictor.MIN_DISTANCE_SCALAR = scalar
+        start = time.perf_counter()
+        full = [
+            predictor.calculate_2d_distance((loc, abs(delta)), predictor.build_product_points(products, loc, abs(delta)))[0]
+            for loc, delta in zip(locs, deltas)
+        ]
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pruned = [
+            predictor.calculate_2d_distance_pruned(products, loc, {"weight_delta": delta}, product_index)[0]
+            for loc, delta in zip(locs, deltas)
+        ]
+        pruned_time = time.perf_counter() - start
+
+        for full_candidates, pruned_candidates in zip(full, pruned):
+            assert [(id(c["product"]), c["distance"], c["qty"]) for c in full_candidates] == [(id(c["product"]), c["distance"], c["qty"]) for c in pruned_candidates]
+        print(f"MIN_DISTANCE_SCALAR={scalar}: full {full_time:.3f}s, pruned {pruned_time:.3f}s ({full_time/pruned_time:.1f}x), final candidates identical")
+
+if __name__ == "__main__":
+    main()
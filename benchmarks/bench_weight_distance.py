@@ -0,0 +1,66 @@
+"""
+Benchmark scalar vs batched weight_distance_prediction on synthetic shelves
+
+    python benchmarks/bench_weight_distance.py --events 2000 --products 40
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import Learn
+from synthetic import make_products, make_events
+
+class Predictor:
+    """
+    Minimal host object for the Learn prediction functions, which are written as methods
+    """
+    QTY_DECAY = 0.7
+    MIN_DISTANCE_SCALAR = 2.0
+    MIN_WEIGHT_THRESHOLD_MULTIPLIER = 0.5
+    weight_distance_prediction = Learn.weight_distance_prediction
+    weight_distance_prediction_batch = Learn.weight_distance_prediction_batch
+    weight_distance_scores = Learn.weight_distance_scores
+    build_product_points = Learn.build_product_points
+    calculate_2d_distance_new = Learn.calculate_2d_distance_new
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    predictor = Predictor()
+    products = make_products(args.products, rng)
+    locs, deltas = make_events(args.events, products, rng)
+
+    start = time.perf_counter()
+    scalar = [predictor.weight_distance_prediction(products, loc, {"weight_delta": delta}, 1.0) for loc, delta in zip(locs, deltas)]
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = predictor.weight_distance_prediction_batch(products, locs, deltas, 1.0)
+    batch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictor.weight_distance_scores(products, locs, deltas, 1.0)
+    scores_time = time.perf_counter() - start
+
+    for scalar_candidates, batch_candidates in zip(scalar, batch):
+        assert [c.quantity for c in scalar_candidates] == [c.quantity for c in batch_candidates]
+        assert [c.product for c in scalar_candidates] == [c.product for c in batch_candidates]
+        assert np.allclose([c.probability for c in scalar_candidates], [c.probability for c in batch_candidates], rtol=1e-9, atol=0)
+
+    pairs = args.events * args.products
+    print(f"{args.events} events x {args.products} products ({pairs} pairs), results match")
+    print(f"scalar: {scalar_time:.3f}s ({pairs/scalar_time:,.0f} pairs/s)")
+    print(f"batch:  {batch_time:.3f}s ({pairs/batch_time:,.0f} pairs/s)")
+    print(f"arrays: {scores_time:.3f}s ({pairs/scores_time:,.0f} pairs/s)")
+    print(f"speedup: {scalar_time/batch_time:.1f}x with Candidate objects, {scalar_time/scores_time:.1f}x as arrays")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Benchmark the prediction, product mapping and backtest scoring hot paths on seeded synthetic data
+
+    python benchmarks/run_benchmarks.py --scales small medium
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json --tolerance 0.15
+
+Each case reports the best-of-N throughput and the peak traced memory of one extra run
+Startup cases time `cli.py <command> --dry-run` in a fresh interpreter and report its peak RSS instead
+Comparing against a baseline flags cases whose throughput dropped or peak memory grew by more than the tolerance
+"""
+import argparse
+import io
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+import orjson
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+from synthetic import make_products, make_events, make_store, make_weight_events, make_backtest_responses, make_session_tags
+
+SCALES = {
+    "small" : {"systems": 1, "gondolas": 4, "shelves": 4, "products": 10, "events": 500, "sessions": 500},
+    "medium" : {"systems": 2, "gondolas": 8, "shelves": 5, "products": 25, "events": 2000, "sessions": 2000},
+    "large" : {"systems": 4, "gondolas": 12, "shelves": 6, "products": 60, "events": 5000, "sessions": 10000}
+}
+CLI_COMMANDS = ["backtest", "repredict", "sweep", "build-dataset", "stream"]
+CART_VERSIONS = ["baseline-p", "candidate-p"]
+SESSION_TAGS = ["multi-product-grab", "incomplete-reach"]
+PREDICTION_TAGS = ["false-negative", "false-positive"]
+
+def case_weight_distance_prediction(scale:dict, rng:np.random.Generator) -> tuple:
+    from Replay import ReplayPredictor
+    predictor = ReplayPredictor(dict(), dict())
+    products = make_products(scale["products"], rng)
+    locs, deltas = make_events(scale["events"], products, rng)
+    events = [{"weight_delta": delta} for delta in deltas]
+
+    def run():
+        for loc, event in zip(locs, events):
+            predictor.weight_distance_prediction(products, loc, event, 1.0)
+    return run, len(events), "events"
+
+def case_weight_distance_scores(scale:dict, rng:np.random.Generator) -> tuple:
+    import Learn
+    products = make_products(scale["products"], rng)
+    locs, deltas = make_events(scale["events"], products, rng)
+
+    class Host:
+        QTY_DECAY = 0.7
+        MIN_DISTANCE_SCALAR = 2.0
+        weight_distance_scores = Learn.weight_distance_scores
+
+    host = Host()
+    return lambda: host.weight_distance_scores(products, locs, deltas, 1.0), len(locs), "events"
+
+def case_location_prediction(scale:dict, rng:np.random.Generator) -> tuple:
+    from ProductMapper import ProductMapper
+    from Replay import ReplayPredictor
+    shelf_info, raw_product_data = make_store(scale["systems"], scale["gondolas"], scale["shelves"], scale["products"], rng)
+    mapper = ProductMapper(use_cache=False)
+    class_info = mapper.sort_class_info(mapper.dataMapping(shelf_info, raw_product_data))
+    predictor = ReplayPredictor(dict(), {"store": shelf_info})
+    events = make_weight_events(class_info, scale["events"], rng)
+
+    def run():
+        for shelf, event in events:
+            predictor.location_prediction(class_info[shelf], event, dict(), shelf, class_info, "store", 1.0)
+    return run, len(events), "events"
+
+def case_data_mapping(scale:dict, rng:np.random.Generator) -> tuple:
+    from ProductMapper import ProductMapper
+    shelf_info, raw_product_data = make_store(scale["systems"], scale["gondolas"], scale["shelves"], scale["products"], rng)
+    mapper = ProductMapper(use_cache=False)
+    num_products = sum(len(records) for records in raw_product_data.values())
+    return lambda: mapper.sort_class_info(mapper.dataMapping(shelf_info, raw_product_data)), num_products, "products"
+
+def case_data_mapping_arrays(scale:dict, rng:np.random.Generator) -> tuple:
+    from ProductMapper import ProductMapper
+    shelf_info, raw_product_data = make_store(scale["systems"], scale["gondolas"], scale["shelves"], scale["products"], rng)
+    mapper = ProductMapper(use_cache=False)
+    num_products = sum(len(records) for records in raw_product_data.values())
+    return lambda: mapper.dataMappingArrays(shelf_info, raw_product_data), num_products, "products"
+
+def case_product_index(scale:dict, rng:np.random.Generator) -> tuple:
+    from ProductIndex import ProductIndex
+    from ProductMapper import ProductMapper
+    shelf_info, raw_product_data = make_store(scale["systems"], scale["gondolas"], scale["shelves"], scale["products"], rng)
+    mapper = ProductMapper(use_cache=False)
+    class_info = mapper.sort_class_info(mapper.dataMapping(shelf_info, raw_product_data))
+    upcs = [product["Upc"] for products in class_info.values() for product in products]
+    lookups = [upcs[i] for i in rng.integers(0, len(upcs), scale["events"])]
+
+    def run():
+        product_index = ProductIndex(class_info)
+        for upc in lookups:
+            product_index.find_by_upc(upc)
+    return run, len(upcs), "products"
+
+def case_score_sessions(scale:dict, rng:np.random.Generator) -> tuple:
+    from Backtesting import Backtester
+    sessions = [f"session-{i}" for i in range(scale["sessions"])]
+    responses = make_backtest_responses(len(sessions), CART_VERSIONS, rng)
+    all_session_tags = make_session_tags(len(sessions), SESSION_TAGS, rng)
+    backtester = Backtester()
+    backtester.session_tags = SESSION_TAGS
+    backtester.prediction_tags = PREDICTION_TAGS
+    # Serve cart-metrics responses from memory, the rest of the pipeline (pool, parsing, scoring) runs as is
+    backtester.make_backtest_request = lambda session, version: responses[(session, version)]
+
+    def run():
+        backtester.score_sessions(sessions, CART_VERSIONS, all_session_tags).to_version_results()
+    return run, len(sessions) * len(CART_VERSIONS), "session-versions"
+
+CASES = {
+    "weight_distance_prediction" : case_weight_distance_prediction,
+    "weight_distance_scores" : case_weight_distance_scores,
+    "location_prediction" : case_location_prediction,
+    "dataMapping" : case_data_mapping,
+    "dataMappingArrays" : case_data_mapping_arrays,
+    "product_index" : case_product_index,
+    "score_sessions" : case_score_sessions
+}
+
+def measure(case, scale:dict, seed:int, repeats:int, min_time:float) -> dict:
+    '''
+    Best-of-repeats wall time and throughput, then peak traced memory of one more run
+    Fast cases are looped so every timed sample lasts at least min_time seconds, which keeps sub-millisecond cases stable
+    Progress output of the code under test is swallowed so it does not skew the timings
+    '''
+    with redirect_stdout(io.StringIO()):
+        run, units, unit = case(scale, np.random.default_rng(seed))
+        start = time.perf_counter()
+        run()
+        loops = max(1, int(min_time / max(time.perf_counter() - start, 1e-9)))
+        times = list()
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for _ in range(loops):
+                run()
+            times.append((time.perf_counter() - start) / loops)
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    best = min(times)
+    return {"seconds": best, "throughput": units / best, "units": units, "unit": unit, "peak_bytes": peak}
+
+def measure_startup(command:str, repeats:int) -> dict:
+    '''
+    Best-of-repeats wall time for `cli.py <command> --dry-run` in a fresh interpreter, and the peak RSS of the slowest-to-import child
+    Returns None when the command cannot start here, e.g. an optional dependency of its modules is missing
+    '''
+    times = list()
+    peak = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "cli.py", "--dry-run", command], cwd=SRC_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        _, status, usage = os.wait4(process.pid, 0)
+        times.append(time.perf_counter() - start)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stderr = process.stderr.read().decode("utf-8", errors="replace").strip()
+        process.stderr.close()
+        if process.returncode != 0:
+            print(f"startup[{command}] skipped: {stderr.splitlines()[-1] if stderr else f'exit code {process.returncode}'}")
+            return None
+        # ru_maxrss is in KiB on Linux
+        peak = max(peak, usage.ru_maxrss * 1024)
+    best = min(times)
+    return {"seconds": best, "throughput": 1 / best, "units": 1, "unit": "starts", "peak_bytes": peak}
+
+def compare(results:dict, baseline:dict, tolerance:float) -> list:
+    '''
+    Print each case against the baseline, returns the names of cases that regressed
+    '''
+    regressions = list()
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:45s} no baseline")
+            continue
+        speed = result["throughput"] / base["throughput"]
+        memory = result["peak_bytes"] / max(base["peak_bytes"], 1)
+        regressed = speed < 1 - tolerance or memory > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:45s} throughput {speed:6.2f}x  peak memory {memory:6.2f}x  {'REGRESSION' if regressed else 'ok'}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", nargs="*", choices=list(CASES.keys()), default=list(CASES.keys()))
+    parser.add_argument("--startup", nargs="*", choices=CLI_COMMANDS, default=CLI_COMMANDS, help="cli.py subcommands to measure startup time for")
+    parser.add_argument("--scales", nargs="*", choices=list(SCALES.keys()), default=["small", "medium"])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per timed sample")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--save-baseline", help="write results as the new baseline to this path")
+    parser.add_argument("--baseline", help="compare against a baseline written by --save-baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative throughput drop / peak memory growth")
+    args = parser.parse_args()
+
+    results = dict()
+    for scale_name in args.scales:
+        for case_name in args.cases:
+            name = f"{case_name}[{scale_name}]"
+            result = measure(CASES[case_name], SCALES[scale_name], args.seed, args.repeats, args.min_time)
+            results[name] = result
+            print(f"{name:45s} {result['throughput']:14,.0f} {result['unit']}/s  {result['seconds']*1000:9.2f} ms  peak {result['peak_bytes']/2**20:8.2f} MiB")
+    for command in args.startup:
+        name = f"startup[{command}]"
+        result = measure_startup(command, args.repeats)
+        if result is None:
+            continue
+        results[name] = result
+        print(f"{name:45s} {result['seconds']*1000:9.2f} ms to import  peak RSS {result['peak_bytes']/2**20:8.2f} MiB")
+
+    report = {
+        "created" : time.time(),
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "machine" : platform.platform(),
+        "seed" : args.seed,
+        "results" : results
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "wb") as f:
+                f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+            print(f"Wrote {path}")
+
+    if args.baseline:
+        with open(args.baseline, "rb") as f:
+            baseline = orjson.loads(f.read())
+        print(f"\nCompared to baseline from {baseline['machine']} (python {baseline['python']}, numpy {baseline['numpy']})")
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
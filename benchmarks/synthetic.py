@@ -0,0 +1,130 @@
+"""
+Seeded synthetic data for the benchmarks: shelf infos, planogram exports, weight events and cart-metrics responses
+Everything is generated in-process so the benchmarks run offline
+"""
+import numpy as np
+
+SCALE = 1 / 12 # inches to feet, same as ProductMapper.scale
+
+def make_products(num_products:int, rng:np.random.Generator) -> list:
+    '''
+    One shelf of mapped product dicts laid out left to right, with X_Left/X_Right in feet
+    '''
+    widths = rng.uniform(0.2, 0.6, num_products)
+    lefts = np.concatenate([[0], np.cumsum(widths)[:-1]])
+    weights = rng.uniform(50, 900, num_products).round(1)
+    return [
+        {"Upc": f"upc-{i}", "gondola_id": 1, "shelf_id": 1, "X_Left": float(lefts[i]), "X_Right": float(lefts[i] + widths[i]), "GrossWeight": float(weights[i])}
+        for i in range(num_products)
+    ]
+
+def make_events(num_events:int, products:list, rng:np.random.Generator) -> tuple:
+    '''
+    (locations in feet, weight deltas) for grabs of 1-3 units of random products on one shelf, with sensor noise
+    '''
+    shelf_length = products[-1]["X_Right"]
+    picks = rng.integers(0, len(products), num_events)
+    quantities = rng.integers(1, 4, num_events)
+    locs = np.array([rng.uniform(products[i]["X_Left"], products[i]["X_Right"]) for i in picks])
+    deltas = -np.array([products[i]["GrossWeight"] for i in picks]) * quantities + rng.normal(0, 5, num_events)
+    return locs.clip(0, shelf_length), deltas
+
+def make_store(systems:int, gondolas:int, shelves:int, products:int, rng:np.random.Generator) -> tuple:
+    '''
+    Shelf info (system -> gondola -> shelf -> coordinates, as load_shelf_info returns it) and the matching raw planogram export per system
+    Shelves are as long as their facings, so relative weight locations map back onto products
+    '''
+    shelf_info, raw_product_data = dict(), dict()
+    upc = 0
+    for s in range(systems):
+        system_id = f"system-{s}"
+        shelf_info[system_id], raw_product_data[system_id] = dict(), list()
+        for g in range(gondolas):
+            gondola_id = s * 1000 + g
+            shelf_info[system_id][str(gondola_id)] = dict()
+            for shelf in range(1, shelves + 1):
+                widths = rng.choice([3.0, 4.0, 5.5, 8.0], products)
+                lefts = np.concatenate([[0], np.cumsum(widths)[:-1]])
+                length = float(widths.sum()) * SCALE
+                x_front_left, y_front_left = float(g * 10), float(s * 10)
+                shelf_info[system_id][str(gondola_id)][str(shelf)] = {
+                    "x_front_left" : str(x_front_left),
+                    "y_front_left" : str(y_front_left),
+                    "x_front_right" : str(x_front_left + length),
+                    "y_front_right" : str(y_front_left),
+                    "height" : str(shelf * 1.1),
+                    "shelf" : str(shelf),
+                    "gondola_id" : str(gondola_id),
+                    "smart_system_name" : system_id
+                }
+                for p in range(products):
+                    raw_product_data[system_id].append({
+                        "frictionlessGondolaId" : gondola_id,
+                        "shelf" : shelf,
+                        "price" : 1.99,
+                        "name" : f"product-{upc}",
+                        "upc" : f"{upc:012d}",
+                        "grossWeight" : str(round(float(rng.uniform(50, 900)), 1)) if rng.random() > 0.05 else None,
+                        "netWeight" : "40",
+                        "depth" : 6 if rng.random() > 0.1 else None,
+                        "x" : float(lefts[p]),
+                        "widthOnShelf" : float(widths[p]),
+                        "section" : 1
+                    })
+                    upc += 1
+    return shelf_info, raw_product_data
+
+def make_weight_events(class_info:dict, num_events:int, rng:np.random.Generator) -> list:
+    '''
+    (shelf key, weight_event) pairs of 1-3 unit grabs at random products of a mapped class_info, xlocation relative to the shelf
+    '''
+    shelves = [key for key, products in class_info.items() if len(products)]
+    events = list()
+    for i in rng.integers(0, len(shelves), num_events):
+        products = class_info[shelves[i]]
+        product = products[int(rng.integers(0, len(products)))]
+        quantity = int(rng.integers(1, 4))
+        center = (product["X_Left"] + product["X_Right"]) / 2
+        events.append((shelves[i], {
+            "weight_delta" : -max(product["GrossWeight"], 1.0) * quantity + float(rng.normal(0, 5)),
+            "xlocation" : center / product["shelf_width"]
+        }))
+    return events
+
+class BacktestResponse:
+    """
+    Stand-in for a cart-metrics response, only the headers are read by Backtester.backtest_session
+    """
+    def __init__(self, headers:dict) -> None:
+        self.headers = headers
+        self.status_code = 200
+
+def make_backtest_responses(num_sessions:int, cart_versions:list, rng:np.random.Generator) -> dict:
+    '''
+    (session, version) -> cart-metrics response, with roughly 80% correct carts and a few unscored sessions
+    '''
+    responses = dict()
+    for i in range(num_sessions):
+        for version in cart_versions:
+            if rng.random() < 0.02:
+                responses[(f"session-{i}", version)] = BacktestResponse(dict())
+                continue
+            is_correct = rng.random() < 0.8
+            num_fn = 0 if is_correct else int(rng.integers(0, 3))
+            num_fp = 0 if is_correct else int(rng.integers(0 if num_fn else 1, 3))
+            responses[(f"session-{i}", version)] = BacktestResponse({
+                "is_correct" : str(is_correct),
+                "num_fn" : str(num_fn),
+                "num_fp" : str(num_fp),
+                "num_reviews" : "1"
+            })
+    return responses
+
+def make_session_tags(num_sessions:int, session_tags:list, rng:np.random.Generator) -> dict:
+    '''
+    session -> list of session tags, about a third of sessions tagged
+    '''
+    return {
+        f"session-{i}" : [tag for tag in session_tags if rng.random() < 0.2]
+        for i in range(num_sessions) if rng.random() < 0.33
+    }
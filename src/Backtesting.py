@@ -1,11 +1,23 @@
 import requests  
-import mlflow
 import random
 from json import dumps
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from requests.adapters import HTTPAdapter
+from threading import Lock
 from time import sleep, time
 from os import getenv, environ, wait
 from numpy import select, random, arange
+from MlflowLogger import MlflowLogger
+from ResultStore import ResultStore
+from Sampling import StratifiedEstimate, StratifiedSampler, sequential_looks, stratify, wilson_interval
+from Scoring import ScoreAccumulator
+from SharedCache import SharedCache
+from Sharding import merge_partials, partial_store_from_env, shard_from_env, shard_sessions
+from Telemetry import ERRORS, RETRIES, SESSIONS, ThroughputMeter, span, timed
+
+METRICS_ADDRESS = "http://cart-metrics-dev.default.svc.cluster.local:5006/backtest"
 
 class Session:
     def __init__(self):
@@ -15,14 +27,51 @@ class CartVersion:
     def __init__(self) -> None:
         pass
 
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces calls out to at most `rate` per second (0 disables it)
+    """
+    def __init__(self, rate:float) -> None:
+        self.interval = 1 / rate if rate else 0
+        self.next_time = time()
+        self.lock = Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self.lock:
+            now = time()
+            slot = max(now, self.next_time)
+            self.next_time = slot + self.interval
+        if slot > now:
+            sleep(slot - now)
+
 class Backtester:
-    def __init__(self):
+    def __init__(self, max_workers:int=None, timeout:float=None, retries:int=None):
+        # Concurrency and HTTP settings for cart-metrics requests
+        self.max_workers = max_workers if max_workers is not None else int(getenv("BACKTEST_WORKERS", 16))
+        self.timeout = timeout if timeout is not None else float(getenv("BACKTEST_TIMEOUT", 30))
+        self.retries = retries if retries is not None else int(getenv("BACKTEST_RETRIES", 3))
+        self.analysis_timeout = float(getenv("REPREDICT_TIMEOUT", 300))
+        self.http = self.build_http_session(max(self.max_workers, int(getenv("REPREDICT_WORKERS", 8))))
+        # Optional semaphore shared with other schedulers to cap total in-flight requests
+        self.request_budget = None
+        # Optional persistent (session, version) result store for incremental/resumable runs
+        self.result_store = ResultStore(getenv("BACKTEST_RESULT_STORE")) if getenv("BACKTEST_RESULT_STORE") else None
+        # Optional Redis cache of cart-metrics verdicts shared by every worker and pod (REDIS_ADDRESS)
+        self.shared_cache = SharedCache.from_env()
+        self.verdict_ttl = float(getenv("REDIS_VERDICT_TTL", 604800))
+        # Sampled backtests: significance level, smallest draw per stratum and the seed of the stratified sample
+        self.sample_alpha = float(getenv("BACKTEST_SAMPLE_ALPHA", 0.05))
+        self.sample_min_per_stratum = int(getenv("BACKTEST_SAMPLE_MIN_STRATUM", 5))
+        self.sample_seed = int(getenv("BACKTEST_SAMPLE_SEED", 0))
+        # Runs are logged to MLFlow from a background queue so a slow tracking server never blocks a backtest
+        self.mlflow_logger = MlflowLogger()
         if getenv("CLUSTER_ID") == "global.us.central.1":
-            # Initiate ML flow
+            # Initiate ML flow, the logger only imports mlflow and contacts the tracking server once a run is logged
             environ["MLFLOW_TRACKING_USERNAME"] = "mlflow"
             environ["GIT_PYTHON_REFRESH"] = "quiet"
-            mlflow.set_tracking_uri("https://mlflow.awmfric.com")
-            mlflow.set_experiment("Cart-Backtest-Demo")
+            self.mlflow_logger = MlflowLogger(experiment_name="Cart-Backtest-Demo", tracking_uri="https://mlflow.awmfric.com")
             self.cart_versions = [
                 f"{getenv('CART_BRANCH')}-v3.2.0-p",
                 f"{getenv('CART_BRANCH')}-v3.2.1-p",
@@ -43,24 +92,96 @@ class Backtester:
         else:
             print(f"Current cluster is not Global, backtesting will be functionally useless")
 
+    def build_http_session(self, pool_size:int) -> requests.Session:
+        """
+        Create a keep-alive HTTP session whose connection pool is sized for the worker count
+        """
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(pool_size, 1))
+        http = requests.Session()
+        http.mount("http://", adapter)
+        http.mount("https://", adapter)
+        return http
+
+    @contextmanager
+    def budgeted(self, request_budget):
+        '''
+        Hold every request made inside the block to request_budget, restoring the previous budget afterwards
+        '''
+        previous = self.request_budget
+        self.request_budget = request_budget
+        try:
+            yield self
+        finally:
+            self.request_budget = previous
+
     def make_backtest_request(self, session, version):
         """
         Hit Cart Metrics endpoint to test for prediction correctness
+        Retries connection errors and 5xx responses with exponential backoff
         """
-        metrics_address = "http://cart-metrics-dev.default.svc.cluster.local:5006/backtest"
         body = {
                 "session_id":session,
                 "cart_version": version
         }
-        try:
-            backtest_analysis = requests.get(
-                metrics_address,
-                json=body
-            )
-        except Exception as e:
-            print(f"Error {e}")
-            return dict()
-        return backtest_analysis
+        for attempt in range(self.retries + 1):
+            try:
+                with self.request_budget or nullcontext(), timed("cart_metrics"):
+                    backtest_analysis = self.http.get(
+                        METRICS_ADDRESS,
+                        json=body,
+                        timeout=self.timeout
+                    )
+                if backtest_analysis.status_code < 500:
+                    return backtest_analysis
+                if attempt == self.retries:
+                    ERRORS.labels("cart_metrics", version).inc()
+                    return backtest_analysis
+            except Exception as e:
+                print(f"Error {e}")
+                if attempt == self.retries:
+                    ERRORS.labels("cart_metrics", version).inc()
+                    return dict()
+            RETRIES.labels("cart_metrics", version).inc()
+            sleep(0.5 * 2 ** attempt)
+        return dict()
+
+    def backtest_session(self, session, cart_versions) -> dict:
+        """
+        Request backtest results for every cart version of a single session
+        Returns a dict of version -> {"is_correct", "num_fn", "num_fp", "prediction_tags"} for versions cart-metrics could score
+        """
+        version_info = dict()
+        # Shared verdicts are keyed by the session's prediction generations, which re-predicting bumps (see invalidate_verdicts):
+        # one for every version of the session and one per (session, version)
+        generation = 0
+        if self.shared_cache is not None and cart_versions:
+            generation = self.shared_cache.get(self.shared_cache.key("verdict-generation", session)) or 0
+        for version in cart_versions:
+            if self.shared_cache is not None:
+                version_generation = self.shared_cache.get(self.shared_cache.key("verdict-generation", session, version)) or 0
+                key = self.shared_cache.key("verdict", version, session, generation, version_generation)
+                info = self.shared_cache.get_or_fetch(key, lambda: self.request_verdict(session, version), self.verdict_ttl)
+            else:
+                info = self.request_verdict(session, version)
+            if info is not None:
+                version_info[version] = info
+        return version_info
+
+    def request_verdict(self, session, version) -> dict:
+        """
+        Ask cart-metrics for one (session, version) verdict, None when it could not be scored
+        """
+        result = self.make_backtest_request(session, version)
+        headers = getattr(result, "headers", dict())
+        # Incorporate prediction-level tags
+        if "is_correct" not in headers:
+            return None
+        return {
+            "prediction_tags" : self.get_prediction_tags(headers),
+            "is_correct" : headers["is_correct"] == "True",
+            "num_fn" : int(headers.get("num_fn", 0)),
+            "num_fp" : int(headers.get("num_fp", 0))
+        }
 
     def get_prediction_tags(self, headers):
         """
@@ -82,127 +203,358 @@ class Backtester:
         """
         Get session-level tags (stuff like bad weight events, bad reaches, etc) from DB
         """
-        with sql.cursor() as cursor:
-            cursor.execute(f"select * from frictionless.upload_record_tables where session_id='{session}'")
+        with sql.cursor() as cursor, timed("sql"):
+            cursor.execute("select * from frictionless.upload_record_tables where session_id=%s", (session,))
             session_tags = cursor.fetchone()[-1] if cursor.rowcount > 0 else list()
             if session_tags is None:
                 session_tags = list()
         return session_tags
 
-    def backtest_all_sessions(self, sql, config, versions=False, run_analysis=False):
+    def load_session_tags(self, sql, sessions:list, chunk_size:int=1000) -> dict:
         """
-        Wrapper function to aggregate all Cart predictions and run them through backtesting endpoint, score for correctness, and create MLFlow Experiment
+        Bulk load session-level tags for many sessions with chunked IN (...) queries
+        Returns a session_id -> tags index, sessions without a tag record map to an empty list
         """
-        # If needed, re-predict upon all global sessions
-        if run_analysis:
-            self.run_all_sessions(sql, config)
+        session_tags = {session : list() for session in sessions}
+        with sql.cursor() as cursor:
+            for i in range(0, len(sessions), chunk_size):
+                chunk = sessions[i:i + chunk_size]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                with timed("sql"):
+                    cursor.execute(f"select * from frictionless.upload_record_tables where session_id in ({placeholders})", chunk)
+                    rows = cursor.fetchall()
+                session_id_index = [column[0] for column in cursor.description].index("session_id") if cursor.description else 0
+                seen = set()
+                for row in rows:
+                    session = row[session_id_index]
+                    # Match get_session_tags, which only reads the first record of a session
+                    if session in seen:
+                        continue
+                    seen.add(session)
+                    if row[-1] is not None:
+                        session_tags[session] = row[-1]
+        return session_tags
 
-        # Get all predictions from global storage
-        session_results = dict()
+    def load_grab_counts(self, sql, sessions:list, cart_version:str, chunk_size:int=1000) -> dict:
+        """
+        session_id -> (num_grabs, num_putbacks) from the reference cart version's predictions, so strata do not depend on row order
+        Loaded with chunked IN (...) queries and read in batches like load_session_tags, sessions without a row are left out
+        """
+        grab_counts = dict()
         with sql.cursor() as cursor:
+            for i in range(0, len(sessions), chunk_size):
+                chunk = sessions[i:i + chunk_size]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                with timed("sql"):
+                    cursor.execute(
+                        f"SELECT session_id, num_grabs, num_putbacks from frictionless.cart_predictions where cart_version=%s and session_id in ({placeholders})",
+                        [cart_version] + list(chunk)
+                    )
+                while True:
+                    with timed("sql"):
+                        rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    for session, num_grabs, num_putbacks in rows:
+                        grab_counts.setdefault(session, (num_grabs, num_putbacks))
+        return grab_counts
 
-            # Load backtested cart versions for comparison
-            if versions:
-               cursor.execute("SELECT DISTINCT cart_version from frictionless.cart_predictions")
-               cart_versions = [session[0] for session in cursor.fetchall()]
-            else:
-                cart_versions = self.cart_versions
-            print(f"Cart versions being tested: {cart_versions}")
-            # Aggregate all session IDs
-            cursor.execute("SELECT DISTINCT session_id from frictionless.cart_predictions")
-            sessions = [session[0] for session in cursor.fetchall()]
-
-            # Begin backtesting pulled down session IDs
-            print(f"Backtesting {len(sessions)} sessions")
-            session_ctr = 1
-            for session in sessions:
-                print(session_ctr)
-                session_ctr += 1
-                # Collect session-level tags
-                session_tags = self.get_session_tags(sql, session)
-                for version in self.cart_versions:
-                    result = self.make_backtest_request(session, version)
-                    print(result.headers, version)
-                    # Incorporate session-level and prediction-level tags
-                    if "is_correct" in result.headers:
-                        prediction_tags = self.get_prediction_tags(result.headers) 
-                        session_results.setdefault(session, {"versions": dict(), "session_tags": session_tags})
-                        if version not in session_results[session]["versions"].keys():
-                            session_results[session]["versions"][version] = dict()
-                        session_results[session]["versions"][version]["prediction_tags"] = prediction_tags
-                        session_results[session]["versions"][version]["is_correct"] = result.headers["is_correct"] == "True"
-                            
-        print("Scoring results...")
-        # Initialize data struct for correctness with all counters set to 0
-        version_results = {
-            version: { 
-                "correct" : 0,
-                "total" : 0,
-                "session_tags" : {
-                    session_tag : {
-                        "correct" : 0,
-                        "total" :0
-                    } for session_tag in self.session_tags
-                },
-                "prediction_tags" : {
-                    prediction_tag : {
-                        "total" : 0
-                    } for prediction_tag in self.prediction_tags
-                }
-            } for version in self.cart_versions 
-        }
+    def backtest_all_sessions(self, sql, config, versions=False, run_analysis=False, store=None, shard_index=None, shard_count=None, run_id=None, sample_size=None, sequential=False, max_sessions=None):
+        """
+        Wrapper function to aggregate all Cart predictions and run them through backtesting endpoint, score for correctness, and create MLFlow Experiment
+        Pairs already held in the result store (defaults to BACKTEST_RESULT_STORE) are not requested again
+        In sharded mode (SHARD_COUNT > 1) only this replica's hash partition of sessions is scored and written to the partial store,
+        and shard 0 acts as coordinator: it merges every shard's partial and logs the combined result once
+        With sample_size only a stratified sample of sessions is backtested (see backtest_sample), on shard 0 alone, and every version
+        is reported with confidence intervals and paired against the first cart version
+        Returns the version_results that were logged, or None on a non-coordinator shard
+        """
+        if shard_index is None or shard_count is None:
+            env_index, env_count = shard_from_env()
+            shard_index = env_index if shard_index is None else shard_index
+            shard_count = env_count if shard_count is None else shard_count
+        if sample_size and shard_count > 1:
+            # A sample is small enough for one replica, and splitting it would split its strata
+            if shard_index != 0:
+                print(f"Sampled backtests run on shard 0 only, shard {shard_index} has nothing to do")
+                return None
+            shard_count = 1
+        sharded = shard_count > 1
+        if sharded:
+            # Fixed before any work starts, so every replica files its partial under the same id however long scoring takes
+            run_id = run_id or self.shard_run_id()
+        with span("backtest_all_sessions", run_analysis=run_analysis, shard_index=shard_index, shard_count=shard_count, sample_size=sample_size or 0):
+            # If needed, re-predict upon all global sessions (a sampled run only re-predicts the sessions it draws)
+            if run_analysis and not sample_size:
+                self.run_all_sessions(sql, config, shard_index=shard_index, shard_count=shard_count, store=store)
 
-        # Start scoring
-        for results in session_results.values():
-            for version, version_info in results["versions"].items():
-                is_correct = version_info["is_correct"]
-                # Update based on general results 
-                if is_correct:
-                    version_results[version]["correct"] += 1
-                version_results[version]["total"] += 1
-                for session_tag in version_results[version]["session_tags"].keys():
-                    # Update based on each tag
-                    if session_tag in results["session_tags"]:
-                        if is_correct:
-                            version_results[version]["session_tags"][session_tag]["correct"] += 1
-                        version_results[version]["session_tags"][session_tag]["total"] += 1
-
-                for prediction_tag in version_info["prediction_tags"]:
-                    version_results[version]["prediction_tags"][prediction_tag]["total"] += 1
-
-        # Run MLFlow experiment
-        self.run_mlflow_experiment(version_results, config)
+            # Get all predictions from global storage
+            with sql.cursor() as cursor, timed("sql"):
+
+                # Load backtested cart versions for comparison
+                if versions:
+                   cursor.execute("SELECT DISTINCT cart_version from frictionless.cart_predictions")
+                   cart_versions = [session[0] for session in cursor.fetchall()]
+                else:
+                    cart_versions = self.cart_versions
+                print(f"Cart versions being tested: {cart_versions}")
+                # Aggregate all session IDs
+                cursor.execute("SELECT DISTINCT session_id from frictionless.cart_predictions")
+                sessions = list(dict.fromkeys(session[0] for session in cursor.fetchall()))
+            if sharded:
+                sessions = shard_sessions(sessions, shard_index, shard_count)
+                print(f"Shard {shard_index}/{shard_count} owns {len(sessions)} sessions")
+
+            # Collect session-level tags
+            all_session_tags = self.load_session_tags(sql, sessions)
+
+            if sample_size:
+                accumulator, estimate, alpha = self.backtest_sample(sql, config, sessions, cart_versions, all_session_tags, sample_size, sequential, max_sessions, run_analysis, store or self.result_store)
+                version_results = accumulator.to_version_results()
+                comparisons = self.report_sample(version_results, estimate, alpha)
+                self.run_mlflow_experiment(version_results, config)
+                self.log_comparisons(comparisons, config, alpha)
+                print("Done...")
+                return version_results
+
+            # Begin backtesting pulled down session IDs, scoring each result as it arrives
+            print(f"Backtesting {len(sessions)} sessions with {self.max_workers} workers")
+            accumulator = self.score_sessions(sessions, cart_versions, all_session_tags, store or self.result_store)
+
+            if sharded:
+                partial_store = partial_store_from_env()
+                try:
+                    partial_store.put(run_id, shard_index, shard_count, len(sessions), accumulator)
+                    print(f"Stored partial results of shard {shard_index}/{shard_count} for run {run_id}")
+                    if shard_index != 0:
+                        return None
+                    # Coordinator: wait for the other replicas, then merge
+                    partials = partial_store.wait_for(run_id, shard_count, float(getenv("BACKTEST_MERGE_TIMEOUT", 21600)), float(getenv("BACKTEST_MERGE_POLL", 5)))
+                finally:
+                    partial_store.close()
+                accumulator = merge_partials(partials)
+                print(f"Merged {shard_count} shards covering {sum(session_count for session_count, _ in partials.values())} sessions")
+            version_results = accumulator.to_version_results()
+
+            # Run MLFlow experiment
+            self.run_mlflow_experiment(version_results, config)
         print("Done...")
+        return version_results
+
+    def backtest_sample(self, sql, config, sessions:list, cart_versions:list, all_session_tags:dict, sample_size:int, sequential:bool=False, max_sessions:int=None, run_analysis:bool=False, store:ResultStore=None) -> tuple:
+        """
+        Backtest a sample of sessions stratified by tags of interest (self.session_tags) and the first cart version's num_grabs/num_putbacks buckets
+        Without sequential one sample of about sample_size sessions is scored; with it, batches of sample_size more sessions are drawn until
+        every version's paired difference to the first version is significant, max_sessions are sampled or the corpus runs out.
+        Alpha is split evenly over the planned looks so stopping early does not inflate the false positive rate, and the run never
+        makes more looks than were planned (draws are always sample-sized until the corpus runs out, this is a safety net)
+        Returns (accumulator, estimate, alpha) where alpha is the per-look significance level the intervals should use
+        """
+        strata = stratify(sessions, all_session_tags, self.load_grab_counts(sql, sessions, cart_versions[0]), self.session_tags)
+        sampler = StratifiedSampler(strata, self.sample_min_per_stratum, self.sample_seed)
+        estimate = StratifiedEstimate(sampler.sizes, cart_versions)
+        accumulator = ScoreAccumulator(cart_versions, self.session_tags, self.prediction_tags)
+        max_sessions = min(max_sessions or len(sessions), len(sessions))
+        planned_looks = sequential_looks(sample_size, sample_size, max_sessions) if sequential else 1
+        alpha = self.sample_alpha / planned_looks
+        print(f"Sampling {sample_size} of {len(sessions)} sessions from {len(sampler.sizes)} strata{f', sequentially up to {max_sessions}' if sequential else ''}")
+        sampled = 0
+        looks = 0
         while True:
-            sleep(1)
+            batch = sampler.draw(min(sample_size, max_sessions - sampled))
+            if not batch:
+                break
+            if run_analysis:
+                failed_sessions = self.run_sessions(batch, config, store=store)
+                if failed_sessions:
+                    print(f"{len(failed_sessions)} sampled sessions failed to re-predict")
+            for session, version_info in self.iter_session_results(batch, cart_versions, store):
+                for version, info in version_info.items():
+                    accumulator.update(version, info["is_correct"], all_session_tags.get(session), info["prediction_tags"])
+                estimate.update(strata[session], version_info)
+            sampled += len(batch)
+            looks += 1
+            undecided = list()
+            for version in cart_versions[1:]:
+                difference = estimate.difference(cart_versions[0], version, alpha=alpha)
+                if difference["low"] <= 0 <= difference["high"]:
+                    undecided.append(version)
+            print(f"Look {looks}/{planned_looks}: sampled {sampled} sessions, {len(cart_versions) - 1 - len(undecided)}/{len(cart_versions) - 1} comparisons to {cart_versions[0]} significant")
+            if not undecided or sampled >= max_sessions or looks >= planned_looks:
+                break
+        return accumulator, estimate, alpha
+
+    def report_sample(self, version_results:dict, estimate:StratifiedEstimate, alpha:float) -> dict:
+        """
+        Add confidence intervals to a sampled run's version_results and pair every version with the first one
+        Tags of interest are estimated from their strata, other tags fall back to a Wilson interval on the raw counts
+        Returns (version_a, version_b) -> {"all" : difference, tag : difference} for the tags of interest
+        """
+        for version, results in version_results.items():
+            if version not in estimate.cart_versions:
+                continue
+            results["interval"] = estimate.accuracy(version, alpha=alpha)
+            for session_tag, tag_results in results["session_tags"].items():
+                strata = estimate.strata_with(session_tag) if session_tag in self.session_tags else []
+                if strata:
+                    tag_results["interval"] = estimate.accuracy(version, strata, alpha)
+                else:
+                    low, high = wilson_interval(tag_results["correct"], tag_results["total"], alpha)
+                    tag_results["interval"] = {"estimate" : tag_results["correct"] / max(tag_results["total"], 1), "low" : low, "high" : high, "sessions" : tag_results["total"]}
+
+        comparisons = dict()
+        version_a = estimate.cart_versions[0]
+        for version_b in estimate.cart_versions[1:]:
+            comparison = {"all" : estimate.difference(version_a, version_b, alpha=alpha)}
+            for session_tag in self.session_tags:
+                strata = estimate.strata_with(session_tag)
+                if strata:
+                    comparison[session_tag] = estimate.difference(version_a, version_b, strata, alpha)
+            comparisons[(version_a, version_b)] = comparison
+            for name, difference in comparison.items():
+                verdict = "better" if difference["low"] > 0 else "worse" if difference["high"] < 0 else "not significantly different"
+                print(f"{version_b} vs {version_a} on {name}: {difference['estimate']*100:+.1f}% [{difference['low']*100:+.1f}%, {difference['high']*100:+.1f}%] over {difference['sessions']} paired sessions, McNemar p={difference['p_value']:.3g}, {verdict}")
+        return comparisons
+
+    def log_comparisons(self, comparisons:dict, config, alpha:float) -> None:
+        """
+        Queue one MLFlow run per paired comparison of a sampled backtest
+        """
+        for (version_a, version_b), comparison in comparisons.items():
+            params = {
+                "version_a" : version_a,
+                "version_b" : version_b,
+                "session_count" : comparison["all"]["sessions"],
+                "alpha" : alpha,
+                "config" : config
+            }
+            metrics = dict()
+            for name, difference in comparison.items():
+                prefix = "general" if name == "all" else name
+                metrics[f"{prefix}_difference"] = round(difference["estimate"], 4)
+                metrics[f"{prefix}_difference_low"] = round(difference["low"], 4)
+                metrics[f"{prefix}_difference_high"] = round(difference["high"], 4)
+                metrics[f"{prefix}_p_value"] = difference["p_value"]
+            self.mlflow_logger.log_run(f"compare_{version_b}_vs_{version_a}", params, metrics)
+
+    def shard_run_id(self) -> str:
+        """
+        Id shared by all replicas of a sharded run, from BACKTEST_RUN_ID (the Job's controller uid in backtest-job.yaml)
+        It has to be unique per run, or the coordinator merges partials left by an earlier run, and only the launcher
+        can hand the same unique token to every replica, so there is no derived fallback
+        """
+        run_id = getenv("BACKTEST_RUN_ID")
+        if not run_id:
+            raise ValueError("Sharded backtests need BACKTEST_RUN_ID set to an id unique to this run and shared by every replica")
+        return run_id
+
+    def iter_session_results(self, sessions:list, cart_versions:list, store:ResultStore=None):
+        """
+        Backtest every session against every cart version on a bounded worker pool
+        Yields (session, version_info) in session order so the output matches a serial run, keeping at most a few batches in flight
+        When a result store is given only the (session, version) pairs missing from it are requested
+        """
+        stored_results = store.load(cart_versions) if store is not None else dict()
+
+        def request_missing(session):
+            cached_info = stored_results.get(session, dict())
+            missing = [version for version in cart_versions if version not in cached_info]
+            return self.backtest_session(session, missing) if missing else dict()
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers) if self.max_workers > 1 else None
+        in_flight = deque()
+        session_iter = iter(sessions)
+        throughput = ThroughputMeter("backtest")
+        try:
+            session_ctr = 0
+            while True:
+                # Keep the pool fed without materializing a future for every session
+                while executor is not None and len(in_flight) < self.max_workers * 4:
+                    session = next(session_iter, None)
+                    if session is None:
+                        break
+                    in_flight.append((session, executor.submit(request_missing, session)))
+                if executor is not None:
+                    if not in_flight:
+                        break
+                    session, future = in_flight.popleft()
+                    new_info = future.result()
+                else:
+                    session = next(session_iter, None)
+                    if session is None:
+                        break
+                    new_info = request_missing(session)
+                session_ctr += 1
+                throughput.mark()
+                for version in new_info:
+                    SESSIONS.labels("backtest", version).inc()
+                if session_ctr % 100 == 0:
+                    print(f"Backtested {session_ctr}/{len(sessions)} sessions")
+                if store is not None:
+                    for version, info in new_info.items():
+                        store.put(session, version, info)
+                cached_info = stored_results.get(session, dict())
+                version_info = {
+                    version : new_info[version] if version in new_info else cached_info[version]
+                    for version in cart_versions if version in new_info or version in cached_info
+                }
+                yield session, version_info
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            if store is not None:
+                store.flush()
+
+    def score_sessions(self, sessions:list, cart_versions:list, all_session_tags:dict, store:ResultStore=None) -> ScoreAccumulator:
+        """
+        Stream backtest results into per-version counters without keeping per-session results around
+        """
+        accumulator = ScoreAccumulator(cart_versions, self.session_tags, self.prediction_tags)
+        for session, version_info in self.iter_session_results(sessions, cart_versions, store):
+            for version, info in version_info.items():
+                accumulator.update(version, info["is_correct"], all_session_tags.get(session), info["prediction_tags"])
+        return accumulator
 
     def run_mlflow_experiment(self, version_results, config):
         """
         Run MLFlow experiment for each version, logging config, and scoring each tag.
+        Each version's params and metrics are queued as one batched run on self.mlflow_logger
         """
         for version, results in version_results.items():
-            with mlflow.start_run(run_name=f"backtest_{version}"):
-                mlflow_params = {
-                    "version" : version,
-                    "session_count" : results['total'],
-                    "config" : config
-                }
-                mlflow.log_params(mlflow_params)
+            mlflow_params = {
+                "version" : version,
+                "session_count" : results['total'],
+                "config" : config
+            }
+
+            # Start doing tag-level scoring
+            score = round((results['correct']/max(results['total'], 1)), 3)
+            metrics = {"general_score" : score}
+            # Sampled runs carry confidence intervals on the population accuracy
+            if "interval" in results:
+                metrics["general_score"] = round(results["interval"]["estimate"], 3)
+                metrics["general_score_low"] = round(results["interval"]["low"], 3)
+                metrics["general_score_high"] = round(results["interval"]["high"], 3)
 
-                # Start doing tag-level scoring
-                score = round((results['correct']/results['total']), 3)
-                mlflow.log_metric(f"general_score", score)
+            # Session tags
+            for session_tag in results["session_tags"].keys():
+                session_tag_score = round(results["session_tags"][session_tag]["correct"]/(max(results["session_tags"][session_tag]["total"], 1)), 3)
+                metrics[f"{session_tag}_score"] = session_tag_score
+                if "interval" in results["session_tags"][session_tag]:
+                    interval = results["session_tags"][session_tag]["interval"]
+                    metrics[f"{session_tag}_score"] = round(interval["estimate"], 3)
+                    metrics[f"{session_tag}_score_low"] = round(interval["low"], 3)
+                    metrics[f"{session_tag}_score_high"] = round(interval["high"], 3)
 
-                # Session tags
-                for session_tag in results["session_tags"].keys():
-                    session_tag_score = round(results["session_tags"][session_tag]["correct"]/(max(results["session_tags"][session_tag]["total"], 1)), 3)
-                    mlflow.log_metric(f"{session_tag}_score", session_tag_score)
+            # Prediction tags
+            for prediction_tag in results["prediction_tags"].keys():
+                prediction_tag_total = results["prediction_tags"][prediction_tag]["total"]
+                metrics[f"{prediction_tag}_total"] = prediction_tag_total
 
-                # Prediction tags
-                for prediction_tag in results["prediction_tags"].keys():
-                    prediction_tag_total = results["prediction_tags"][prediction_tag]["total"]
-                    mlflow.log_metric(f"{prediction_tag}_total", prediction_tag_total)
-                print(f"Version {version} had {results['correct']} correct sessions of {results['total']} total, for an accuracy of {score*100}%")
+            self.mlflow_logger.log_run(f"backtest_{version}", mlflow_params, metrics)
+            print(f"Version {version} had {results['correct']} correct sessions of {results['total']} total, for an accuracy of {score*100}%")
+            if "interval" in results:
+                print(f"Version {version} estimated accuracy {metrics['general_score']*100:.1f}% [{metrics['general_score_low']*100:.1f}%, {metrics['general_score_high']*100:.1f}%]")
 
     def build_param_sweep_configs(self, config, value, start, stop, step):
         """
@@ -225,32 +577,117 @@ class Backtester:
             uri = "http://cart-analyzer-dev.default.svc.cluster.local:5005/analysis"
         else:
             uri = "http://cart-analyzer-3-1-9.default.svc.cluster.local:5017/analysis"
-        r = requests.get(
-            url=uri,
-            json={
-                "session_id": session_id, 
-                "gid_hash": "", 
-                "submit": True, 
-                "config" : dumps(config)
-            }
-        )
+        with self.request_budget or nullcontext(), timed("cart_analyzer"):
+            r = self.http.get(
+                url=uri,
+                json={
+                    "session_id": session_id, 
+                    "gid_hash": "", 
+                    "submit": True, 
+                    "config" : dumps(config)
+                },
+                timeout=self.analysis_timeout
+            )
         return str(r.status_code)
 
-    def run_all_sessions(self, sql, config):
+    def run_cart_with_retry(self, session_id:str, config:dict, dev=True, rate_limiter:"RateLimiter"=None) -> dict:
         """
-        Get all sessions within global storage and re-predict upon them
+        Re-predict a session, retrying errors, 429s and 5xx responses with exponential backoff
+        Returns a record of the final status code, attempt count and last error
         """
-        with sql.cursor() as cursor:
-            all_session_id_query = "SELECT session_id from frictionless.cart_predictions"
-            session_ids = cursor.execute(all_session_id_query)
-            sessions = list(set([session[0] for session in cursor.fetchall()]))
-            print(session_ids)
-            for session_id in sessions:
-                print(f'Testing {session_id}...')
-                self.run_cart(session_id, config, dev=True)
-        print("DONE")
-        # while True:
-        #     sleep(1)
+        record = {"session_id": session_id, "status_code": None, "attempts": 0, "error": None}
+        cart_version = self.config_version(config)
+        for attempt in range(self.retries + 1):
+            if rate_limiter is not None:
+                rate_limiter.wait()
+            record["attempts"] = attempt + 1
+            try:
+                record["status_code"] = self.run_cart(session_id, config, dev)
+                record["error"] = None
+                if record["status_code"] != "429" and not record["status_code"].startswith("5"):
+                    break
+            except Exception as e:
+                record["error"] = str(e)
+            if attempt < self.retries:
+                RETRIES.labels("cart_analyzer", cart_version).inc()
+                sleep(0.5 * 2 ** attempt)
+        if record["status_code"] is None or not record["status_code"].startswith("2"):
+            ERRORS.labels("cart_analyzer", cart_version).inc()
+        SESSIONS.labels("repredict", cart_version).inc()
+        return record
+
+    def config_version(self, config) -> str:
+        """
+        Cart version label for metrics about a re-predict config, when the config names one
+        """
+        if isinstance(config, dict):
+            return str(config.get("cart_version", "default"))
+        return "default"
+
+    def repredicted_versions(self, config) -> list:
+        """
+        Cart versions a re-predict config rewrites: the one it names, or None (every version) when the analyzer picks the version
+        """
+        if isinstance(config, dict) and config.get("cart_version"):
+            return [str(config["cart_version"])]
+        return None
 
+    def invalidate_verdicts(self, sessions:list, store:ResultStore=None, versions:list=None) -> None:
+        """
+        Forget the stored and shared-cache verdicts of re-predicted sessions for the given versions (every version by default),
+        so the next backtest scores the new predictions instead of serving the old verdicts
+        The shared cache is invalidated by bumping the sessions' generations, which every pod reads before looking a verdict up
+        """
+        if store is not None and sessions:
+            removed = store.invalidate(sessions, versions)
+            print(f"Invalidated {removed} stored verdicts of {len(sessions)} re-predicted sessions for {', '.join(versions) if versions else 'every version'}")
+        if self.shared_cache is not None:
+            for session in sessions:
+                # Outlive every verdict cached under the previous generation, so the counter never resets while they exist
+                if versions is None:
+                    self.shared_cache.incr(self.shared_cache.key("verdict-generation", session), self.verdict_ttl)
+                else:
+                    for version in versions:
+                        self.shared_cache.incr(self.shared_cache.key("verdict-generation", session, version), self.verdict_ttl)
 
-    
\ No newline at end of file
+    def run_sessions(self, session_ids:list, config:dict, dev=True, max_workers:int=None, rate_limit:float=None, rate_limiter:RateLimiter=None, store:ResultStore=None, invalidate_store:bool=True) -> list:
+        """
+        Re-predict the given sessions on a worker pool capped at rate_limit requests per second
+        A shared rate_limiter can be passed instead so several concurrent runs respect one cap
+        Verdicts of every session that was sent are invalidated for the config's version (every version if it names none), including failed ones,
+        whose predictions may have been partially rewritten: in the shared cache, and in the result store (self.result_store unless store is given)
+        unless invalidate_store is False because the caller does not score against it
+        Returns the records of every session that did not come back with a 2xx status
+        """
+        max_workers = max_workers or int(getenv("REPREDICT_WORKERS", 8))
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(rate_limit if rate_limit is not None else float(getenv("REPREDICT_RATE_LIMIT", 5)))
+        failed_sessions = list()
+        throughput = ThroughputMeter("repredict")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            records = executor.map(lambda session_id: self.run_cart_with_retry(session_id, config, dev, rate_limiter), session_ids)
+            for session_ctr, record in enumerate(records, start=1):
+                if record["status_code"] is None or not record["status_code"].startswith("2"):
+                    failed_sessions.append(record)
+                rate = throughput.mark()
+                if session_ctr % 100 == 0 or session_ctr == len(session_ids):
+                    print(f"Re-predicted {session_ctr}/{len(session_ids)} sessions ({rate:.2f} sessions/s, {len(failed_sessions)} failed)")
+        self.invalidate_verdicts(session_ids, (store or self.result_store) if invalidate_store else None, self.repredicted_versions(config))
+        return failed_sessions
+
+    def run_all_sessions(self, sql, config, dev=True, max_workers:int=None, rate_limit:float=None, shard_index:int=0, shard_count:int=1, store:ResultStore=None) -> list:
+        """
+        Get all sessions within global storage and re-predict upon them, or only one shard's partition of them
+        Returns the records of sessions that failed to re-predict
+        """
+        with span("run_all_sessions", dev=dev):
+            with sql.cursor() as cursor, timed("sql"):
+                cursor.execute("SELECT DISTINCT session_id from frictionless.cart_predictions")
+                sessions = [session[0] for session in cursor.fetchall()]
+            sessions = shard_sessions(sessions, shard_index, shard_count)
+            print(f"Re-predicting {len(sessions)} sessions")
+            failed_sessions = self.run_sessions(sessions, config, dev, max_workers, rate_limit, store=store)
+        for record in failed_sessions:
+            print(f"Failed to re-predict {record['session_id']} after {record['attempts']} attempts: status {record['status_code']}, error {record['error']}")
+        print("DONE")
+        return failed_sessions
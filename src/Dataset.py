@@ -0,0 +1,135 @@
+import os
+import time
+import orjson
+import numpy as np
+
+MANIFEST = "manifest.json"
+
+class DatasetWriter:
+    """
+    Materialize preprocessed input and label matrices into versioned, chunked .npy shards with a manifest
+    Rows of many sessions are concatenated per shard; an index array records each session's input and label row ranges
+    The manifest is written last, so a partially written version is never picked up by DatasetReader
+    """
+    def __init__(self, root:str, product_limit:int, feature_width:int, version:str=None, shard_rows:int=100000) -> None:
+        self.root = root
+        self.version = version or time.strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(root, self.version)
+        self.product_limit = product_limit
+        self.feature_width = feature_width
+        self.shard_rows = shard_rows
+        self.shards = list()
+        self.reset_buffer()
+        os.makedirs(self.path, exist_ok=True)
+
+    def reset_buffer(self) -> None:
+        self.inputs, self.outputs, self.sessions, self.epochs = list(), list(), list(), list()
+        self.input_rows, self.output_rows = 0, 0
+        self.index = list()
+
+    def add(self, session_id:str, inputs:np.ndarray, outputs:np.ndarray, epochs:list=()) -> None:
+        '''
+        Append one session's input rows and label rows, flushing a shard once it reaches shard_rows input rows
+        '''
+        inputs = np.asarray(inputs, dtype=np.float32).reshape(-1, self.feature_width)
+        outputs = np.asarray(outputs, dtype=np.int32).reshape(-1, self.product_limit)
+        self.index.append((self.input_rows, self.input_rows + len(inputs), self.output_rows, self.output_rows + len(outputs)))
+        self.inputs.append(inputs)
+        self.outputs.append(outputs)
+        self.sessions.append(session_id)
+        self.epochs.append(list(epochs))
+        self.input_rows += len(inputs)
+        self.output_rows += len(outputs)
+        if self.input_rows >= self.shard_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.sessions:
+            return
+        name = f"shard-{len(self.shards):05d}"
+        np.save(os.path.join(self.path, f"{name}.inputs.npy"), np.concatenate(self.inputs))
+        np.save(os.path.join(self.path, f"{name}.outputs.npy"), np.concatenate(self.outputs))
+        np.save(os.path.join(self.path, f"{name}.index.npy"), np.array(self.index, dtype=np.int64).reshape(-1, 4))
+        self.shards.append({
+            "name" : name,
+            "sessions" : self.sessions,
+            "planogram_epochs" : self.epochs,
+            "input_rows" : self.input_rows,
+            "output_rows" : self.output_rows
+        })
+        self.reset_buffer()
+
+    def close(self) -> str:
+        '''
+        Flush the last shard and write the manifest, returns the dataset version directory
+        '''
+        self.flush()
+        manifest = {
+            "version" : self.version,
+            "created" : time.time(),
+            "product_limit" : self.product_limit,
+            "feature_width" : self.feature_width,
+            "shards" : self.shards
+        }
+        tmp_path = os.path.join(self.path, MANIFEST + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(manifest))
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST))
+        return self.path
+
+class DatasetReader:
+    """
+    Open a materialized dataset version with memory-mapped shards, so nothing is read until it is used
+    """
+    def __init__(self, root:str, version:str=None) -> None:
+        if version is None:
+            versions = sorted(name for name in os.listdir(root) if os.path.exists(os.path.join(root, name, MANIFEST)))
+            if not versions:
+                raise FileNotFoundError(f"No dataset with a manifest found under {root}")
+            version = versions[-1]
+        self.path = os.path.join(root, version)
+        with open(os.path.join(self.path, MANIFEST), "rb") as f:
+            self.manifest = orjson.loads(f.read())
+        self.product_limit = self.manifest["product_limit"]
+
+    def shard(self, shard:dict) -> tuple:
+        '''
+        Memory-map one shard's inputs, outputs and session index
+        '''
+        name = shard["name"]
+        return (
+            np.load(os.path.join(self.path, f"{name}.inputs.npy"), mmap_mode="r"),
+            np.load(os.path.join(self.path, f"{name}.outputs.npy"), mmap_mode="r"),
+            np.load(os.path.join(self.path, f"{name}.index.npy"))
+        )
+
+    def session_ids(self) -> list:
+        return [session for shard in self.manifest["shards"] for session in shard["sessions"]]
+
+    def iter_sessions(self):
+        '''
+        Yield (session_id, inputs, outputs) as zero-copy views into the shards
+        '''
+        for shard in self.manifest["shards"]:
+            inputs, outputs, index = self.shard(shard)
+            for session, (input_start, input_end, output_start, output_end) in zip(shard["sessions"], index):
+                yield session, inputs[input_start:input_end], outputs[output_start:output_end]
+
+    def iter_batches(self, batch_size:int):
+        '''
+        Yield batches of up to batch_size consecutive sessions as dicts of session ids, contiguous input/label views and per-session row offsets
+        Batches never span shards, so the views stay zero-copy
+        '''
+        for shard in self.manifest["shards"]:
+            inputs, outputs, index = self.shard(shard)
+            for start in range(0, len(shard["sessions"]), batch_size):
+                batch_index = index[start:start + batch_size]
+                input_start, output_start = batch_index[0, 0], batch_index[0, 2]
+                input_end, output_end = batch_index[-1, 1], batch_index[-1, 3]
+                yield {
+                    "session_ids" : shard["sessions"][start:start + batch_size],
+                    "inputs" : inputs[input_start:input_end],
+                    "outputs" : outputs[output_start:output_end],
+                    "input_offsets" : np.append(batch_index[:, 0], input_end) - input_start,
+                    "output_offsets" : np.append(batch_index[:, 2], output_end) - output_start
+                }
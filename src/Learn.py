@@ -1,25 +1,47 @@
-import sklearn 
-import hulearn
 import math
 import numpy as np
+from math import sqrt
+from typing import Any, NamedTuple
+from ShelfGeometry import shelf_key
+
+class Candidate(NamedTuple):
+    """
+    Candidate product for a weight event, with its prediction confidence and signed quantity
+    """
+    product: dict
+    probability: float
+    quantity: int
 
 def location_prediction(self, products:list, weight_event:dict, current_cart:list, location:tuple, pmap:list, store_id:str, confidence_multiplier:float, vendor:bool=False, additional_weights:list=[]) -> list:
         """
         Make prediction on weight event using downloaded product mapper
         """
+        # Precomputed shelf length and minimum product weight, when a ShelfGeometry table is attached and products is a whole pmap shelf
+        geometry = getattr(self, "shelf_geometry", None)
+        key = shelf_key(products[0]['smart_system_id'], products[0]['gondola_id'], products[0]['shelf']) if geometry is not None else None
+        shelf_length = geometry.shelf_length(store_id, key) if geometry is not None else None
+        shelf_min_weight = None
+        if geometry is not None and pmap is not None and pmap.get((products[0]['gondola_id'], products[0]['shelf_id'])) is products:
+            shelf_min_weight = geometry.min_weights(pmap).get(key)
+
         # Catch noisy weight events where weight delta doesnt reach the minimum weight of any products on shelf
         weight = weight_event["weight_delta"]
-        sorted_weights = sorted([product["GrossWeight"] for product in products] + additional_weights)
-        min_weight = sorted_weights[0] if sorted_weights != 0 else sorted_weights[1]
+        if shelf_min_weight is not None:
+            min_weight = min([shelf_min_weight] + additional_weights)
+        else:
+            sorted_weights = sorted([product["GrossWeight"] for product in products] + additional_weights)
+            min_weight = sorted_weights[0] if sorted_weights != 0 else sorted_weights[1]
         if abs(weight) < self.MIN_WEIGHT_THRESHOLD_MULTIPLIER * min_weight:
             self.logging.info(f"WEIGHT EVENT FILTERED OUT, weight {weight} and minimum product weight {min_weight}")
             return list()
         
         # Begin forming prediction by localizing where weight occured on a shelf
-        shelf_coordinates = self.shelf_infos[store_id][str(products[0]['smart_system_id'])][str(products[0]['gondola_id'])][str(products[0]['shelf'])]   
-        relative_weight_loc = max(0, min(float(weight_event['xlocation']), 1)) * sqrt(
-            abs(float(shelf_coordinates['y_front_right']) - float(shelf_coordinates['y_front_left'])) ** 2
-            + abs(float(shelf_coordinates['x_front_right']) - float(shelf_coordinates['x_front_left'])) ** 2)
+        if shelf_length is None:
+            shelf_coordinates = self.shelf_infos[store_id][str(products[0]['smart_system_id'])][str(products[0]['gondola_id'])][str(products[0]['shelf'])]   
+            shelf_length = sqrt(
+                abs(float(shelf_coordinates['y_front_right']) - float(shelf_coordinates['y_front_left'])) ** 2
+                + abs(float(shelf_coordinates['x_front_right']) - float(shelf_coordinates['x_front_left'])) ** 2)
+        relative_weight_loc = max(0, min(float(weight_event['xlocation']), 1)) * shelf_length
     
         # Hand off further refinement to either putback or grab helper functions
         if weight > 0:
@@ -41,29 +63,7 @@ def weight_distance_prediction(self, products: list[dict[str, Any]], relative_we
             relative_weight_loc, 
             abs_weight_delta
         )
-        product_points = list()
-        for product in products:
-            data_points = []
-
-            dist_to_left_boundary = abs(relative_weight_loc - product["X_Left"])
-            dist_to_right_boundary = abs(relative_weight_loc - product["X_Right"])
-            
-            if dist_to_left_boundary <= dist_to_right_boundary:
-                closest_boundary = product["X_Left"]
-            else:
-                closest_boundary = product["X_Right"]
-            
-            product_weight = product["GrossWeight"]
-            if product_weight:
-                raw_quantity = abs_weight_delta / product_weight
-            else:
-                raw_quantity = 1
-                
-            if raw_quantity >= 1:  # Don't consider qty 0 
-                data_points.append((closest_boundary, product_weight * math.floor(raw_quantity)))
-            data_points.append((closest_boundary, product_weight * math.ceil(raw_quantity)))
-
-            product_points.append({"product": product, "datapoints": data_points})
+        product_points = self.build_product_points(products, relative_weight_loc, abs_weight_delta)
 
         # Calculate distance between weight event point and all other points
         point_distances = self.calculate_2d_distance_new(weight_event_point, product_points)
@@ -115,4 +115,171 @@ def calculate_2d_distance(self, weight_event_point:tuple, product_points:list):
             final_candidates.append(data)
         else:
             tossed_candidates.append(data)
-    return final_candidates, tossed_candidates
\ No newline at end of file
+    return final_candidates, tossed_candidates
+
+def calculate_2d_distance_new(self, weight_event_point:tuple, product_points:list) -> list:
+    """
+    Split (location, weight) distance per product, used by weight_distance_prediction
+    For each product the data point closest to the weight event is kept, along with its location and weight distances, quantity and how far the raw quantity is from it
+    """
+    distances = list()
+    relative_weight_loc, abs_weight_delta = weight_event_point
+    for point_data in product_points:
+        data_points = point_data["datapoints"]
+        product_distances = [math.dist(weight_event_point, point) for point in data_points]
+        closest_boundary, min_product_weight = data_points[product_distances.index(min(product_distances))]
+        product_weight = point_data["product"]["GrossWeight"]
+        raw_quantity = abs_weight_delta / product_weight if product_weight else 1
+        qty = max(1, int(min_product_weight / product_weight)) if product_weight else 1
+        distances.append({
+            "location_distance" : abs(relative_weight_loc - closest_boundary),
+            "weight_distance" : abs(abs_weight_delta - min_product_weight),
+            "weight" : min_product_weight,
+            "qty" : qty,
+            "qty_remainder" : abs(raw_quantity - qty),
+            "product" : point_data["product"]
+        })
+    return distances
+
+def product_columns(products) -> tuple:
+    """
+    X_Left, X_Right and GrossWeight as float arrays from a list of product dicts or a ShelfArrays
+    """
+    if hasattr(products, "X_Left"):
+        return products.X_Left, products.X_Right, products.GrossWeight
+    return (
+        np.array([product["X_Left"] for product in products], dtype=float),
+        np.array([product["X_Right"] for product in products], dtype=float),
+        np.array([product["GrossWeight"] for product in products], dtype=float)
+    )
+
+def weight_distance_scores(self, products, relative_weight_locs, weight_deltas, confidence_multipliers=1.0, vendor=False) -> tuple:
+        """
+        Array core of weight_distance_prediction_batch, for callers that do not need Candidate objects
+        Boundary distances, candidate quantities, distances and confidences are computed as (events x products) broadcasts
+        Returns (probabilities, quantities), both shaped (events, products)
+        """
+        x_left, x_right, gross_weight = product_columns(products)
+        locs = np.asarray(relative_weight_locs, dtype=float)[:, None]
+        abs_weight_deltas = np.abs(np.asarray(weight_deltas, dtype=float))[:, None]
+        multipliers = np.broadcast_to(np.asarray(confidence_multipliers, dtype=float), (locs.shape[0],))[:, None]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Closest product boundary to each event, ties go to the left boundary
+            closest_boundary = np.where(np.abs(locs - x_left) <= np.abs(locs - x_right), x_left, x_right)
+            has_weight = gross_weight != 0
+            raw_quantity = np.where(has_weight, abs_weight_deltas / np.where(has_weight, gross_weight, 1), 1)
+            floor_weight = gross_weight * np.floor(raw_quantity)
+            ceil_weight = gross_weight * np.ceil(raw_quantity)
+            location_offset = locs - closest_boundary
+            floor_distance = np.sqrt(location_offset ** 2 + (abs_weight_deltas - floor_weight) ** 2)
+            ceil_distance = np.sqrt(location_offset ** 2 + (abs_weight_deltas - ceil_weight) ** 2)
+            # Floor data point only exists for qty >= 1 and wins ties, matching list.index(min(...))
+            min_product_weight = np.where((raw_quantity >= 1) & (floor_distance <= ceil_distance), floor_weight, ceil_weight)
+            qty = np.where(has_weight, np.maximum(1, np.trunc(min_product_weight / np.where(has_weight, gross_weight, 1))), 1)
+            qty_remainder = np.abs(raw_quantity - qty)
+
+            weight_distance = np.abs(abs_weight_deltas - min_product_weight)
+            weight_distance = weight_distance / np.sqrt(weight_distance.sum(axis=1, keepdims=True))
+            inverse_distances = 1 / (weight_distance + np.abs(location_offset))
+            confidences = inverse_distances / inverse_distances.sum(axis=1, keepdims=True)
+            probabilities = multipliers * confidences * self.QTY_DECAY ** (qty - 1 + qty_remainder)
+
+        vendor_qty_multiplier = -1 if vendor else 1
+        return probabilities, qty.astype(int) * vendor_qty_multiplier
+
+def weight_distance_prediction_batch(self, products, relative_weight_locs, weight_deltas, confidence_multipliers=1.0, vendor=False) -> list[list[Candidate]]:
+        """
+        Vectorized weight_distance_prediction for many weight events against the same shelf products
+        Events are arrays of relative weight locations and weight deltas, products a list of product dicts or a ShelfArrays
+        Returns one list of candidates per event, identical to calling weight_distance_prediction on each event
+        """
+        probabilities, quantities = self.weight_distance_scores(products, relative_weight_locs, weight_deltas, confidence_multipliers, vendor)
+        product_list = list(products)
+        return [
+            [
+                Candidate(product=product, probability=probability, quantity=quantity)
+                for product, probability, quantity in zip(product_list, event_probabilities.tolist(), event_quantities.tolist())
+            ]
+            for event_probabilities, event_quantities in zip(probabilities, quantities)
+        ]
+
+def build_product_points(self, products:list, relative_weight_loc:float, abs_weight_delta:float) -> list:
+    """
+    Build the floor/ceil quantity data points at each product's closest boundary to the weight event
+    """
+    product_points = list()
+    for product in products:
+        data_points = []
+
+        dist_to_left_boundary = abs(relative_weight_loc - product["X_Left"])
+        dist_to_right_boundary = abs(relative_weight_loc - product["X_Right"])
+        
+        if dist_to_left_boundary <= dist_to_right_boundary:
+            closest_boundary = product["X_Left"]
+        else:
+            closest_boundary = product["X_Right"]
+        
+        product_weight = product["GrossWeight"]
+        if product_weight:
+            raw_quantity = abs_weight_delta / product_weight
+        else:
+            raw_quantity = 1
+            
+        if raw_quantity >= 1:  # Don't consider qty 0 
+            data_points.append((closest_boundary, product_weight * math.floor(raw_quantity)))
+        data_points.append((closest_boundary, product_weight * math.ceil(raw_quantity)))
+
+        product_points.append({"product": product, "datapoints": data_points})
+    return product_points
+
+def prune_products(self, products:list, relative_weight_loc:float, abs_weight_delta:float, product_index=None) -> list:
+    """
+    Keep only the products that calculate_2d_distance could possibly keep, using a bisect over products sorted by X_Left
+    The nearest products to relative_weight_loc give an upper bound U on the minimum 2D distance; any product entirely further than
+    MIN_DISTANCE_SCALAR * U along the shelf has a 2D distance above the cut-off, so it is dropped without computing its distances
+    The bisect needs a product_index built over this products list (see ProductIndex.covers), otherwise the same window is found with a linear scan
+    Falls back to all products when the window is empty or MIN_DISTANCE_SCALAR < 1
+    The kept products are returned in their order in products (not X_Left order), so ties and output order match the full scan
+    """
+    if not products or self.MIN_DISTANCE_SCALAR < 1:
+        return products
+    gondola_id, shelf_id = products[0]["gondola_id"], products[0]["shelf_id"]
+    if product_index is not None and not product_index.covers(gondola_id, shelf_id, products):
+        product_index = None
+    weight_event_point = (relative_weight_loc, abs_weight_delta)
+    if product_index is not None:
+        seeds = product_index.nearest_products(gondola_id, shelf_id, relative_weight_loc)
+    else:
+        before = [product for product in products if product["X_Left"] <= relative_weight_loc]
+        after = [product for product in products if product["X_Left"] > relative_weight_loc]
+        seeds = [product for product in before if product["X_Right"] >= relative_weight_loc]
+        if before:
+            seeds.append(max(before, key=lambda product: product["X_Left"]))
+        if after:
+            seeds.append(min(after, key=lambda product: product["X_Left"]))
+    seed_distances = [
+        min(math.dist(weight_event_point, point) for point in point_data["datapoints"])
+        for point_data in self.build_product_points(seeds, relative_weight_loc, abs_weight_delta)
+    ]
+    if not seed_distances:
+        return products
+    window = self.MIN_DISTANCE_SCALAR * min(seed_distances)
+    x_min, x_max = relative_weight_loc - window, relative_weight_loc + window
+    if product_index is not None:
+        pruned = product_index.in_shelf_order(product_index.products_in_window(gondola_id, shelf_id, x_min, x_max))
+    else:
+        pruned = [product for product in products if product["X_Right"] >= x_min and product["X_Left"] <= x_max]
+    return pruned if pruned else products
+
+def calculate_2d_distance_pruned(self, products:list, relative_weight_loc:float, weight_event:dict, product_index=None) -> tuple:
+    """
+    calculate_2d_distance restricted to the products returned by prune_products
+    final_candidates are identical to the full scan; tossed_candidates only include the products that were evaluated
+    Only exact for calculate_2d_distance's absolute cut-off: weight_distance_prediction (calculate_2d_distance_new) normalizes
+    confidences over every product on the shelf, so dropping far products there would change its probabilities
+    """
+    abs_weight_delta = abs(float(weight_event["weight_delta"]))
+    pruned = self.prune_products(products, relative_weight_loc, abs_weight_delta, product_index)
+    product_points = self.build_product_points(pruned, relative_weight_loc, abs_weight_delta)
+    return self.calculate_2d_distance((relative_weight_loc, abs_weight_delta), product_points)
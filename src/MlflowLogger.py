@@ -0,0 +1,193 @@
+import os
+import atexit
+import tempfile
+import time
+import uuid
+import orjson
+from os import getenv
+from queue import Queue, Empty
+from threading import Thread, Lock
+
+class MlflowLogger:
+    """
+    Non-blocking MLFlow logger: runs are queued and written by a background thread with one log_batch call each
+    Runs that cannot be written after retries are spooled to a local fallback directory and replayed later with replay_fallback()
+    """
+    def __init__(self, experiment_name:str=None, tracking_uri:str=None, fallback_dir:str=None, retries:int=None) -> None:
+        self.experiment_name = experiment_name or getenv("MLFLOW_EXPERIMENT", "Cart-Backtest-Demo")
+        self.tracking_uri = tracking_uri
+        self.fallback_dir = fallback_dir if fallback_dir is not None else getenv("MLFLOW_FALLBACK_DIR", os.path.join(tempfile.gettempdir(), "mlflow_fallback"))
+        self.retries = retries if retries is not None else int(getenv("MLFLOW_RETRIES", 3))
+        # Retries are handled here with a spool fallback, so keep mlflow's own HTTP retry loop short
+        os.environ.setdefault("MLFLOW_HTTP_REQUEST_MAX_RETRIES", "1")
+        os.environ.setdefault("MLFLOW_HTTP_REQUEST_TIMEOUT", "10")
+        self.queue = Queue()
+        self.thread = None
+        self.lock = Lock()
+        self.client = None
+        self.current = None
+        # Registered once, close() is a no-op while no worker thread is running
+        atexit.register(self.close)
+
+    def log_run(self, run_name:str, params:dict, metrics:dict) -> None:
+        '''
+        Queue one run with its params and metrics, returns immediately
+        '''
+        timestamp = int(time.time() * 1000)
+        run = {
+            "experiment_name" : self.experiment_name,
+            "run_name" : run_name,
+            "params" : {key : str(value) for key, value in params.items()},
+            "metrics" : {key : float(value) for key, value in metrics.items()},
+            "timestamp" : timestamp
+        }
+        self.start()
+        self.queue.put(run)
+
+    def start(self) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.worker, name="mlflow-logger", daemon=True)
+                self.thread.start()
+
+    def worker(self) -> None:
+        self.replay_fallback()
+        while True:
+            run = self.queue.get()
+            try:
+                if run is None:
+                    return
+                self.current = run
+                if not self.write_with_retry(run):
+                    self.spool(run)
+            finally:
+                self.current = None
+                self.queue.task_done()
+
+    def get_client(self):
+        # mlflow is slow to import, so it is only loaded by the background thread once something is logged
+        from mlflow.tracking import MlflowClient
+        if self.client is None:
+            self.client = MlflowClient(tracking_uri=self.tracking_uri)
+        return self.client
+
+    def get_experiment_id(self, experiment_name:str) -> str:
+        client = self.get_client()
+        experiment = client.get_experiment_by_name(experiment_name)
+        if experiment is None:
+            return client.create_experiment(experiment_name)
+        return experiment.experiment_id
+
+    def write(self, run:dict) -> None:
+        '''
+        Create the run and write all of its params and metrics with a single log_batch call
+        '''
+        from mlflow.entities import Metric, Param
+        client = self.get_client()
+        experiment_id = self.get_experiment_id(run["experiment_name"])
+        mlflow_run = client.create_run(experiment_id, run_name=run["run_name"], start_time=run["timestamp"])
+        run_id = mlflow_run.info.run_id
+        try:
+            client.log_batch(
+                run_id,
+                metrics=[Metric(key, value, run["timestamp"], 0) for key, value in run["metrics"].items()],
+                params=[Param(key, value) for key, value in run["params"].items()]
+            )
+        except Exception:
+            client.set_terminated(run_id, status="FAILED")
+            raise
+        client.set_terminated(run_id)
+
+    def write_with_retry(self, run:dict) -> bool:
+        for attempt in range(self.retries + 1):
+            try:
+                self.write(run)
+                return True
+            except Exception as e:
+                print(f"Failed to log MLFlow run {run['run_name']} (attempt {attempt + 1}): {e}")
+                # Drop the client so a reconnect happens on the next attempt
+                self.client = None
+                if attempt < self.retries:
+                    time.sleep(0.5 * 2 ** attempt)
+        return False
+
+    def spool(self, run:dict) -> None:
+        '''
+        Write a run to the fallback directory atomically so it can be replayed later
+        '''
+        if not self.fallback_dir:
+            print(f"Dropping MLFlow run {run['run_name']}, no fallback directory configured")
+            return
+        os.makedirs(self.fallback_dir, exist_ok=True)
+        path = os.path.join(self.fallback_dir, f"{run['timestamp']}-{uuid.uuid4().hex}.json")
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(orjson.dumps(run))
+            os.replace(tmp_path, path)
+            print(f"Spooled MLFlow run {run['run_name']} to {path}")
+        except OSError as e:
+            print(f"Failed to spool MLFlow run {run['run_name']}: {e}")
+
+    def replay_fallback(self) -> int:
+        '''
+        Write spooled runs to the tracking server in the order they were logged, removing each one once written
+        Returns how many runs were replayed
+        '''
+        if not self.fallback_dir or not os.path.isdir(self.fallback_dir):
+            return 0
+        replayed = 0
+        for name in sorted(os.listdir(self.fallback_dir)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.fallback_dir, name)
+            try:
+                with open(path, "rb") as f:
+                    run = orjson.loads(f.read())
+            except (OSError, orjson.JSONDecodeError) as e:
+                print(f"Skipping unreadable MLFlow fallback entry {path}: {e}")
+                continue
+            try:
+                self.write(run)
+            except Exception as e:
+                print(f"Tracking server still unavailable, keeping {len(os.listdir(self.fallback_dir))} spooled runs: {e}")
+                self.client = None
+                break
+            os.remove(path)
+            replayed += 1
+        return replayed
+
+    def flush(self, timeout:float=None) -> bool:
+        '''
+        Wait until every queued run has been written or spooled, returns False if timeout ran out first
+        '''
+        deadline = time.time() + timeout if timeout is not None else None
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout:float=None) -> None:
+        '''
+        Flush the queue and stop the background thread; runs still queued after timeout are spooled instead
+        '''
+        timeout = timeout if timeout is not None else float(getenv("MLFLOW_FLUSH_TIMEOUT", 30))
+        if self.thread is None:
+            return
+        if not self.flush(timeout):
+            # The run being written may never finish, spool it too (it can show up twice if the write does complete)
+            if self.current is not None:
+                self.spool(self.current)
+            while True:
+                try:
+                    run = self.queue.get_nowait()
+                except Empty:
+                    break
+                if run is not None:
+                    self.spool(run)
+                self.queue.task_done()
+        self.queue.put(None)
+        self.thread.join(timeout=1)
+        with self.lock:
+            self.thread = None
@@ -0,0 +1,120 @@
+import os
+import hashlib
+import tempfile
+import time
+import orjson
+from collections import OrderedDict
+from os import getenv
+from threading import Lock
+
+class PlanogramCache:
+    """
+    Two-tier planogram cache: an in-process LRU backed by an on-disk store
+    Entries are keyed by (smartSystemUId, realogram flag, time bucket) and expire after ttl seconds
+    Expired disk entries are pruned when the cache is created and after every prune_every writes, so the disk tier stays bounded
+    """
+    def __init__(self, cache_dir:str=None, max_entries:int=None, ttl:float=None, bucket_seconds:float=None, prune_every:int=None) -> None:
+        self.cache_dir = cache_dir if cache_dir is not None else getenv("PLANOGRAM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "planogram_cache"))
+        self.max_entries = max_entries if max_entries is not None else int(getenv("PLANOGRAM_CACHE_SIZE", 256))
+        self.ttl = ttl if ttl is not None else float(getenv("PLANOGRAM_CACHE_TTL", 86400))
+        self.bucket_seconds = bucket_seconds if bucket_seconds is not None else float(getenv("PLANOGRAM_CACHE_BUCKET_SECONDS", 3600))
+        self.prune_every = prune_every if prune_every is not None else int(getenv("PLANOGRAM_CACHE_PRUNE_EVERY", 100))
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.puts = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.prune()
+
+    def key(self, smartSystemUId:str, timestamp:str, realogram:bool=False, use_timestamp:bool=True) -> tuple:
+        '''
+        Build the cache key, bucketing the requested timestamp (or the current time for live planograms) into planogram epochs
+        '''
+        if use_timestamp:
+            bucket = int(float(timestamp) // self.bucket_seconds)
+        else:
+            bucket = f"live-{int(time.time() // self.bucket_seconds)}"
+        return (str(smartSystemUId), bool(realogram), bucket)
+
+    def path(self, key:tuple) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key:tuple) -> list:
+        '''
+        Return cached planogram records for key, checking memory first and then disk, or None on a miss
+        '''
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self.entries.move_to_end(key)
+                    return entry[1]
+                del self.entries[key]
+        if not self.cache_dir:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                stored = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        if now - stored["fetched_at"] > self.ttl:
+            self.remove_file(path)
+            return None
+        self.remember(key, stored["fetched_at"], stored["data"])
+        return stored["data"]
+
+    def put(self, key:tuple, data:list) -> None:
+        '''
+        Store planogram records in both tiers, writing the disk entry atomically
+        '''
+        fetched_at = time.time()
+        self.remember(key, fetched_at, data)
+        if not self.cache_dir:
+            return
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(orjson.dumps({"key": list(key), "fetched_at": fetched_at, "data": data}))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to write planogram cache entry {path}: {e}")
+            self.remove_file(tmp_path)
+        with self.lock:
+            self.puts += 1
+            due = self.prune_every > 0 and self.puts % self.prune_every == 0
+        if due:
+            self.prune()
+
+    def remember(self, key:tuple, fetched_at:float, data:list) -> None:
+        with self.lock:
+            self.entries[key] = (fetched_at, data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def prune(self) -> int:
+        '''
+        Delete expired entries from disk, returns how many were removed
+        '''
+        if not self.cache_dir:
+            return 0
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def remove_file(self, path:str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
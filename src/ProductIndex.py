@@ -0,0 +1,80 @@
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+class ProductIndex:
+    """
+    Lookup indexes over a class_info map, built once per class_info
+    UPC and (gondola, UPC) lookups are dict hits; position lookups binary search per-shelf boundaries sorted by X_Left
+    """
+    def __init__(self, class_info:dict) -> None:
+        self.by_upc = dict()
+        self.by_gondola_upc = dict()
+        self.shelves = dict()
+        # Position of every product in its class_info shelf list, to hand position lookups back in class_info order
+        self.positions = dict()
+        # The class_info list each shelf was built from, so callers can tell whether the index covers the products they hold
+        self.sources = dict()
+        for (gondola_id, shelf_id), shelf_products in class_info.items():
+            self.sources[(gondola_id, shelf_id)] = shelf_products
+            products = list(shelf_products)
+            for i, product in enumerate(products):
+                self.positions[id(product)] = i
+            for product in products:
+                # First match wins, same as a linear scan over class_info
+                self.by_upc.setdefault(product["Upc"], product)
+                self.by_gondola_upc.setdefault((gondola_id, product["Upc"]), product)
+            products = sorted(products, key=lambda product: product["X_Left"])
+            lefts = [product["X_Left"] for product in products]
+            rights = [product["X_Right"] for product in products]
+            # Running max of right boundaries lets overlapping facings be found with a single bisect
+            max_rights = list(accumulate(rights, max))
+            self.shelves[(gondola_id, shelf_id)] = (products, lefts, rights, max_rights)
+
+    def covers(self, gondola_id, shelf_id, products:list) -> bool:
+        '''
+        Whether the shelf was indexed from exactly this products list
+        '''
+        return self.sources.get((gondola_id, shelf_id)) is products
+
+    def find_by_upc(self, upc) -> dict:
+        return self.by_upc.get(upc)
+
+    def find_by_gondola_upc(self, gondola_id, upc) -> dict:
+        return self.by_gondola_upc.get((gondola_id, upc))
+
+    def products_in_window(self, gondola_id, shelf_id, x_min:float, x_max:float) -> list:
+        '''
+        Products on a shelf whose [X_Left, X_Right] span overlaps [x_min, x_max], in X_Left order
+        '''
+        if (gondola_id, shelf_id) not in self.shelves:
+            return list()
+        products, lefts, rights, max_rights = self.shelves[(gondola_id, shelf_id)]
+        start = bisect_left(max_rights, x_min)
+        stop = bisect_right(lefts, x_max)
+        return [products[i] for i in range(start, stop) if rights[i] >= x_min]
+
+    def in_shelf_order(self, products:list) -> list:
+        '''
+        Products returned by a position lookup, back in the order of their class_info shelf list
+        '''
+        return sorted(products, key=lambda product: self.positions[id(product)])
+
+    def nearest_products(self, gondola_id, shelf_id, x:float) -> list:
+        '''
+        Products covering x plus the closest product starting at or before x and the first product starting after it
+        '''
+        if (gondola_id, shelf_id) not in self.shelves:
+            return list()
+        products, lefts, rights, max_rights = self.shelves[(gondola_id, shelf_id)]
+        nearest = self.products_in_window(gondola_id, shelf_id, x, x)
+        i = bisect_right(lefts, x)
+        for j in (i - 1, i):
+            if 0 <= j < len(products) and not any(products[j] is product for product in nearest):
+                nearest.append(products[j])
+        return nearest
+
+    def products_at(self, gondola_id, shelf_id, x:float) -> list:
+        '''
+        Products on a shelf that cover position x
+        '''
+        return self.products_in_window(gondola_id, shelf_id, x, x)
@@ -4,49 +4,105 @@ import base64
 import hashlib
 import hmac
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from os import getenv
+from requests.adapters import HTTPAdapter
+from PlanogramCache import PlanogramCache
+from ShelfArrays import ShelfArrays
+from ProductIndex import ProductIndex
+from SharedCache import SharedCache
+from Telemetry import ERRORS, span, timed
 
 class ProductMapper:
-    def __init__(self) -> None:
+    def __init__(self, planogram_cache:PlanogramCache=None, use_cache:bool=True, shared_cache:SharedCache=None) -> None:
         self.scale = 1/12 # inch to feet ratio
+        # Planograms change rarely, so repeat lookups within the same epoch are served from memory/disk
+        self.planogram_cache = (planogram_cache or PlanogramCache()) if use_cache else None
+        # Optional Redis cache shared across pods (REDIS_ADDRESS), so each planogram epoch is downloaded once cluster-wide
+        self.shared_cache = (shared_cache or SharedCache.from_env()) if use_cache else None
+        self.shared_cache_ttl = float(getenv("REDIS_PLANOGRAM_TTL", 86400))
+        # Shared keep-alive session so concurrent planogram downloads reuse connections
+        self.max_workers = int(getenv("PLANOGRAM_WORKERS", 8))
+        self.timeout = float(getenv("PLANOGRAM_TIMEOUT", 30))
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.max_workers)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        # Lookup indexes for the most recently built class_info, built on the first lookup
+        self.product_index = None
+        self.indexed_class_info = None
+        # Indexes for class_info dicts passed in by callers, by dict identity, so they never replace the indexes above
+        self.foreign_indexes = OrderedDict()
+        self.foreign_index_limit = int(getenv("PRODUCT_INDEX_CACHE_SIZE", 8))
         
-    def get_class_info(self, shelf_info:dict, timestamp:str, use_realogram:bool=False, use_timestamp:bool=True) -> list:
+    def get_class_info(self, shelf_info:dict, timestamp:str, use_realogram:bool=False, use_timestamp:bool=True, allow_partial:bool=False) -> list:
         '''
         Begin process of aggregating and sorting class info according to planogram/realogram at specified time
+        With allow_partial, systems whose planogram could not be fetched are left out instead of failing the whole store
         '''
-        unique_system_id = shelf_info.keys()
-        raw_product_data = dict()
-        for system_id in unique_system_id:
-            raw_product_data[system_id] = self.getPlanogram(system_id, timestamp, use_realogram, use_timestamp) # This looks good to go
-            if raw_product_data[system_id] is None:
-                print(f"Failed to get product mapper data for {system_id}")
+        with span("get_class_info", systems=len(shelf_info), timestamp=str(timestamp)):
+            raw_product_data, errors = self.fetch_planograms(list(shelf_info.keys()), timestamp, use_realogram, use_timestamp)
+            for system_id, error in errors.items():
+                print(f"Failed to get product mapper data for {system_id}: {error}")
+            if errors and not allow_partial:
                 return
-        dataMapped = self.dataMapping(shelf_info, raw_product_data)
-        class_info = self.sort_class_info(dataMapped)
-        return class_info
+            dataMapped = self.dataMapping(shelf_info, raw_product_data)
+            class_info = self.sort_class_info(dataMapped)
+            self.set_class_info(class_info)
+            return class_info
+
+    def fetch_planograms(self, system_ids:list, timestamp:str, use_realogram:bool=False, use_timestamp:bool=True) -> tuple:
+        '''
+        Fetch planograms for all smart systems in parallel
+        Returns (system_id -> records for the systems that succeeded, system_id -> error message for those that failed)
+        '''
+        def fetch(system_id):
+            try:
+                data = self.getPlanogram(system_id, timestamp, use_realogram, use_timestamp)
+            except Exception as e:
+                return None, str(e)
+            return data, None if data is not None else "no planogram returned"
+
+        raw_product_data, errors = dict(), dict()
+        if not system_ids:
+            return raw_product_data, errors
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(system_ids))) as executor:
+            for system_id, (data, error) in zip(system_ids, executor.map(fetch, system_ids)):
+                if error is None:
+                    raw_product_data[system_id] = data
+                else:
+                    errors[system_id] = error
+        return raw_product_data, errors
 
     def sort_class_info(self, class_info:list) -> list:
         '''
         Re-organize class info once it has been mapped by dataMapping()
+        Stable sort by X so products sharing an X position are all kept
         '''
         for (gondola_id, shelf_id) in class_info:
-            products = class_info[(gondola_id, shelf_id)]
-            x_hash = dict()
-            for i,product in enumerate(products):
-                x_hash[product['X']] = i
-            new_products = []
-            sorted_x = sorted(x_hash.keys())
-            for x in sorted_x:
-                new_products.append(products[x_hash[x]])
-            class_info[(gondola_id, shelf_id)] = new_products
+            class_info[(gondola_id, shelf_id)] = sorted(class_info[(gondola_id, shelf_id)], key=lambda product: product['X'])
         return class_info
 
+    def shelf_geometry(self, shelf_data:dict) -> tuple:
+        '''
+        Parse shelf front-left origin, height, width and unit direction vector from shelf info
+        '''
+        x_front_left = float(shelf_data['x_front_left'])
+        y_front_left = float(shelf_data['y_front_left'])
+        deltax = float(shelf_data['x_front_right']) - x_front_left
+        deltay = float(shelf_data['y_front_right']) - y_front_left
+        dis = (deltax**2 + deltay**2) ** 0.5
+        shelf_vec = [deltax/dis, deltay/dis]
+        return x_front_left, y_front_left, float(shelf_data['height']), dis, shelf_vec
+
     def dataMapping(self, shelf_info:dict, raw_product_data:list) -> dict:
         '''
         Combine shelf info with raw product data into parseable format
         '''
         class_info = dict()
+        geometry_cache = dict()
         for system_id in raw_product_data:
             system_data = raw_product_data[system_id]
             for product_data in system_data:
@@ -86,14 +142,13 @@ class ProductMapper:
                 else:
                     product['Depth'] = float(product_data['depth']) * self.scale
                 
-                # product locational info
-                deltax = float(shelf_data['x_front_right']) - float(shelf_data['x_front_left'])
-                deltay = float(shelf_data['y_front_right']) - float(shelf_data['y_front_left'])
-                dis = (deltax**2 + deltay**2) ** 0.5
-                shelf_vec = [deltax/dis, deltay/dis]
-                product['X_3D'] = float(shelf_data['x_front_left']) + shelf_vec[0] * product_data['x'] * self.scale
-                product['Y_3D'] = float(shelf_data['y_front_left']) + shelf_vec[1] * product_data['x'] * self.scale
-                product['Z_3D'] = float(shelf_data['height'])
+                # product locational info, shelf geometry only depends on the shelf so it is parsed once
+                if id(shelf_data) not in geometry_cache:
+                    geometry_cache[id(shelf_data)] = self.shelf_geometry(shelf_data)
+                x_front_left, y_front_left, height, dis, shelf_vec = geometry_cache[id(shelf_data)]
+                product['X_3D'] = x_front_left + shelf_vec[0] * product_data['x'] * self.scale
+                product['Y_3D'] = y_front_left + shelf_vec[1] * product_data['x'] * self.scale
+                product['Z_3D'] = height
                 product['Adjusted_x'] = shelf_vec[0] * float(product_data['widthOnShelf']) * self.scale
                 product['Adjusted_y'] = shelf_vec[1] * float(product_data['widthOnShelf']) * self.scale
 
@@ -109,7 +164,69 @@ class ProductMapper:
                 class_info[(gondola_id, shelf_id)].append(product)
         return class_info
 
+    def get_class_arrays(self, shelf_info:dict, timestamp:str, use_realogram:bool=False, use_timestamp:bool=True, allow_partial:bool=False) -> dict:
+        '''
+        Same as get_class_info, but returns one X-sorted ShelfArrays per (gondola_id, shelf_id) instead of lists of product dicts
+        '''
+        raw_product_data, errors = self.fetch_planograms(list(shelf_info.keys()), timestamp, use_realogram, use_timestamp)
+        for system_id, error in errors.items():
+            print(f"Failed to get product mapper data for {system_id}: {error}")
+        if errors and not allow_partial:
+            return
+        class_arrays = self.dataMappingArrays(shelf_info, raw_product_data)
+        self.set_class_info(class_arrays)
+        return class_arrays
+
+    def dataMappingArrays(self, shelf_info:dict, raw_product_data:dict) -> dict:
+        '''
+        Struct-of-arrays version of dataMapping(): group raw products by shelf and build one ShelfArrays per shelf
+        '''
+        shelf_records = dict()
+        for system_id in raw_product_data:
+            for product_data in raw_product_data[system_id]:
+                shelf_data = shelf_info[system_id][str(product_data['frictionlessGondolaId'])][str(product_data['shelf'])]
+                key = (int(shelf_data['gondola_id']), int(shelf_data['shelf']))
+                if key not in shelf_records:
+                    shelf_records[key] = (system_id, shelf_data, [])
+                shelf_records[key][2].append(product_data)
+        return {
+            key : ShelfArrays.from_records(key[0], key[1], system_id, shelf_data, records, self.shelf_geometry(shelf_data), self.scale)
+            for key, (system_id, shelf_data, records) in shelf_records.items()
+        }
+
+    def planogram_epoch(self, timestamp:str) -> int:
+        '''
+        Planogram time bucket a timestamp falls in, the same bucketing the planogram cache keys on
+        '''
+        bucket_seconds = self.planogram_cache.bucket_seconds if self.planogram_cache is not None else float(getenv("PLANOGRAM_CACHE_BUCKET_SECONDS", 3600))
+        return int(float(timestamp) // bucket_seconds)
+
     def getPlanogram(self, smartSystemUId:str, timestamp:str, realogram:bool=False, use_timestamp:bool=True) -> list:
+        """
+        Get planogram for specified Smart System ID, serving it from the planogram cache when the same epoch was already downloaded
+        Misses go through the shared cache when one is configured before hitting the planogram API
+        """
+        if self.planogram_cache is None:
+            return self.fetchPlanogram(smartSystemUId, timestamp, realogram, use_timestamp)
+        key = self.planogram_cache.key(smartSystemUId, timestamp, realogram, use_timestamp)
+        data = self.planogram_cache.get(key)
+        if data is None:
+            data = self.fetchPlanogram(smartSystemUId, timestamp, realogram, use_timestamp)
+            if data is not None:
+                self.planogram_cache.put(key, data)
+        return data
+
+    def fetchPlanogram(self, smartSystemUId:str, timestamp:str, realogram:bool=False, use_timestamp:bool=True) -> list:
+        """
+        Download a planogram, single-flighted through the shared cache under its system, kind and planogram epoch when one is configured
+        """
+        if self.shared_cache is None:
+            return self.downloadPlanogram(smartSystemUId, timestamp, realogram, use_timestamp)
+        bucket = self.planogram_epoch(timestamp) if use_timestamp else f"live-{self.planogram_epoch(time.time())}"
+        key = self.shared_cache.key("planogram", smartSystemUId, "realogram" if realogram else "planogram", bucket)
+        return self.shared_cache.get_or_fetch(key, lambda: self.downloadPlanogram(smartSystemUId, timestamp, realogram, use_timestamp), self.shared_cache_ttl)
+
+    def downloadPlanogram(self, smartSystemUId:str, timestamp:str, realogram:bool=False, use_timestamp:bool=True) -> list:
         """
         Hit Fullstack API endpoint to download planogram for specified Smart System ID. Timestamp argument gives historical planogram (planogram config at specified time), while realogram bool toggles whether planogram or realogram is returned
         """
@@ -125,17 +242,9 @@ class ProductMapper:
         if realogram:
             query_string += "&realogram=true"
         
-        requestDate = int(time.time())
-        apiKey = getenv("PLANOGRAM_API_ACCESS_KEY")
-        secretKey = getenv("PLANOGRAM_API_SECRET_KEY")
-        hashMessage = method.lower() + uri.lower() + query_string.lower().replace("?","").replace("=","").replace("&",",") + str(requestDate) + apiKey
-        message = bytes(hashMessage, 'utf-8')
-        secret = bytes(secretKey, 'utf-8')
-
-        hash = hmac.new(secret, message, hashlib.sha256)
-        signature = base64.b64encode(hash.digest()).decode('utf-8')
-        authorizationHeaders = apiKey + "," + str(requestDate) + "," + signature
-        r = requests.get(url = API_ENDPOINT + uri + query_string, headers={"Authorization" : authorizationHeaders})
+        authorizationHeaders = self.signRequest(method, uri, query_string)
+        with timed("planogram"):
+            r = self.http.get(url = API_ENDPOINT + uri + query_string, headers={"Authorization" : authorizationHeaders}, timeout=self.timeout)
         if r.status_code == 200:
             records = json.loads(r.text)
             data = []
@@ -144,17 +253,85 @@ class ProductMapper:
             return data
         else:
             print(f"Error downloading planogram/realogram with status code {r.status_code} and info {r.text}")
+            ERRORS.labels("planogram", "").inc()
             return None
         
+    def signRequest(self, method:str, uri:str, query_string:str) -> str:
+        """
+        Build the HMAC-SHA256 Authorization header value for a planogram API request
+        """
+        requestDate = int(time.time())
+        apiKey = getenv("PLANOGRAM_API_ACCESS_KEY")
+        secretKey = getenv("PLANOGRAM_API_SECRET_KEY")
+        hashMessage = method.lower() + uri.lower() + query_string.lower().replace("?","").replace("=","").replace("&",",") + str(requestDate) + apiKey
+        message = bytes(hashMessage, 'utf-8')
+        secret = bytes(secretKey, 'utf-8')
+
+        hash = hmac.new(secret, message, hashlib.sha256)
+        signature = base64.b64encode(hash.digest()).decode('utf-8')
+        return apiKey + "," + str(requestDate) + "," + signature
+
+    def set_class_info(self, class_info:dict) -> None:
+        """
+        Make class_info the default for lookups; its indexes are only built on the first lookup, so building class info stays cheap
+        """
+        if class_info is not self.indexed_class_info:
+            self.product_index = None
+            self.indexed_class_info = class_info
+
+    def index_class_info(self, class_info:dict) -> ProductIndex:
+        """
+        Return the lookup indexes for class_info, building them only when class_info changes
+        """
+        self.set_class_info(class_info)
+        return self.index_for()
+
+    def index_for(self, class_info:dict=None) -> ProductIndex:
+        """
+        Lookup indexes for class_info without touching the last class_info built, defaulting to that one
+        Indexes of other dicts are kept for the most recent few, keyed by identity (the dict is held too, so its id is not reused)
+        """
+        if class_info is None or class_info is self.indexed_class_info:
+            if self.product_index is None and self.indexed_class_info is not None:
+                self.product_index = ProductIndex(self.indexed_class_info)
+            return self.product_index
+        entry = self.foreign_indexes.get(id(class_info))
+        if entry is not None and entry[0] is class_info:
+            self.foreign_indexes.move_to_end(id(class_info))
+            return entry[1]
+        index = ProductIndex(class_info)
+        self.foreign_indexes[id(class_info)] = (class_info, index)
+        while len(self.foreign_indexes) > self.foreign_index_limit:
+            self.foreign_indexes.popitem(last=False)
+        return index
+
+    def find_by_upc(self, product_upc, class_info:dict=None) -> dict:
+        """
+        Find a product anywhere in the store by UPC, defaulting to the last class_info built
+        """
+        index = self.index_for(class_info)
+        return index.find_by_upc(product_upc) if index is not None else None
+
+    def find_by_gondola_upc(self, gondola, product_upc, class_info:dict=None) -> dict:
+        """
+        Find a product by UPC on a specific gondola, defaulting to the last class_info built
+        """
+        index = self.index_for(class_info)
+        return index.find_by_gondola_upc(gondola, product_upc) if index is not None else None
+
+    def products_at(self, gondola, shelf, x:float, class_info:dict=None) -> list:
+        """
+        Find the products whose X_Left/X_Right boundaries cover position x on a shelf
+        """
+        index = self.index_for(class_info)
+        return index.products_at(gondola, shelf, x) if index is not None else list()
+
     def lookup_by_upc(self, product_upc, product_mapper, gondola):
         """
         Helper function used to locate specific product via UPC in product mapper data struct
         Not used by anything crucial
         """
-        for location in product_mapper.keys():
-            if location[0] == gondola:
-                for item in product_mapper[location]:
-                    if item["Upc"] == product_upc:
-                        return item
-        print(f"Item not found")
-        return None
+        item = self.find_by_gondola_upc(gondola, product_upc, product_mapper)
+        if item is None:
+            print(f"Item not found")
+        return item
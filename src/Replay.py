@@ -0,0 +1,205 @@
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from os import getenv
+import Learn
+from Scoring import ScoreAccumulator
+from SessionLoader import prediction_shelf
+from ShelfGeometry import ShelfGeometry
+
+DEFAULT_HYPERPARAMETERS = {
+    "QTY_DECAY" : 0.7,
+    "MIN_DISTANCE_SCALAR" : 2.0,
+    "MIN_WEIGHT_THRESHOLD_MULTIPLIER" : 0.5,
+    "CONFIDENCE_MULTIPLIER" : 1.0
+}
+
+class ReplayPredictor:
+    """
+    In-process host for the Learn prediction functions, configured from a hyperparameter dict instead of a deployed cart-analyzer
+    """
+    location_prediction = Learn.location_prediction
+    weight_distance_prediction = Learn.weight_distance_prediction
+    build_product_points = Learn.build_product_points
+    calculate_2d_distance_new = Learn.calculate_2d_distance_new
+
+    def __init__(self, config:dict, shelf_infos:dict, shelf_geometry:ShelfGeometry=None) -> None:
+        hyperparameters = {**DEFAULT_HYPERPARAMETERS, **config}
+        self.QTY_DECAY = float(hyperparameters["QTY_DECAY"])
+        self.MIN_DISTANCE_SCALAR = float(hyperparameters["MIN_DISTANCE_SCALAR"])
+        self.MIN_WEIGHT_THRESHOLD_MULTIPLIER = float(hyperparameters["MIN_WEIGHT_THRESHOLD_MULTIPLIER"])
+        self.confidence_multiplier = float(hyperparameters["CONFIDENCE_MULTIPLIER"])
+        self.shelf_infos = shelf_infos
+        self.shelf_geometry = shelf_geometry or ShelfGeometry(shelf_infos)
+        self.logging = logging.getLogger("replay")
+
+    def handle_putback(self, current_cart:dict, relative_weight_loc:float, weight:float, location:tuple, pmap:dict, confidence_multiplier:float, vendor:bool=False) -> list:
+        '''
+        Score a putback against the cart products from this shelf (or the whole shelf when none are in the cart), returning negative quantities
+        '''
+        shelf_products = pmap.get(location, list())
+        cart_upcs = {upc for upc, entry in current_cart.items() if entry["quantity"] > 0}
+        products = [product for product in shelf_products if product["Upc"] in cart_upcs] or shelf_products
+        if not products:
+            return list()
+        return self.weight_distance_prediction(products, relative_weight_loc, {"weight_delta": weight}, confidence_multiplier, vendor=True)
+
+    def predict_session(self, inputs:dict, class_info:dict) -> dict:
+        '''
+        Replay every weight event of a session through location_prediction against the session's stored product map (see stored_class_info)
+        Returns the predicted cart as (gondola_id, shelf_id, shelf_location) -> quantity, shelf_location being the 1-based position of the product
+        on its shelf in X order, the field reviewed carts are labelled with (see main.postprocess_cart)
+        '''
+        current_cart = dict()
+        for prediction in inputs["predictions"]:
+            shelf = prediction_shelf(prediction)
+            store_id = prediction.get("store_id")
+            if shelf is None or store_id not in self.shelf_infos or not class_info.get(shelf):
+                continue
+            weight_event = {"weight_delta": float(prediction["sample_value"]), "xlocation": prediction["weight_location_x"]}
+            candidates = self.location_prediction(class_info[shelf], weight_event, current_cart, shelf, class_info, store_id, self.confidence_multiplier)
+            if not candidates:
+                continue
+            best = max(candidates, key=lambda candidate: candidate.probability)
+            entry = current_cart.setdefault(best.product["Upc"], {"product": best.product, "location": shelf + (shelf_location(class_info[shelf], best.product),), "quantity": 0})
+            entry["quantity"] += best.quantity
+        predicted_cart = dict()
+        for entry in current_cart.values():
+            if entry["quantity"] > 0:
+                predicted_cart[entry["location"]] = predicted_cart.get(entry["location"], 0) + entry["quantity"]
+        return predicted_cart
+
+def stored_class_info(products) -> dict:
+    '''
+    Class info (gondola_id, shelf_id) -> X-sorted product dicts from the product map stored with a session's predictions (inputs["products"]),
+    either a list of dataMapping() product dicts or a JSON object of such lists per shelf
+    Raises ValueError when the session has no stored product map, so it is never replayed against a planogram fetched later
+    '''
+    if isinstance(products, dict):
+        products = [product for shelf_products in products.values() for product in shelf_products]
+    if not products:
+        raise ValueError("Session has no stored product map")
+    class_info = dict()
+    for product in products:
+        key = (int(product["gondola_id"]), int(product.get("shelf_id", product.get("shelf"))))
+        class_info.setdefault(key, list()).append(product)
+    # Same stable X order as ProductMapper.sort_class_info
+    return {key : sorted(shelf_products, key=lambda product: product.get("X", product["X_Left"])) for key, shelf_products in class_info.items()}
+
+def shelf_location(shelf_products:list, product:dict) -> int:
+    '''
+    1-based position of a product among its shelf's X-sorted class_info products
+    '''
+    for i, shelf_product in enumerate(shelf_products):
+        if shelf_product is product:
+            return i + 1
+    for i, shelf_product in enumerate(shelf_products):
+        if shelf_product["Upc"] == product["Upc"]:
+            return i + 1
+    raise ValueError(f"Product {product['Upc']} is not on its shelf's class info")
+
+def reviewed_location(item:dict) -> tuple:
+    '''
+    (gondola_id, shelf_id, shelf_location) of a reviewed cart item, the key predicted carts use
+    Raises ValueError when a location field is missing rather than scoring the item under a placeholder key
+    '''
+    gondola_id = item.get("gondola_id")
+    shelf_id = item.get("shelf_id", item.get("shelf"))
+    if gondola_id is None or shelf_id is None or item.get("shelf_location") is None:
+        raise ValueError(f"Reviewed cart item has no gondola_id, shelf or shelf_location: {item}")
+    return (int(gondola_id), int(shelf_id), int(item["shelf_location"]))
+
+def score_cart(predicted_cart:dict, reviewed_cart:dict) -> dict:
+    '''
+    Compare a predicted cart ((gondola_id, shelf_id, shelf_location) -> quantity) against the reviewed cart item by item location,
+    producing the same fields the result store keeps for cart-metrics verdicts
+    '''
+    reviewed = dict()
+    for item in reviewed_cart.get("cart", list()):
+        location = reviewed_location(item)
+        reviewed[location] = reviewed.get(location, 0) + int(item["quantity"])
+    num_fn = sum(max(0, quantity - predicted_cart.get(location, 0)) for location, quantity in reviewed.items())
+    num_fp = sum(max(0, quantity - reviewed.get(location, 0)) for location, quantity in predicted_cart.items())
+    prediction_tags = list()
+    if num_fn > 0:
+        prediction_tags.append("false-negative")
+    if num_fp > 0:
+        prediction_tags.append("false-positive")
+    return {"is_correct": num_fn == 0 and num_fp == 0, "num_fn": num_fn, "num_fp": num_fp, "prediction_tags": prediction_tags}
+
+# Per-process state for pool workers, set once by init_worker
+worker_state = dict()
+
+def init_worker(shelf_infos:dict, configs:dict, session_tags:list, prediction_tags:list) -> None:
+    shelf_geometry = ShelfGeometry(shelf_infos)
+    worker_state["predictors"] = {version : ReplayPredictor(config, shelf_infos, shelf_geometry) for version, config in configs.items()}
+    worker_state["session_tags"] = session_tags
+    worker_state["prediction_tags"] = prediction_tags
+
+def replay_chunk(sessions:list) -> ScoreAccumulator:
+    '''
+    Replay a chunk of (session_id, inputs, reviewed_cart, session_tags) for every configured version, returning a partial accumulator
+    '''
+    predictors = worker_state["predictors"]
+    accumulator = ScoreAccumulator(list(predictors.keys()), worker_state["session_tags"], worker_state["prediction_tags"])
+    for session_id, inputs, reviewed_cart, session_tags in sessions:
+        try:
+            class_info = stored_class_info(inputs.get("products"))
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Failed to replay {session_id}: {e}")
+            continue
+        for version, predictor in predictors.items():
+            try:
+                predicted_cart = predictor.predict_session(inputs, class_info)
+                result = score_cart(predicted_cart, reviewed_cart)
+            except Exception as e:
+                print(f"Failed to replay {session_id} for {version}: {e}")
+                continue
+            accumulator.update(version, result["is_correct"], session_tags, result["prediction_tags"])
+    return accumulator
+
+class ReplayBacktester:
+    """
+    Offline backtester: replays stored weight events through the Learn prediction functions in a process pool and scores them against reviewed carts locally
+    Each session is replayed against the product map stored with its predictions, so no planogram, cart-analyzer or cart-metrics request is made
+    Produces the same version_results structure as Backtester.backtest_all_sessions without calling cart-analyzer or cart-metrics
+    """
+    def __init__(self, shelf_infos:dict, session_tags:list=(), prediction_tags:list=(), max_workers:int=None, chunk_size:int=50) -> None:
+        self.shelf_infos = shelf_infos
+        self.session_tags = list(session_tags)
+        self.prediction_tags = list(prediction_tags)
+        self.max_workers = max_workers or int(getenv("REPLAY_WORKERS", 4))
+        self.chunk_size = chunk_size
+
+    def chunks(self, session_stream, all_session_tags:dict):
+        chunk = list()
+        for session_id, inputs, reviewed_cart in session_stream:
+            chunk.append((session_id, inputs, reviewed_cart, all_session_tags.get(session_id)))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = list()
+        if chunk:
+            yield chunk
+
+    def run(self, session_stream, configs:dict, all_session_tags:dict=None) -> dict:
+        '''
+        Replay a SessionLoader stream for each version -> config in configs and return version_results
+        '''
+        all_session_tags = all_session_tags or dict()
+        accumulator = ScoreAccumulator(list(configs.keys()), self.session_tags, self.prediction_tags)
+        init_args = (self.shelf_infos, configs, self.session_tags, self.prediction_tags)
+        if self.max_workers > 1:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker, initargs=init_args) as executor:
+                # Keep a bounded number of chunks in flight so the session stream is not materialized
+                in_flight = deque()
+                for chunk in self.chunks(session_stream, all_session_tags):
+                    in_flight.append(executor.submit(replay_chunk, chunk))
+                    if len(in_flight) >= self.max_workers * 2:
+                        accumulator.merge(in_flight.popleft().result())
+                while in_flight:
+                    accumulator.merge(in_flight.popleft().result())
+        else:
+            init_worker(*init_args)
+            for chunk in self.chunks(session_stream, all_session_tags):
+                accumulator.merge(replay_chunk(chunk))
+        return accumulator.to_version_results()
@@ -0,0 +1,117 @@
+import sqlite3
+from json import dumps, loads
+from threading import Lock
+
+class ResultStore:
+    """
+    Local SQLite store of backtest verdicts keyed by (session_id, cart_version)
+    Lets backtest runs skip pairs that were already scored and resume after an interruption
+    """
+    def __init__(self, path:str, commit_every:int=100) -> None:
+        self.path = path
+        self.commit_every = commit_every
+        self.pending = 0
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS backtest_results (
+                session_id TEXT NOT NULL,
+                cart_version TEXT NOT NULL,
+                is_correct INTEGER NOT NULL,
+                num_fn INTEGER NOT NULL,
+                num_fp INTEGER NOT NULL,
+                prediction_tags TEXT NOT NULL,
+                PRIMARY KEY (session_id, cart_version)
+            )
+            """
+        )
+        self.connection.commit()
+
+    def load(self, cart_versions:list) -> dict:
+        '''
+        Load every stored result for the given cart versions as session_id -> {version: result}
+        '''
+        results = dict()
+        if not cart_versions:
+            return results
+        placeholders = ", ".join(["?"] * len(cart_versions))
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT session_id, cart_version, is_correct, num_fn, num_fp, prediction_tags FROM backtest_results WHERE cart_version IN ({placeholders})",
+                list(cart_versions)
+            ).fetchall()
+        for session, version, is_correct, num_fn, num_fp, prediction_tags in rows:
+            results.setdefault(session, dict())[version] = {
+                "is_correct" : bool(is_correct),
+                "num_fn" : num_fn,
+                "num_fp" : num_fp,
+                "prediction_tags" : loads(prediction_tags)
+            }
+        return results
+
+    def get(self, session:str, version:str) -> dict:
+        '''
+        Look up a single stored result, returns None if the pair has not been scored yet
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT is_correct, num_fn, num_fp, prediction_tags FROM backtest_results WHERE session_id=? AND cart_version=?",
+                (session, version)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "is_correct" : bool(row[0]),
+            "num_fn" : row[1],
+            "num_fp" : row[2],
+            "prediction_tags" : loads(row[3])
+        }
+
+    def put(self, session:str, version:str, result:dict) -> None:
+        '''
+        Insert or replace the result for a (session, version) pair, committing every commit_every writes
+        '''
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO backtest_results VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    session,
+                    version,
+                    int(result["is_correct"]),
+                    int(result.get("num_fn", 0)),
+                    int(result.get("num_fp", 0)),
+                    dumps(result.get("prediction_tags", list()))
+                )
+            )
+            self.pending += 1
+            if self.pending >= self.commit_every:
+                self.connection.commit()
+                self.pending = 0
+
+    def invalidate(self, sessions:list, versions:list=None, chunk_size:int=500) -> int:
+        '''
+        Delete the stored results of the given sessions for the given cart versions (every version by default), returns how many were removed
+        '''
+        sessions = list(sessions)
+        versions = list(versions) if versions is not None else None
+        version_filter = f" AND cart_version IN ({', '.join(['?'] * len(versions))})" if versions is not None else ""
+        removed = 0
+        with self.lock:
+            for i in range(0, len(sessions), chunk_size):
+                chunk = sessions[i:i + chunk_size]
+                placeholders = ", ".join(["?"] * len(chunk))
+                removed += self.connection.execute(f"DELETE FROM backtest_results WHERE session_id IN ({placeholders}){version_filter}", chunk + (versions or [])).rowcount
+            self.connection.commit()
+            self.pending = 0
+        return removed
+
+    def flush(self) -> None:
+        with self.lock:
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,237 @@
+from math import ceil, exp, lgamma, log, sqrt
+from random import Random
+from statistics import NormalDist
+from Scoring import normalize_tags
+
+def z_score(alpha:float) -> float:
+    '''
+    Two-sided normal critical value for significance level alpha
+    '''
+    return NormalDist().inv_cdf(1 - alpha / 2)
+
+def wilson_interval(correct:int, total:int, alpha:float=0.05) -> tuple:
+    '''
+    Wilson score interval for a binomial proportion, (0, 1) when there are no observations
+    '''
+    if total <= 0:
+        return 0.0, 1.0
+    z = z_score(alpha)
+    p = correct / total
+    center = (p + z * z / (2 * total)) / (1 + z * z / total)
+    half_width = z * sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / (1 + z * z / total)
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+def mcnemar_p_value(only_a:int, only_b:int) -> float:
+    '''
+    Exact two-sided McNemar test on the discordant pairs: sessions only version A got right vs only version B got right
+    '''
+    n = only_a + only_b
+    if n == 0:
+        return 1.0
+    k = min(only_a, only_b)
+    # Binomial(n, 1/2) lower tail, summed in log space so large n does not overflow
+    log_terms = [lgamma(n + 1) - lgamma(i + 1) - lgamma(n - i + 1) - n * log(2) for i in range(k + 1)]
+    peak = max(log_terms)
+    tail = exp(peak) * sum(exp(term - peak) for term in log_terms)
+    return min(1.0, 2 * tail)
+
+def grab_bucket(num_grabs) -> str:
+    if num_grabs is None:
+        return "grabs=?"
+    return f"grabs={num_grabs}" if num_grabs < 3 else "grabs=3+"
+
+def putback_bucket(num_putbacks) -> str:
+    if num_putbacks is None:
+        return "putbacks=?"
+    return "putbacks=0" if num_putbacks == 0 else "putbacks=1+"
+
+def stratum_of(session_tags, num_grabs, num_putbacks, tags_of_interest:list) -> str:
+    '''
+    Stratum key of a session, e.g. "multi-product-grab|grabs=2|putbacks=0"
+    Sessions are split on which of tags_of_interest they carry, so each of those tags is a union of whole strata
+    '''
+    tags = set(normalize_tags(session_tags))
+    tag_key = "+".join(tag for tag in tags_of_interest if tag in tags) or "untagged"
+    return "|".join([tag_key, grab_bucket(num_grabs), putback_bucket(num_putbacks)])
+
+def stratify(sessions:list, all_session_tags:dict, grab_counts:dict, tags_of_interest:list) -> dict:
+    '''
+    session -> stratum key for every session, grab_counts maps session -> (num_grabs, num_putbacks)
+    '''
+    return {
+        session : stratum_of(all_session_tags.get(session), *grab_counts.get(session, (None, None)), tags_of_interest)
+        for session in sessions
+    }
+
+class StratifiedSampler:
+    """
+    Draw sessions without replacement, stratum by stratum, so repeated draws grow one stratified sample
+    Each draw is allocated proportionally to stratum size (largest remainder), with at least min_per_stratum sessions from every
+    stratum the first time it is drawn from, so small strata such as rare tags still get an estimate
+    """
+    def __init__(self, strata:dict, min_per_stratum:int=5, seed:int=0) -> None:
+        rng = Random(seed)
+        self.queues = dict()
+        for session, stratum in strata.items():
+            self.queues.setdefault(stratum, list()).append(session)
+        for queue in self.queues.values():
+            rng.shuffle(queue)
+        self.sizes = {stratum : len(queue) for stratum, queue in self.queues.items()}
+        self.drawn = {stratum : 0 for stratum in self.queues}
+        self.min_per_stratum = min_per_stratum
+
+    def remaining(self) -> int:
+        return sum(self.sizes[stratum] - self.drawn[stratum] for stratum in self.queues)
+
+    def draw(self, n:int) -> list:
+        '''
+        n more sessions (a few more if the per-stratum minimum requires it, fewer only once the corpus runs out), never repeating an earlier draw
+        The share of a stratum that has run out is handed to the strata that still have sessions, so sequential looks stay sample-sized
+        '''
+        allocation = dict()
+        for stratum, size in self.sizes.items():
+            allocation[stratum] = min(self.min_per_stratum, size) if self.drawn[stratum] == 0 else 0
+        budget = max(n - sum(allocation.values()), 0)
+        while budget > 0:
+            capacity = {stratum : self.sizes[stratum] - self.drawn[stratum] - allocation[stratum] for stratum in self.sizes}
+            open_strata = [stratum for stratum in self.sizes if capacity[stratum] > 0]
+            if not open_strata:
+                break
+            population = sum(self.sizes[stratum] for stratum in open_strata)
+            shares = {stratum : budget * self.sizes[stratum] / population for stratum in open_strata}
+            given = 0
+            for stratum in open_strata:
+                take = min(int(shares[stratum]), capacity[stratum])
+                allocation[stratum] += take
+                given += take
+            if given == 0:
+                # Every share is below one session, hand them out by largest remainder
+                for stratum in sorted(open_strata, key=lambda stratum: shares[stratum], reverse=True)[:budget]:
+                    allocation[stratum] += 1
+                    given += 1
+            budget -= given
+
+        sample = list()
+        for stratum, count in allocation.items():
+            start = self.drawn[stratum]
+            end = min(start + count, self.sizes[stratum])
+            sample.extend(self.queues[stratum][start:end])
+            self.drawn[stratum] = end
+        return sample
+
+class StratifiedEstimate:
+    """
+    Per-stratum counters for the sampled sessions, combined into population estimates by weighting every stratum by its size
+    Strata that have no scored sessions yet are left out and the remaining weights renormalized
+    Per-stratum variances use Agresti-Coull adjusted proportions, so strata with all-correct or all-wrong samples do not report zero variance
+    """
+    def __init__(self, strata_sizes:dict, cart_versions:list) -> None:
+        self.strata_sizes = dict(strata_sizes)
+        self.cart_versions = list(cart_versions)
+        self.correct = {stratum : dict.fromkeys(self.cart_versions, 0) for stratum in self.strata_sizes}
+        self.total = {stratum : dict.fromkeys(self.cart_versions, 0) for stratum in self.strata_sizes}
+        # Paired outcomes per (version_a, version_b): count of scored pairs, sum of (b - a) and the discordant counts
+        self.pairs = dict()
+
+    def pair(self, version_a:str, version_b:str, stratum:str) -> dict:
+        stratum_pairs = self.pairs.setdefault((version_a, version_b), dict())
+        if stratum not in stratum_pairs:
+            stratum_pairs[stratum] = {"n" : 0, "only_a" : 0, "only_b" : 0}
+        return stratum_pairs[stratum]
+
+    def update(self, stratum:str, version_info:dict) -> None:
+        '''
+        Fold one session's verdicts in; versions are only paired on sessions that all of them could score
+        '''
+        for version, info in version_info.items():
+            if version in self.total[stratum]:
+                self.total[stratum][version] += 1
+                self.correct[stratum][version] += int(info["is_correct"])
+        scored = [version for version in self.cart_versions if version in version_info]
+        for i, version_a in enumerate(scored):
+            for version_b in scored[i + 1:]:
+                counts = self.pair(version_a, version_b, stratum)
+                counts["n"] += 1
+                a, b = version_info[version_a]["is_correct"], version_info[version_b]["is_correct"]
+                if a and not b:
+                    counts["only_a"] += 1
+                elif b and not a:
+                    counts["only_b"] += 1
+
+    def weights(self, observed:dict, strata:list=None) -> dict:
+        '''
+        Population share of each stratum that has observations, among the given strata (all by default)
+        '''
+        strata = [stratum for stratum in (strata if strata is not None else self.strata_sizes) if observed.get(stratum, 0) > 0]
+        population = sum(self.strata_sizes[stratum] for stratum in strata)
+        return {stratum : self.strata_sizes[stratum] / population for stratum in strata}
+
+    def accuracy(self, version:str, strata:list=None, alpha:float=0.05) -> dict:
+        '''
+        Stratified accuracy of a version over the given strata, with a normal confidence interval
+        '''
+        observed = {stratum : self.total[stratum][version] for stratum in self.strata_sizes}
+        weights = self.weights(observed, strata)
+        estimate = 0.0
+        variance = 0.0
+        for stratum, weight in weights.items():
+            n = observed[stratum]
+            correct = self.correct[stratum][version]
+            estimate += weight * correct / n
+            adjusted = (correct + 2) / (n + 4)
+            # Finite population correction, a fully sampled stratum contributes no sampling error
+            fpc = max(1 - n / self.strata_sizes[stratum], 0)
+            variance += weight * weight * fpc * adjusted * (1 - adjusted) / (n + 4)
+        half_width = z_score(alpha) * sqrt(variance)
+        return {
+            "estimate" : estimate,
+            "low" : max(0.0, estimate - half_width),
+            "high" : min(1.0, estimate + half_width),
+            "sessions" : sum(observed[stratum] for stratum in weights)
+        }
+
+    def difference(self, version_a:str, version_b:str, strata:list=None, alpha:float=0.05) -> dict:
+        '''
+        Paired stratified estimate of accuracy(version_b) - accuracy(version_a) on sessions both versions scored,
+        with a normal confidence interval and the exact McNemar p-value of the pooled discordant pairs
+        '''
+        stratum_pairs = self.pairs.get((version_a, version_b), dict())
+        weights = self.weights({stratum : counts["n"] for stratum, counts in stratum_pairs.items()}, strata)
+        estimate = 0.0
+        variance = 0.0
+        only_a = only_b = sessions = 0
+        for stratum, weight in weights.items():
+            counts = stratum_pairs[stratum]
+            n = counts["n"]
+            mean = (counts["only_b"] - counts["only_a"]) / n
+            estimate += weight * mean
+            # Sample variance of the per-session difference (values -1, 0 or 1), the largest possible variance until a stratum has two pairs
+            squares = counts["only_a"] + counts["only_b"]
+            sample_variance = (squares - n * mean * mean) / (n - 1) if n > 1 else 1.0
+            fpc = max(1 - n / self.strata_sizes[stratum], 0)
+            variance += weight * weight * fpc * sample_variance / n
+            only_a += counts["only_a"]
+            only_b += counts["only_b"]
+            sessions += n
+        half_width = z_score(alpha) * sqrt(variance)
+        return {
+            "estimate" : estimate,
+            "low" : estimate - half_width,
+            "high" : estimate + half_width,
+            "sessions" : sessions,
+            "only_a" : only_a,
+            "only_b" : only_b,
+            "p_value" : mcnemar_p_value(only_a, only_b)
+        }
+
+    def strata_with(self, tag:str) -> list:
+        '''
+        Strata whose sessions all carry the given tag of interest
+        '''
+        return [stratum for stratum in self.strata_sizes if tag in stratum.split("|")[0].split("+")]
+
+def sequential_looks(sample_size:int, batch_size:int, max_sessions:int) -> int:
+    '''
+    Number of interim analyses a sequential run can make, used to split alpha between them
+    '''
+    return 1 + max(ceil((max_sessions - sample_size) / max(batch_size, 1)), 0)
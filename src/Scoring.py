@@ -0,0 +1,173 @@
+import numpy as np
+from json import loads
+
+def normalize_tags(tags) -> list:
+    '''
+    Coerce a tag column value (list, JSON string, comma separated string or None) into a list of tags
+    '''
+    if tags is None:
+        return list()
+    if isinstance(tags, (list, tuple, set)):
+        return list(tags)
+    if isinstance(tags, bytes):
+        tags = tags.decode("utf-8")
+    if isinstance(tags, str):
+        tags = tags.strip()
+        if not tags:
+            return list()
+        try:
+            parsed = loads(tags)
+        except ValueError:
+            return [tag.strip() for tag in tags.split(",") if tag.strip()]
+        return normalize_tags(parsed) if not isinstance(parsed, str) else [parsed]
+    return [tags]
+
+class ScoreAccumulator:
+    """
+    Streaming per-version scorer backed by NumPy counter arrays indexed by version x tag
+    Results are folded in one at a time, so scoring needs no per-session state, and partial accumulators can be merged
+    """
+    def __init__(self, cart_versions:list, session_tags:list=(), prediction_tags:list=(), discover_tags:bool=True) -> None:
+        self.discover_tags = discover_tags
+        self.versions = list()
+        self.version_index = dict()
+        self.session_tags = list()
+        self.session_tag_index = dict()
+        self.prediction_tags = list()
+        self.prediction_tag_index = dict()
+        self.correct = np.zeros(0, dtype=np.int64)
+        self.total = np.zeros(0, dtype=np.int64)
+        self.session_tag_correct = np.zeros((0, 0), dtype=np.int64)
+        self.session_tag_total = np.zeros((0, 0), dtype=np.int64)
+        self.prediction_tag_total = np.zeros((0, 0), dtype=np.int64)
+        for version in cart_versions:
+            self.add_version(version)
+        for session_tag in session_tags:
+            self.add_session_tag(session_tag)
+        for prediction_tag in prediction_tags:
+            self.add_prediction_tag(prediction_tag)
+
+    def add_version(self, version:str) -> int:
+        if version not in self.version_index:
+            self.version_index[version] = len(self.versions)
+            self.versions.append(version)
+            self.correct = np.append(self.correct, 0)
+            self.total = np.append(self.total, 0)
+            self.session_tag_correct = np.vstack([self.session_tag_correct, np.zeros((1, len(self.session_tags)), dtype=np.int64)])
+            self.session_tag_total = np.vstack([self.session_tag_total, np.zeros((1, len(self.session_tags)), dtype=np.int64)])
+            self.prediction_tag_total = np.vstack([self.prediction_tag_total, np.zeros((1, len(self.prediction_tags)), dtype=np.int64)])
+        return self.version_index[version]
+
+    def add_session_tag(self, session_tag:str) -> int:
+        if session_tag not in self.session_tag_index:
+            self.session_tag_index[session_tag] = len(self.session_tags)
+            self.session_tags.append(session_tag)
+            self.session_tag_correct = np.hstack([self.session_tag_correct, np.zeros((len(self.versions), 1), dtype=np.int64)])
+            self.session_tag_total = np.hstack([self.session_tag_total, np.zeros((len(self.versions), 1), dtype=np.int64)])
+        return self.session_tag_index[session_tag]
+
+    def add_prediction_tag(self, prediction_tag:str) -> int:
+        if prediction_tag not in self.prediction_tag_index:
+            self.prediction_tag_index[prediction_tag] = len(self.prediction_tags)
+            self.prediction_tags.append(prediction_tag)
+            self.prediction_tag_total = np.hstack([self.prediction_tag_total, np.zeros((len(self.versions), 1), dtype=np.int64)])
+        return self.prediction_tag_index[prediction_tag]
+
+    def session_tag_columns(self, session_tags:list) -> list:
+        '''
+        Map a session's tags to counter columns, registering unseen tags when discovery is on
+        '''
+        columns = set()
+        for session_tag in normalize_tags(session_tags):
+            if session_tag in self.session_tag_index:
+                columns.add(self.session_tag_index[session_tag])
+            elif self.discover_tags:
+                columns.add(self.add_session_tag(session_tag))
+        return sorted(columns)
+
+    def update(self, version:str, is_correct:bool, session_tags:list=(), prediction_tags:list=(), count:int=1) -> None:
+        '''
+        Fold a single (session, version) result into the counters, count=-1 takes a previously added result back out
+        '''
+        if version in self.version_index:
+            v = self.version_index[version]
+        elif self.discover_tags:
+            v = self.add_version(version)
+        else:
+            return
+        columns = self.session_tag_columns(session_tags)
+        self.total[v] += count
+        self.session_tag_total[v, columns] += count
+        if is_correct:
+            self.correct[v] += count
+            self.session_tag_correct[v, columns] += count
+        for prediction_tag in prediction_tags:
+            if prediction_tag in self.prediction_tag_index:
+                p = self.prediction_tag_index[prediction_tag]
+            elif self.discover_tags:
+                p = self.add_prediction_tag(prediction_tag)
+            else:
+                continue
+            self.prediction_tag_total[v, p] += count
+
+    def merge(self, other:"ScoreAccumulator") -> "ScoreAccumulator":
+        '''
+        Add another accumulator's counters into this one, aligning versions and tags by name
+        '''
+        versions = np.array([self.add_version(version) for version in other.versions], dtype=np.intp)
+        session_tags = np.array([self.add_session_tag(session_tag) for session_tag in other.session_tags], dtype=np.intp)
+        prediction_tags = np.array([self.add_prediction_tag(prediction_tag) for prediction_tag in other.prediction_tags], dtype=np.intp)
+        self.correct[versions] += other.correct
+        self.total[versions] += other.total
+        self.session_tag_correct[np.ix_(versions, session_tags)] += other.session_tag_correct
+        self.session_tag_total[np.ix_(versions, session_tags)] += other.session_tag_total
+        self.prediction_tag_total[np.ix_(versions, prediction_tags)] += other.prediction_tag_total
+        return self
+
+    def to_dict(self) -> dict:
+        '''
+        JSON-serializable snapshot of the names and counters, restored with from_dict
+        '''
+        return {
+            "versions" : list(self.versions),
+            "session_tags" : list(self.session_tags),
+            "prediction_tags" : list(self.prediction_tags),
+            "correct" : self.correct.tolist(),
+            "total" : self.total.tolist(),
+            "session_tag_correct" : self.session_tag_correct.tolist(),
+            "session_tag_total" : self.session_tag_total.tolist(),
+            "prediction_tag_total" : self.prediction_tag_total.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data:dict) -> "ScoreAccumulator":
+        accumulator = cls(data["versions"], data["session_tags"], data["prediction_tags"])
+        shape = (len(accumulator.versions), len(accumulator.session_tags))
+        accumulator.correct = np.array(data["correct"], dtype=np.int64).reshape(len(accumulator.versions))
+        accumulator.total = np.array(data["total"], dtype=np.int64).reshape(len(accumulator.versions))
+        accumulator.session_tag_correct = np.array(data["session_tag_correct"], dtype=np.int64).reshape(shape)
+        accumulator.session_tag_total = np.array(data["session_tag_total"], dtype=np.int64).reshape(shape)
+        accumulator.prediction_tag_total = np.array(data["prediction_tag_total"], dtype=np.int64).reshape(len(accumulator.versions), len(accumulator.prediction_tags))
+        return accumulator
+
+    def to_version_results(self) -> dict:
+        '''
+        Expand the counters into the nested version_results dict consumed by run_mlflow_experiment
+        '''
+        return {
+            version: {
+                "correct" : int(self.correct[v]),
+                "total" : int(self.total[v]),
+                "session_tags" : {
+                    session_tag : {
+                        "correct" : int(self.session_tag_correct[v, t]),
+                        "total" : int(self.session_tag_total[v, t])
+                    } for t, session_tag in enumerate(self.session_tags)
+                },
+                "prediction_tags" : {
+                    prediction_tag : {
+                        "total" : int(self.prediction_tag_total[v, p])
+                    } for p, prediction_tag in enumerate(self.prediction_tags)
+                }
+            } for v, version in enumerate(self.versions)
+        }
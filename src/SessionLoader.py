@@ -0,0 +1,96 @@
+import orjson
+import pymysql
+from Telemetry import timed
+
+def prediction_shelf(prediction:dict):
+    '''
+    (gondola_id, shelf_id) a prediction's weight event happened on, None when the prediction does not say
+    '''
+    gondola_id = prediction.get("gondola_id")
+    shelf_id = prediction.get("shelf_id", prediction.get("shelf"))
+    if gondola_id is None or shelf_id is None:
+        return None
+    return (int(gondola_id), int(shelf_id))
+
+def prediction_timestamp(prediction:dict):
+    '''
+    Start timestamp of a prediction's weight event, used to pick the planogram in effect
+    '''
+    return prediction.get("start", prediction.get("timestamp"))
+
+class SessionLoader:
+    """
+    Stream joined cart_predictions x reviewed_cart rows through a server-side cursor in fixed-size chunks
+    Only the session id, prediction metadata and reviewed cart columns are selected, and sessions are yielded lazily
+    """
+    def __init__(self, sql, chunk_size:int=500) -> None:
+        self.sql = sql
+        self.chunk_size = chunk_size
+        self.columns = None
+
+    def resolve_columns(self) -> tuple:
+        '''
+        Look up the names of the metadata column of cart_predictions and the cart column of reviewed_cart
+        These are the positional columns (5 and 3) get_session and postprocess_output have always read
+        '''
+        if self.columns is None:
+            with self.sql.cursor() as cursor:
+                cursor.execute("select * from frictionless.cart_predictions limit 0")
+                prediction_columns = [column[0] for column in cursor.description]
+                cursor.execute("select * from frictionless.reviewed_cart limit 0")
+                reviewed_columns = [column[0] for column in cursor.description]
+            self.columns = (prediction_columns[5], reviewed_columns[3])
+        return self.columns
+
+    def stream_sessions(self, session_ids:list=None, where:str=None, params:tuple=(), cart_version:str=None):
+        '''
+        Yield (session_id, inputs, reviewed_cart) for every reviewed session, optionally restricted to session_ids, a cart version or an extra WHERE clause on cart_predictions (aliased p)
+        inputs has the same metadata/predictions/products keys as get_session, reviewed_cart is the parsed reviewed cart contents
+        '''
+        if session_ids is not None:
+            session_ids = list(session_ids)
+            for i in range(0, len(session_ids), self.chunk_size):
+                chunk = session_ids[i:i + self.chunk_size]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                chunk_where = f"p.session_id in ({placeholders})" + (f" and ({where})" if where else "")
+                yield from self.stream_query(chunk_where, tuple(chunk) + tuple(params), cart_version)
+        else:
+            yield from self.stream_query(where, tuple(params), cart_version)
+
+    def stream_query(self, where:str, params:tuple, cart_version:str):
+        metadata_column, cart_column = self.resolve_columns()
+        conditions = [where] if where else []
+        if cart_version is not None:
+            conditions.append("p.cart_version = %s")
+            params = params + (cart_version,)
+        query = (
+            f"select p.session_id, p.`{metadata_column}`, r.`{cart_column}` "
+            "from frictionless.cart_predictions p join frictionless.reviewed_cart r on r.session_id = p.session_id"
+            + (" where " + " and ".join(f"({condition})" for condition in conditions) if conditions else "")
+            + " order by p.session_id"
+        )
+        # A session has one cart_predictions row per cart version, only the first is used like get_session did
+        # Rows come back grouped by session, so a repeat is always the same session as the previous row
+        previous = None
+        cursor = self.sql.cursor(pymysql.cursors.SSCursor)
+        try:
+            with timed("sql"):
+                cursor.execute(query, params)
+            while True:
+                with timed("sql"):
+                    rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                for session_id, metadata, reviewed_cart in rows:
+                    if session_id == previous:
+                        continue
+                    previous = session_id
+                    metadata = orjson.loads(metadata)
+                    inputs = {
+                        "metadata" : metadata["metadata"],
+                        "predictions" : metadata["predictions"],
+                        "products" : metadata["products"]
+                    }
+                    yield session_id, inputs, orjson.loads(reviewed_cart)
+        finally:
+            cursor.close()
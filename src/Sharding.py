@@ -0,0 +1,154 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+from json import dumps, loads
+from os import getenv
+from threading import Lock
+from Scoring import ScoreAccumulator
+
+def shard_of(session_id, shard_count:int) -> int:
+    '''
+    Deterministic shard of a session id, stable across processes and hosts (unlike the salted built-in hash)
+    '''
+    digest = hashlib.blake2b(str(session_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+def shard_sessions(sessions:list, shard_index:int, shard_count:int) -> list:
+    '''
+    The sessions belonging to one shard, in their original order
+    '''
+    if shard_count <= 1:
+        return list(sessions)
+    return [session for session in sessions if shard_of(session, shard_count) == shard_index]
+
+def shard_from_env() -> tuple:
+    '''
+    (shard_index, shard_count) from SHARD_INDEX, falling back to the JOB_COMPLETION_INDEX of an indexed Kubernetes Job, and SHARD_COUNT
+    '''
+    shard_count = int(getenv("SHARD_COUNT", 1))
+    shard_index = int(getenv("SHARD_INDEX", getenv("JOB_COMPLETION_INDEX", 0)))
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index {shard_index} is outside of shard count {shard_count}")
+    return shard_index, shard_count
+
+def partial_store_from_env():
+    '''
+    Partial store for sharded runs: Redis on REDIS_ADDRESS when it is set, which is what replicas in separate pods need,
+    else the local SQLite stand-in on BACKTEST_PARTIAL_STORE for replicas that are processes on one host
+    '''
+    if getenv("REDIS_ADDRESS"):
+        from SharedCache import SharedCache
+        return RedisPartialStore(SharedCache.from_env())
+    return PartialStore(getenv("BACKTEST_PARTIAL_STORE", os.path.join(tempfile.gettempdir(), "backtest_partials.db")))
+
+def wait_for_partials(store, run_id:str, shard_count:int, timeout:float=None, poll:float=5) -> dict:
+    '''
+    Poll a partial store until all shard_count partials of a run are stored, raises TimeoutError listing the missing shards
+    '''
+    deadline = time.time() + timeout if timeout is not None else None
+    while True:
+        partials = store.get_all(run_id, shard_count)
+        if len(partials) == shard_count:
+            return partials
+        missing = sorted(set(range(shard_count)) - set(partials.keys()))
+        if deadline is not None and time.time() >= deadline:
+            raise TimeoutError(f"Run {run_id} is still missing shards {missing}")
+        print(f"Waiting for shards {missing} of run {run_id}")
+        time.sleep(poll)
+
+class PartialStore:
+    """
+    SQLite store of per-shard ScoreAccumulator snapshots keyed by (run_id, shard_index)
+    Replicas write their partial once their shard is scored; the coordinator waits for every shard and merges them
+    Only for replicas running as processes on one host: SQLite locking is not reliable on network volumes, use RedisPartialStore across pods
+    """
+    def __init__(self, path:str) -> None:
+        self.path = path
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS backtest_partials (
+                run_id TEXT NOT NULL,
+                shard_index INTEGER NOT NULL,
+                shard_count INTEGER NOT NULL,
+                session_count INTEGER NOT NULL,
+                accumulator TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (run_id, shard_index)
+            )
+            """
+        )
+        self.connection.commit()
+
+    def put(self, run_id:str, shard_index:int, shard_count:int, session_count:int, accumulator:ScoreAccumulator) -> None:
+        '''
+        Store (or replace, when a shard is re-run) one shard's partial accumulator
+        '''
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO backtest_partials VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, shard_index, shard_count, session_count, dumps(accumulator.to_dict()), time.time())
+            )
+            self.connection.commit()
+
+    def get_all(self, run_id:str, shard_count:int) -> dict:
+        '''
+        shard_index -> (session_count, ScoreAccumulator) for the partials of a run written with this shard count
+        '''
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT shard_index, session_count, accumulator FROM backtest_partials WHERE run_id=? AND shard_count=?",
+                (run_id, shard_count)
+            ).fetchall()
+        return {shard_index : (session_count, ScoreAccumulator.from_dict(loads(accumulator))) for shard_index, session_count, accumulator in rows}
+
+    def wait_for(self, run_id:str, shard_count:int, timeout:float=None, poll:float=5) -> dict:
+        return wait_for_partials(self, run_id, shard_count, timeout, poll)
+
+    def close(self) -> None:
+        self.connection.close()
+
+class RedisPartialStore:
+    """
+    Per-shard ScoreAccumulator snapshots in one Redis hash per (run_id, shard_count), keyed by shard index
+    Same interface as PartialStore, for replicas in separate pods; errors are raised rather than swallowed like SharedCache lookups,
+    since a lost partial would silently drop a shard from the merge
+    """
+    def __init__(self, cache, ttl:float=None) -> None:
+        self.cache = cache
+        self.ttl = ttl if ttl is not None else float(getenv("BACKTEST_PARTIAL_TTL", 604800))
+
+    def key(self, run_id:str, shard_count:int) -> str:
+        return self.cache.key("partials", run_id, shard_count)
+
+    def put(self, run_id:str, shard_index:int, shard_count:int, session_count:int, accumulator:ScoreAccumulator) -> None:
+        key = self.key(run_id, shard_count)
+        partial = dumps({"session_count" : session_count, "accumulator" : accumulator.to_dict(), "created" : time.time()})
+        self.cache.client.hset(key, str(shard_index), partial)
+        self.cache.client.expire(key, int(self.ttl))
+
+    def get_all(self, run_id:str, shard_count:int) -> dict:
+        partials = dict()
+        for shard_index, partial in self.cache.client.hgetall(self.key(run_id, shard_count)).items():
+            partial = loads(partial)
+            partials[int(shard_index)] = (partial["session_count"], ScoreAccumulator.from_dict(partial["accumulator"]))
+        return partials
+
+    def wait_for(self, run_id:str, shard_count:int, timeout:float=None, poll:float=5) -> dict:
+        return wait_for_partials(self, run_id, shard_count, timeout, poll)
+
+    def close(self) -> None:
+        pass
+
+def merge_partials(partials:dict) -> ScoreAccumulator:
+    '''
+    Merge per-shard accumulators in shard order into one
+    '''
+    merged = ScoreAccumulator(list())
+    for shard_index in sorted(partials.keys()):
+        merged.merge(partials[shard_index][1])
+    return merged
@@ -0,0 +1,115 @@
+import time
+import uuid
+import orjson
+from os import getenv
+
+# Compare-and-delete in one server-side step, so a lock that expired and was taken over is never deleted by its previous holder
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+class SharedCache:
+    """
+    Redis-backed cache shared by every worker and pod, storing orjson values under namespaced keys with TTLs
+    get_or_fetch is single-flight: of all workers missing the same key, only the one holding the SET NX lock calls upstream
+    Cache errors never fail a caller, they fall back to fetching directly
+    """
+    def __init__(self, client, namespace:str=None, lock_ttl:float=None, wait_timeout:float=None) -> None:
+        self.client = client
+        self.namespace = namespace or getenv("REDIS_NAMESPACE", "cart-learning")
+        self.lock_ttl = lock_ttl if lock_ttl is not None else float(getenv("REDIS_LOCK_TTL", 120))
+        self.wait_timeout = wait_timeout if wait_timeout is not None else self.lock_ttl
+
+    @classmethod
+    def from_env(cls) -> "SharedCache":
+        '''
+        Shared cache on REDIS_ADDRESS (host:port or a redis:// URL), None when it is not set
+        '''
+        address = getenv("REDIS_ADDRESS")
+        if not address:
+            return None
+        import redis
+        url = address if "://" in address else f"redis://{address}"
+        return cls(redis.Redis.from_url(url, socket_timeout=float(getenv("REDIS_TIMEOUT", 5))))
+
+    def key(self, *parts) -> str:
+        return ":".join([self.namespace] + [str(part) for part in parts])
+
+    def get(self, key:str):
+        '''
+        Cached value for key, None on a miss or when Redis is unavailable
+        '''
+        try:
+            value = self.client.get(key)
+        except Exception as e:
+            print(f"Shared cache get failed for {key}: {e}")
+            return None
+        return orjson.loads(value) if value is not None else None
+
+    def set(self, key:str, value, ttl:float) -> None:
+        try:
+            self.client.set(key, orjson.dumps(value), px=int(ttl * 1000))
+        except Exception as e:
+            print(f"Shared cache set failed for {key}: {e}")
+
+    def incr(self, key:str, ttl:float) -> int:
+        '''
+        Atomically increment a counter and extend its TTL, None when Redis is unavailable
+        '''
+        try:
+            value = self.client.incr(key)
+            self.client.expire(key, int(ttl))
+            return value
+        except Exception as e:
+            print(f"Shared cache incr failed for {key}: {e}")
+            return None
+
+    def get_or_fetch(self, key:str, fetch, ttl:float):
+        '''
+        Return the cached value for key, or call fetch() once across all workers and cache its result (None results are not cached)
+        '''
+        value = self.get(key)
+        if value is not None:
+            return value
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+        deadline = time.time() + self.wait_timeout
+        delay = 0.05
+        while True:
+            try:
+                acquired = self.client.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+            except Exception as e:
+                print(f"Shared cache lock failed for {key}: {e}")
+                return fetch()
+            if acquired:
+                try:
+                    # Another worker may have filled the key between our miss and taking the lock
+                    value = self.get(key)
+                    if value is None:
+                        value = fetch()
+                        if value is not None:
+                            self.set(key, value, ttl)
+                    return value
+                finally:
+                    self.release(lock_key, token)
+            # Someone else is fetching, wait for their result
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            value = self.get(key)
+            if value is not None:
+                return value
+            if time.time() >= deadline:
+                print(f"Timed out waiting for shared cache key {key}, fetching directly")
+                return fetch()
+
+    def release(self, lock_key:str, token:str) -> None:
+        '''
+        Drop the single-flight lock if it is still ours (it may have expired and been taken over), atomically via RELEASE_SCRIPT
+        '''
+        try:
+            self.client.eval(RELEASE_SCRIPT, 1, lock_key, token)
+        except Exception as e:
+            print(f"Shared cache unlock failed for {lock_key}: {e}")
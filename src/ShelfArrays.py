@@ -0,0 +1,115 @@
+import numpy as np
+
+class ShelfArrays:
+    """
+    Struct-of-arrays product data for a single (gondola_id, shelf_id), sorted by X
+    Numeric product fields are NumPy arrays, shelf geometry is stored once per shelf, and product(i) gives the dict view dataMapping() would build
+    """
+    FLOAT_FIELDS = ("X", "X_Left", "X_Right", "GrossWeight", "Depth", "X_3D", "Y_3D", "Adjusted_x", "Adjusted_y")
+    INT_FIELDS = ("section", "shelf")
+    OBJECT_FIELDS = ("price", "Name", "Upc", "smart_system_id")
+
+    def __init__(self, gondola_id:int, shelf_id:int, smart_system_name:str, x_front_left:float, y_front_left:float, height:float, shelf_width:float, shelf_vec:list, columns:dict) -> None:
+        self.gondola_id = gondola_id
+        self.shelf_id = shelf_id
+        self.smart_system_name = smart_system_name
+        self.x_front_left = x_front_left
+        self.y_front_left = y_front_left
+        self.height = height
+        self.shelf_width = shelf_width
+        self.shelf_vec = shelf_vec
+        for field, values in columns.items():
+            setattr(self, field, values)
+
+    @classmethod
+    def from_records(cls, gondola_id:int, shelf_id:int, system_id:str, shelf_data:dict, records:list, geometry:tuple, scale:float) -> "ShelfArrays":
+        '''
+        Build shelf arrays from raw planogram export records, applying the same parsing rules as dataMapping()
+        '''
+        x_front_left, y_front_left, height, shelf_width, shelf_vec = geometry
+        count = len(records)
+        x = np.empty(count)
+        width = np.empty(count)
+        gross_weight = np.empty(count)
+        depth = np.empty(count)
+        section = np.empty(count, dtype=np.int32)
+        shelf = np.empty(count, dtype=np.int32)
+        price, name, upc = list(), list(), list()
+        for i, product_data in enumerate(records):
+            x[i] = float(product_data['x'])
+            width[i] = float(product_data['widthOnShelf'])
+            try:
+                gross_weight[i] = float(product_data['grossWeight'])
+            except:
+                netWeight = product_data.get("netWeight")
+                gross_weight[i] = float(netWeight) if netWeight is not None else 0
+            depth[i] = float(product_data['depth']) * scale if product_data['depth'] is not None else 0
+            section[i] = int(product_data['section'])
+            shelf[i] = int(product_data['shelf'])
+            price.append(product_data['price'])
+            name.append(product_data['name'])
+            upc.append(product_data['upc'])
+
+        # Stable sort so products sharing an X position keep their planogram order
+        order = np.argsort(x, kind="stable")
+        x, width, gross_weight, depth, section, shelf = x[order], width[order], gross_weight[order], depth[order], section[order], shelf[order]
+        columns = {
+            "X" : x,
+            "X_Left" : x * scale,
+            "X_Right" : (x + width) * scale,
+            "GrossWeight" : gross_weight,
+            "Depth" : depth,
+            "X_3D" : x_front_left + shelf_vec[0] * x * scale,
+            "Y_3D" : y_front_left + shelf_vec[1] * x * scale,
+            "Adjusted_x" : shelf_vec[0] * width * scale,
+            "Adjusted_y" : shelf_vec[1] * width * scale,
+            "section" : section,
+            "shelf" : shelf,
+            "price" : np.array(price, dtype=object)[order],
+            "Name" : np.array(name, dtype=object)[order],
+            "Upc" : np.array(upc, dtype=object)[order],
+            "smart_system_id" : np.full(count, system_id, dtype=object)
+        }
+        return cls(gondola_id, shelf_id, shelf_data['smart_system_name'], x_front_left, y_front_left, height, shelf_width, shelf_vec, columns)
+
+    def __len__(self) -> int:
+        return len(self.X)
+
+    def __iter__(self):
+        return (self.product(i) for i in range(len(self)))
+
+    def product(self, i:int) -> dict:
+        '''
+        Dict view of product i with the same keys and values dataMapping() produces
+        '''
+        return {
+            'gondola_id' : self.gondola_id,
+            'shelf_id' : self.shelf_id,
+            'price' : self.price[i],
+            'Name' : self.Name[i],
+            'Upc' : self.Upc[i],
+            'GrossWeight' : float(self.GrossWeight[i]),
+            'Depth' : float(self.Depth[i]),
+            'X_3D' : float(self.X_3D[i]),
+            'Y_3D' : float(self.Y_3D[i]),
+            'Z_3D' : self.height,
+            'Adjusted_x' : float(self.Adjusted_x[i]),
+            'Adjusted_y' : float(self.Adjusted_y[i]),
+            'smart_system_name' : self.smart_system_name,
+            'smart_system_id' : self.smart_system_id[i],
+            'X' : float(self.X[i]),
+            'section' : int(self.section[i]),
+            'shelf' : int(self.shelf[i]),
+            'shelf_width' : self.shelf_width,
+            'X_Left' : float(self.X_Left[i]),
+            'X_Right' : float(self.X_Right[i])
+        }
+
+    def products(self) -> list:
+        return list(self)
+
+def to_class_info(class_arrays:dict) -> dict:
+    '''
+    Expand a (gondola_id, shelf_id) -> ShelfArrays map into the list-of-dicts class_info format
+    '''
+    return {key : shelf_arrays.products() for key, shelf_arrays in class_arrays.items()}
@@ -0,0 +1,58 @@
+from math import sqrt
+from types import MappingProxyType
+
+def shelf_key(smart_system_id, gondola_id, shelf_id) -> tuple:
+    '''
+    Key a shelf by its smart system and a (gondola_id, shelf_id) pair packed into a single integer
+    Gondola and shelf ids are only unique within a smart system, so the system is part of the key
+    '''
+    return (str(smart_system_id), (int(gondola_id) << 16) | int(shelf_id))
+
+class ShelfGeometry:
+    """
+    Read-only shelf table built once per load_shelf_info() result
+    Stores each shelf's length under store_id -> shelf_key(smart_system_id, gondola_id, shelf), so the prediction hot path does no string parsing or sqrt
+    Minimum product weights depend on the planogram, so they are derived per class_info by min_weights()
+    """
+    def __init__(self, shelf_infos:dict) -> None:
+        lengths = dict()
+        for store_id, systems in shelf_infos.items():
+            store_lengths = dict()
+            for system_id, gondolas in systems.items():
+                for gondola_id, shelves in gondolas.items():
+                    for shelf_id, shelf_coordinates in shelves.items():
+                        try:
+                            key = shelf_key(system_id, gondola_id, shelf_id)
+                            store_lengths[key] = sqrt(
+                                abs(float(shelf_coordinates['y_front_right']) - float(shelf_coordinates['y_front_left'])) ** 2
+                                + abs(float(shelf_coordinates['x_front_right']) - float(shelf_coordinates['x_front_left'])) ** 2)
+                        except (KeyError, TypeError, ValueError):
+                            continue
+            lengths[store_id] = MappingProxyType(store_lengths)
+        self.lengths = MappingProxyType(lengths)
+        self.min_weight_source = None
+        self.min_weight_table = MappingProxyType(dict())
+
+    def shelf_length(self, store_id:str, key:tuple) -> float:
+        '''
+        Length of a shelf from its front-left to front-right corner, None if the shelf is unknown
+        '''
+        store_lengths = self.lengths.get(store_id)
+        return store_lengths.get(key) if store_lengths is not None else None
+
+    def min_weights(self, class_info:dict):
+        '''
+        shelf_key -> minimum product GrossWeight for a class_info (list of product dicts or ShelfArrays per shelf)
+        The table for the most recent class_info is kept, so repeated events against the same planogram reuse it
+        '''
+        if class_info is not self.min_weight_source:
+            table = dict()
+            for (gondola_id, shelf_id), products in class_info.items():
+                if hasattr(products, "GrossWeight"):
+                    if len(products):
+                        table[shelf_key(products.smart_system_id[0], gondola_id, shelf_id)] = float(products.GrossWeight.min())
+                elif products:
+                    table[shelf_key(products[0]["smart_system_id"], gondola_id, shelf_id)] = min(product["GrossWeight"] for product in products)
+            self.min_weight_table = MappingProxyType(table)
+            self.min_weight_source = class_info
+        return self.min_weight_table
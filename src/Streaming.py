@@ -0,0 +1,321 @@
+import sqlite3
+import time
+import orjson
+from collections import deque
+from os import getenv
+from Scoring import ScoreAccumulator, normalize_tags
+from Telemetry import ROLLING_ACCURACY, SESSIONS, ThroughputMeter
+
+def build_kafka_consumer(topic:str, group_id:str=None):
+    '''
+    confluent_kafka consumer for topic with auto commit off, using the Kafka certificates mounted under /creds/ when present
+    '''
+    from confluent_kafka import Consumer
+    config = {
+        "bootstrap.servers" : getenv("KAFKA_BOOTSTRAP_SERVERS"),
+        "group.id" : group_id or getenv("STREAM_GROUP_ID", "cart-learning-backtest"),
+        "enable.auto.commit" : False,
+        "auto.offset.reset" : getenv("STREAM_OFFSET_RESET", "earliest")
+    }
+    if getenv("KAFKA_SECURITY_PROTOCOL", "SSL") == "SSL":
+        config.update({
+            "security.protocol" : "SSL",
+            "ssl.ca.location" : "/creds/kafka-cluster-ca.crt",
+            "ssl.certificate.location" : "/creds/kafka-user.crt",
+            "ssl.key.location" : "/creds/kafka-user.key"
+        })
+    consumer = Consumer(config)
+    consumer.subscribe([topic])
+    return consumer
+
+class StreamState:
+    """
+    SQLite checkpoint of a streaming backtest: last processed offset per partition, scored (session, version) pairs, sessions that failed to score,
+    the rolling window's results and aggregates
+    Everything is written in one transaction before offsets are committed to Kafka, so a restart neither loses nor double counts a session
+    Scored pairs and failed sessions are only remembered for retention seconds, older ones are pruned at each checkpoint
+    Window results are appended and trimmed row by row, so a checkpoint only writes what changed since the last one
+    """
+    def __init__(self, path:str, retention:float=None) -> None:
+        self.retention = retention or float(getenv("STREAM_SCORED_RETENTION", 604800))
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS stream_offsets (topic TEXT NOT NULL, partition INTEGER NOT NULL, offset INTEGER NOT NULL, PRIMARY KEY (topic, partition))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS stream_scored (session_id TEXT NOT NULL, cart_version TEXT NOT NULL, scored_at REAL NOT NULL, PRIMARY KEY (session_id, cart_version))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS stream_failed (session_id TEXT PRIMARY KEY, attempts INTEGER NOT NULL, error TEXT, failed_at REAL NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS stream_window (seq INTEGER PRIMARY KEY, payload BLOB NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS stream_aggregates (name TEXT PRIMARY KEY, payload BLOB NOT NULL)")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(stream_scored)")]
+        if "scored_at" not in columns:
+            # State written before scored pairs were timestamped, start their retention now
+            self.connection.execute("ALTER TABLE stream_scored ADD COLUMN scored_at REAL NOT NULL DEFAULT 0")
+            self.connection.execute("UPDATE stream_scored SET scored_at=?", (time.time(),))
+        self.connection.execute("CREATE INDEX IF NOT EXISTS stream_scored_at ON stream_scored (scored_at)")
+        self.connection.commit()
+
+    def offsets(self) -> dict:
+        return {(topic, partition) : offset for topic, partition, offset in self.connection.execute("SELECT topic, partition, offset FROM stream_offsets")}
+
+    def is_scored(self, session:str, version:str) -> bool:
+        return self.connection.execute("SELECT 1 FROM stream_scored WHERE session_id=? AND cart_version=?", (session, version)).fetchone() is not None
+
+    def failed_sessions(self, limit:int, max_attempts:int, failed_before:float) -> list:
+        '''
+        Oldest failed sessions that are due for another attempt
+        '''
+        rows = self.connection.execute("SELECT session_id FROM stream_failed WHERE attempts < ? AND failed_at <= ? ORDER BY failed_at LIMIT ?", (max_attempts, failed_before, limit))
+        return [row[0] for row in rows]
+
+    def failed_count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM stream_failed").fetchone()[0]
+
+    def window(self) -> list:
+        '''
+        (seq, result) of the checkpointed window results, oldest first
+        '''
+        return [(seq, tuple(orjson.loads(payload))) for seq, payload in self.connection.execute("SELECT seq, payload FROM stream_window ORDER BY seq")]
+
+    def aggregate(self, name:str):
+        row = self.connection.execute("SELECT payload FROM stream_aggregates WHERE name=?", (name,)).fetchone()
+        return orjson.loads(row[0]) if row is not None else None
+
+    def checkpoint(self, offsets:dict, scored:set, aggregates:dict, failed:dict=None, recovered:set=None, window:list=(), window_start:int=0, max_attempts:int=None) -> int:
+        '''
+        failed maps session -> error of sessions that could not be scored (one more attempt each), recovered are failed sessions that now scored
+        window are the (seq, result) appended to the rolling window, rows before window_start have slid out of it
+        Failed sessions that reached max_attempts are dropped and added to the "dropped" aggregate, returns how many were dropped
+        '''
+        now = time.time()
+        dropped = 0
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO stream_offsets VALUES (?, ?, ?)", [(topic, partition, offset) for (topic, partition), offset in offsets.items()])
+            self.connection.executemany("INSERT OR IGNORE INTO stream_scored VALUES (?, ?, ?)", [(session, version, now) for session, version in scored])
+            self.connection.execute("DELETE FROM stream_scored WHERE scored_at < ?", (now - self.retention,))
+            self.connection.executemany(
+                "INSERT INTO stream_failed VALUES (?, 1, ?, ?) ON CONFLICT(session_id) DO UPDATE SET attempts=attempts + 1, error=excluded.error, failed_at=excluded.failed_at",
+                [(session, error, now) for session, error in (failed or dict()).items()]
+            )
+            self.connection.executemany("DELETE FROM stream_failed WHERE session_id=?", [(session,) for session in (recovered or set())])
+            self.connection.execute("DELETE FROM stream_failed WHERE failed_at < ?", (now - self.retention,))
+            if max_attempts is not None:
+                for session, error in self.connection.execute("SELECT session_id, error FROM stream_failed WHERE attempts >= ?", (max_attempts,)).fetchall():
+                    print(f"Dropping session {session} after {max_attempts} failed attempts: {error}")
+                dropped = self.connection.execute("DELETE FROM stream_failed WHERE attempts >= ?", (max_attempts,)).rowcount
+            if dropped:
+                aggregates = {**aggregates, "dropped": (self.aggregate("dropped") or 0) + dropped}
+            self.connection.executemany("INSERT OR REPLACE INTO stream_window VALUES (?, ?)", [(seq, orjson.dumps(result)) for seq, result in window])
+            self.connection.execute("DELETE FROM stream_window WHERE seq < ?", (window_start,))
+            # Written by older versions as a single aggregate
+            self.connection.execute("DELETE FROM stream_aggregates WHERE name='window'")
+            self.connection.executemany("INSERT OR REPLACE INTO stream_aggregates VALUES (?, ?)", [(name, orjson.dumps(payload)) for name, payload in aggregates.items()])
+        return dropped
+
+    def close(self) -> None:
+        self.connection.close()
+
+class StreamingBacktester:
+    """
+    Score sessions against cart_versions as new-prediction / review-completed events arrive, instead of re-scanning the whole corpus
+    Keeps all-time and rolling-window per-version/per-tag aggregates, checkpoints them with the processed offsets and then commits to Kafka
+    Event values are JSON objects with a session_id (a bare session id string is accepted too)
+    Sessions that fail to score are recorded in the same checkpoint as their event's offset, and retried as the stream runs until max_attempts
+    attempts failed, after which they are dropped and counted
+    """
+    def __init__(self, backtester, sql, consumer, cart_versions:list, state:StreamState, window:int=None, checkpoint_every:int=None, checkpoint_interval:float=None) -> None:
+        self.backtester = backtester
+        self.sql = sql
+        self.consumer = consumer
+        self.cart_versions = list(cart_versions)
+        self.state = state
+        self.window = window or int(getenv("STREAM_WINDOW", 1000))
+        self.checkpoint_every = checkpoint_every or int(getenv("STREAM_CHECKPOINT_EVERY", 100))
+        self.checkpoint_interval = checkpoint_interval or float(getenv("STREAM_CHECKPOINT_INTERVAL", 30))
+        self.max_attempts = int(getenv("STREAM_MAX_ATTEMPTS", 5))
+        self.retry_delay = float(getenv("STREAM_RETRY_DELAY", 60))
+        self.retry_batch = int(getenv("STREAM_RETRY_BATCH", 50))
+        self.throughput = ThroughputMeter("stream")
+        self.load_state()
+
+    def load_state(self) -> None:
+        '''
+        Restore offsets and aggregates from the last checkpoint
+        '''
+        self.offsets = self.state.offsets()
+        totals = self.state.aggregate("totals")
+        self.totals = ScoreAccumulator.from_dict(totals) if totals else ScoreAccumulator(self.cart_versions, self.backtester.session_tags, self.backtester.prediction_tags)
+        # Window results are kept with their sequence number, which is also their row in stream_window
+        self.window_results = deque(self.state.window())
+        self.pending_window = list()
+        if not self.window_results:
+            # State written when the whole window was one aggregate, rewrite it as rows at the next checkpoint
+            self.window_results = deque(enumerate(tuple(result) for result in self.state.aggregate("window") or list()))
+            self.pending_window = list(self.window_results)
+        self.next_window_seq = self.window_results[-1][0] + 1 if self.window_results else 0
+        self.rolling = ScoreAccumulator(self.cart_versions, self.backtester.session_tags, self.backtester.prediction_tags)
+        for _, (version, is_correct, session_tags, prediction_tags) in self.window_results:
+            self.rolling.update(version, is_correct, session_tags, prediction_tags)
+        self.dropped = self.state.aggregate("dropped") or 0
+        self.pending_offsets = dict()
+        self.pending_scored = set()
+        self.pending_messages = dict()
+        self.pending_failed = dict()
+        self.pending_recovered = set()
+        self.last_checkpoint = time.time()
+
+    def parse_session(self, value:bytes) -> str:
+        try:
+            event = orjson.loads(value)
+        except orjson.JSONDecodeError:
+            return value.decode("utf-8").strip() or None
+        if isinstance(event, dict):
+            return event.get("session_id")
+        return str(event) if event else None
+
+    def handle(self, message) -> None:
+        '''
+        Score one event's session for every cart version that has not been counted for it yet
+        '''
+        partition_key = (message.topic(), message.partition())
+        self.pending_messages[partition_key] = message
+        self.pending_offsets[partition_key] = message.offset()
+        # Redelivered after a restart: the checkpoint already counted it
+        if message.offset() <= self.offsets.get(partition_key, -1):
+            return
+        session = self.parse_session(message.value())
+        if session is None:
+            print(f"Skipping event without a session id at {partition_key} offset {message.offset()}")
+            return
+        self.attempt(session)
+
+    def attempt(self, session:str) -> bool:
+        '''
+        Score a session, recording it as failed (to be retried) when any cart version could not be scored
+        '''
+        try:
+            scored = self.score_session(session)
+            error = "not every cart version could be scored"
+        except Exception as e:
+            scored = False
+            error = str(e)
+        if scored:
+            self.pending_failed.pop(session, None)
+            self.pending_recovered.add(session)
+        else:
+            print(f"Failed to score session {session}: {error}")
+            self.pending_recovered.discard(session)
+            self.pending_failed[session] = error
+        return scored
+
+    def score_session(self, session:str) -> bool:
+        '''
+        Score a session for every cart version that has not been counted for it yet, True once every version is counted
+        '''
+        versions = [version for version in self.cart_versions if (session, version) not in self.pending_scored and not self.state.is_scored(session, version)]
+        if not versions:
+            return True
+        store = self.backtester.result_store
+        version_info = dict()
+        for version in versions:
+            stored = store.get(session, version) if store is not None else None
+            if stored is not None:
+                version_info[version] = stored
+        missing = [version for version in versions if version not in version_info]
+        if missing:
+            new_info = self.backtester.backtest_session(session, missing)
+            for version, info in new_info.items():
+                if store is not None:
+                    store.put(session, version, info)
+                version_info[version] = info
+        if not version_info:
+            return False
+        session_tags = normalize_tags(self.backtester.load_session_tags(self.sql, [session]).get(session))
+        for version, info in version_info.items():
+            self.totals.update(version, info["is_correct"], session_tags, info["prediction_tags"])
+            self.rolling.update(version, info["is_correct"], session_tags, info["prediction_tags"])
+            result = (self.next_window_seq, (version, info["is_correct"], session_tags, info["prediction_tags"]))
+            self.window_results.append(result)
+            self.pending_window.append(result)
+            self.next_window_seq += 1
+            self.pending_scored.add((session, version))
+            SESSIONS.labels("stream", version).inc()
+        # Slide the rolling window
+        while len(self.window_results) > self.window * len(self.cart_versions):
+            self.rolling.update(*self.window_results.popleft()[1], count=-1)
+        self.throughput.mark()
+        for version, results in self.rolling.to_version_results().items():
+            ROLLING_ACCURACY.labels(version).set(results["correct"] / max(results["total"], 1))
+        return len(version_info) == len(versions)
+
+    def retry_failed(self) -> None:
+        '''
+        Try again the failed sessions whose last attempt is at least retry_delay seconds old
+        '''
+        for session in self.state.failed_sessions(self.retry_batch, self.max_attempts, time.time() - self.retry_delay):
+            if session not in self.pending_failed and session not in self.pending_recovered:
+                self.attempt(session)
+
+    def checkpoint(self) -> None:
+        '''
+        Persist offsets, scored pairs, failures and aggregates, then commit the processed offsets to Kafka
+        '''
+        if not self.pending_messages and not self.pending_failed and not self.pending_recovered:
+            return
+        if self.backtester.result_store is not None:
+            self.backtester.result_store.flush()
+        offsets = {**self.offsets, **self.pending_offsets}
+        window_start = self.window_results[0][0] if self.window_results else self.next_window_seq
+        # Results that already slid out of the window since the last checkpoint are never written
+        window = [result for result in self.pending_window if result[0] >= window_start]
+        self.dropped += self.state.checkpoint(offsets, self.pending_scored, {"totals": self.totals.to_dict()}, self.pending_failed, self.pending_recovered, window, window_start, self.max_attempts)
+        for message in self.pending_messages.values():
+            self.consumer.commit(message=message, asynchronous=False)
+        self.offsets = offsets
+        self.pending_offsets, self.pending_scored, self.pending_messages = dict(), set(), dict()
+        self.pending_failed, self.pending_recovered, self.pending_window = dict(), set(), list()
+        self.last_checkpoint = time.time()
+
+    def run(self, max_messages:int=None, idle_timeout:float=None, poll_timeout:float=1.0) -> dict:
+        '''
+        Consume until max_messages were handled or no message arrived for idle_timeout seconds (forever by default)
+        Returns {"totals": version_results, "rolling": version_results, "failed": sessions waiting for a retry, "dropped": sessions that ran out of attempts}
+        '''
+        handled = 0
+        since_checkpoint = 0
+        last_message = time.time()
+        try:
+            while max_messages is None or handled < max_messages:
+                message = self.consumer.poll(poll_timeout)
+                if message is None:
+                    if idle_timeout is not None and time.time() - last_message >= idle_timeout:
+                        break
+                    if time.time() - self.last_checkpoint >= self.checkpoint_interval:
+                        self.retry_failed()
+                        self.checkpoint()
+                    continue
+                if message.error():
+                    print(f"Consumer error: {message.error()}")
+                    continue
+                last_message = time.time()
+                try:
+                    self.handle(message)
+                except Exception as e:
+                    # Scoring failures are recorded by handle, this only leaves events that could not be read
+                    print(f"Failed to score event at offset {message.offset()}: {e}")
+                handled += 1
+                since_checkpoint += 1
+                if since_checkpoint >= self.checkpoint_every or time.time() - self.last_checkpoint >= self.checkpoint_interval:
+                    self.retry_failed()
+                    self.checkpoint()
+                    since_checkpoint = 0
+                if handled % 100 == 0:
+                    self.print_summary()
+        finally:
+            self.checkpoint()
+        return self.results()
+
+    def results(self) -> dict:
+        return {"totals": self.totals.to_version_results(), "rolling": self.rolling.to_version_results(), "failed": self.state.failed_count(), "dropped": self.dropped}
+
+    def print_summary(self) -> None:
+        for version, results in self.rolling.to_version_results().items():
+            print(f"Version {version}: {results['correct']}/{results['total']} correct over the last {self.window} sessions")
@@ -0,0 +1,158 @@
+import itertools
+from math import ceil
+from random import Random
+from threading import BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from numpy import arange
+from Backtesting import Backtester, RateLimiter
+from Scoring import ScoreAccumulator
+
+def build_grid_sweep_configs(hyperparameters:dict, param_values:dict) -> list:
+    '''
+    Cartesian product of param_values ({name: [values] or (start, stop, step)}) applied on top of the base hyperparameters
+    '''
+    names = list(param_values.keys())
+    values = [expand_param_values(param_values[name]) for name in names]
+    configs = list()
+    for combination in itertools.product(*values):
+        config_copy = hyperparameters.copy()
+        config_copy.update(zip(names, combination))
+        configs.append(config_copy)
+    return configs
+
+def build_random_sweep_configs(hyperparameters:dict, param_ranges:dict, num_configs:int, seed:int=0) -> list:
+    '''
+    Random search, drawing each parameter uniformly from (low, high) or choosing from a list of values
+    '''
+    rng = Random(seed)
+    configs = list()
+    for _ in range(num_configs):
+        config_copy = hyperparameters.copy()
+        for name, param_range in param_ranges.items():
+            if isinstance(param_range, tuple):
+                config_copy[name] = round(rng.uniform(*param_range), 3)
+            else:
+                config_copy[name] = rng.choice(list(param_range))
+        configs.append(config_copy)
+    return configs
+
+def expand_param_values(param_value) -> list:
+    '''
+    Accept either an explicit list of values or an arange-style (start, stop, step) tuple
+    '''
+    if isinstance(param_value, tuple):
+        return [round(float(i), 3) for i in arange(*param_value)]
+    return list(param_value)
+
+class SweepScheduler:
+    """
+    Run a hyperparameter sweep through re-prediction and backtesting with successive halving
+    Every config starts on a small session subset; only the best 1/eta of each rung is promoted to eta times more sessions, until the survivors cover the whole corpus
+    All configs share one request budget and one analyzer rate limit
+    """
+    def __init__(self, backtester:Backtester, base_version:str, concurrency:int=None, max_parallel_configs:int=None, eta:int=3, min_sessions:int=None, rate_limit:float=None, version_key:str="cart_version", seed:int=0) -> None:
+        self.backtester = backtester
+        self.base_version = base_version
+        self.concurrency = concurrency or int(getenv("SWEEP_CONCURRENCY", 32))
+        self.max_parallel_configs = max_parallel_configs or int(getenv("SWEEP_PARALLEL_CONFIGS", 4))
+        self.eta = eta
+        self.min_sessions = min_sessions or int(getenv("SWEEP_MIN_SESSIONS", 200))
+        self.rate_limiter = RateLimiter(rate_limit if rate_limit is not None else float(getenv("REPREDICT_RATE_LIMIT", 5)))
+        self.version_key = version_key
+        self.seed = seed
+        # Every HTTP request made by the backtester during the sweep, for any config, holds one slot of this budget
+        self.request_budget = BoundedSemaphore(self.concurrency)
+
+    def version_name(self, config:dict, param_names:list) -> str:
+        '''
+        Name the cart version for a config after its swept values, e.g. buzz-v3.2.2-p-0.6
+        '''
+        return "-".join([self.base_version] + [str(config[name]) for name in param_names])
+
+    def rung_sizes(self, num_sessions:int, num_configs:int) -> list:
+        '''
+        Session counts per rung, growing by eta until the whole corpus is covered
+        '''
+        sizes = list()
+        size = min(self.min_sessions, num_sessions)
+        remaining = num_configs
+        while remaining > 1 and size < num_sessions:
+            sizes.append(size)
+            size *= self.eta
+            remaining = ceil(remaining / self.eta)
+        sizes.append(num_sessions)
+        return sizes
+
+    def evaluate(self, config:dict, version:str, sessions:list, all_session_tags:dict) -> ScoreAccumulator:
+        '''
+        Re-predict a config on new sessions and score the resulting version on them
+        '''
+        # Scored without the result store below, so only the shared-cache verdicts of this version are invalidated
+        failed_sessions = self.backtester.run_sessions(sessions, config, rate_limiter=self.rate_limiter, invalidate_store=False)
+        if failed_sessions:
+            print(f"{len(failed_sessions)} sessions failed to re-predict for {version}")
+        return self.backtester.score_sessions(sessions, [version], all_session_tags)
+
+    def run(self, sql, configs:list, param_names:list, sessions:list=None) -> dict:
+        '''
+        Schedule every config through successive-halving rungs and return the final per-version results and configs
+        '''
+        if sessions is None:
+            with sql.cursor() as cursor:
+                cursor.execute("SELECT DISTINCT session_id from frictionless.cart_predictions")
+                sessions = [session[0] for session in cursor.fetchall()]
+        sessions = list(dict.fromkeys(sessions))
+        Random(self.seed).shuffle(sessions)
+        all_session_tags = self.backtester.load_session_tags(sql, sessions)
+
+        versioned_configs = dict()
+        for config in configs:
+            config_copy = config.copy()
+            version = self.version_name(config_copy, param_names)
+            config_copy[self.version_key] = version
+            versioned_configs[version] = config_copy
+
+        accumulators = {version : ScoreAccumulator([version], self.backtester.session_tags, self.backtester.prediction_tags) for version in versioned_configs}
+        survivors = list(versioned_configs.keys())
+        scored_sessions = 0
+        rung_sizes = self.rung_sizes(len(sessions), len(survivors))
+        with self.backtester.budgeted(self.request_budget), ThreadPoolExecutor(max_workers=self.max_parallel_configs) as executor:
+            for rung, rung_size in enumerate(rung_sizes):
+                # Only the sessions added at this rung need re-predicting, earlier ones are already scored
+                new_sessions = sessions[scored_sessions:rung_size]
+                print(f"Rung {rung}: {len(survivors)} configs on {rung_size} sessions")
+                futures = {
+                    version : executor.submit(self.evaluate, versioned_configs[version], version, new_sessions, all_session_tags)
+                    for version in survivors
+                }
+                for version, future in futures.items():
+                    accumulators[version].merge(future.result())
+                scored_sessions = rung_size
+
+                if rung < len(rung_sizes) - 1:
+                    survivors = sorted(survivors, key=lambda version: self.accuracy(accumulators[version], version), reverse=True)
+                    survivors = survivors[:max(1, ceil(len(survivors) / self.eta))]
+
+        version_results = dict()
+        for version in survivors:
+            version_results.update(accumulators[version].to_version_results())
+        return {
+            "version_results" : version_results,
+            "configs" : {version : versioned_configs[version] for version in survivors},
+            "eliminated" : {
+                version : accumulators[version].to_version_results()[version]
+                for version in versioned_configs if version not in survivors
+            }
+        }
+
+    def accuracy(self, accumulator:ScoreAccumulator, version:str) -> float:
+        results = accumulator.to_version_results()[version]
+        return results["correct"] / max(results["total"], 1)
+
+    def log_results(self, sweep_results:dict) -> None:
+        '''
+        Log each surviving version to MLFlow with its own config
+        '''
+        for version, results in sweep_results["version_results"].items():
+            self.backtester.run_mlflow_experiment({version : results}, sweep_results["configs"][version])
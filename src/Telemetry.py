@@ -0,0 +1,75 @@
+import time
+from contextlib import contextmanager
+from os import getenv
+from threading import Lock
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from opentelemetry import trace
+
+# Latency of every outbound call, by service: cart_metrics, cart_analyzer, planogram, sql
+REQUEST_LATENCY = Histogram(
+    "cart_learning_request_seconds",
+    "Latency of outbound calls made by the backtest pipeline",
+    ["service"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+SESSIONS = Counter("cart_learning_sessions_total", "Sessions processed", ["job", "cart_version"])
+ERRORS = Counter("cart_learning_errors_total", "Calls that failed after all retries", ["service", "cart_version"])
+RETRIES = Counter("cart_learning_retries_total", "Calls that were retried", ["service", "cart_version"])
+THROUGHPUT = Gauge("cart_learning_sessions_per_second", "Sessions per second over the current run", ["job"])
+ROLLING_ACCURACY = Gauge("cart_learning_rolling_accuracy", "Accuracy over the streaming backtest window", ["cart_version"])
+
+tracer = trace.get_tracer("cart-learning")
+server_lock = Lock()
+server_port = None
+
+def start_metrics_server(port:int=None) -> int:
+    '''
+    Expose the Prometheus metrics on PROMETHEUS_PORT (8000 by default), once per process
+    Tracing is a no-op unless an OpenTelemetry SDK is configured, e.g. by running under opentelemetry-instrument
+    '''
+    global server_port
+    with server_lock:
+        if server_port is None:
+            server_port = int(port if port is not None else getenv("PROMETHEUS_PORT", 8000))
+            start_http_server(server_port)
+            print(f"Serving Prometheus metrics on port {server_port}")
+    return server_port
+
+@contextmanager
+def timed(service:str):
+    '''
+    Record the wall time of the wrapped call in the latency histogram, including calls that raise
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REQUEST_LATENCY.labels(service).observe(time.perf_counter() - start)
+
+@contextmanager
+def span(name:str, **attributes):
+    '''
+    Wrap a block in an OpenTelemetry span with the given attributes
+    '''
+    with tracer.start_as_current_span(name) as current_span:
+        for key, value in attributes.items():
+            current_span.set_attribute(key, value)
+        yield current_span
+
+class ThroughputMeter:
+    """
+    Track sessions per second for one job since the meter was created and publish it on the throughput gauge
+    """
+    def __init__(self, job:str) -> None:
+        self.job = job
+        self.start_time = time.time()
+        self.count = 0
+        self.lock = Lock()
+        THROUGHPUT.labels(job).set(0)
+
+    def mark(self, n:int=1) -> float:
+        with self.lock:
+            self.count += n
+            rate = self.count / max(time.time() - self.start_time, 1e-9)
+        THROUGHPUT.labels(self.job).set(rate)
+        return rate
@@ -0,0 +1,170 @@
+"""
+Command line entry point for cart-learning
+
+    python3 cli.py backtest [--versions] [--run-analysis] [--config JSON] [--sample N [--sequential] [--max-sample M]]
+    python3 cli.py repredict [--prod] [--workers N] [--rate-limit R]
+    python3 cli.py sweep --param QTY_DECAY=0.6:0.8:0.05 [--param NAME=a,b,c] [--random N]
+    python3 cli.py build-dataset [--dataset-dir DIR] [--version NAME]
+    python3 cli.py stream [--topic TOPIC] [--state PATH]
+
+Heavy modules and the SQL connection are only loaded by the subcommand that needs them; --dry-run stops right after the imports
+By default the process stays alive after the command finishes, as the Deployment expects; --run-to-completion (or RUN_TO_COMPLETION=1) exits instead, for Jobs
+"""
+import argparse
+import os
+import sys
+import time
+from json import loads
+from os import getenv
+
+def connect_sql():
+    import pymysql
+    return pymysql.connect(
+        host=getenv("SQL_ADDRESS"),
+        user=getenv("SQL_USERNAME"),
+        password=getenv("SQL_PASSWORD"),
+        database="frictionless",
+        port=4000
+    )
+
+def parse_param(value:str) -> tuple:
+    '''
+    NAME=a,b,c (explicit values), NAME=start:stop:step (grid range) or NAME=low:high (random search range)
+    '''
+    name, _, values = value.partition("=")
+    if not name or not values:
+        raise argparse.ArgumentTypeError(f"Expected NAME=VALUES, got {value}")
+    if ":" in values:
+        return name, tuple(float(v) for v in values.split(":"))
+    return name, [float(v) if v.replace(".", "", 1).lstrip("-").isdigit() else v for v in values.split(",")]
+
+def backtest(args) -> int:
+    from Backtesting import Backtester
+    from Telemetry import start_metrics_server
+    if args.dry_run:
+        return 0
+    start_metrics_server()
+    backtester = Backtester()
+    backtester.backtest_all_sessions(connect_sql(), args.config, versions=args.versions, run_analysis=args.run_analysis, sample_size=args.sample, sequential=args.sequential, max_sessions=args.max_sample)
+    backtester.mlflow_logger.close()
+    return 0
+
+def repredict(args) -> int:
+    from Backtesting import Backtester
+    from Telemetry import start_metrics_server
+    if args.dry_run:
+        return 0
+    start_metrics_server()
+    failed_sessions = Backtester().run_all_sessions(connect_sql(), args.config, dev=not args.prod, max_workers=args.workers, rate_limit=args.rate_limit)
+    return 1 if failed_sessions else 0
+
+def sweep(args) -> int:
+    from Sweep import SweepScheduler, build_grid_sweep_configs, build_random_sweep_configs
+    from Backtesting import Backtester
+    from Telemetry import start_metrics_server
+    if args.dry_run:
+        return 0
+    start_metrics_server()
+    param_values = dict(args.param)
+    if args.random:
+        configs = build_random_sweep_configs(args.config, param_values, args.random)
+    else:
+        configs = build_grid_sweep_configs(args.config, param_values)
+    backtester = Backtester()
+    scheduler = SweepScheduler(backtester, args.base_version)
+    results = scheduler.run(connect_sql(), configs, list(param_values.keys()))
+    scheduler.log_results(results)
+    backtester.mlflow_logger.close()
+    return 0
+
+def build_dataset(args) -> int:
+    import main
+    from Backtesting import Backtester
+    from Dataset import DatasetReader
+    from ProductMapper import ProductMapper
+    from SessionLoader import SessionLoader
+    from Telemetry import start_metrics_server
+    if args.dry_run:
+        return 0
+    start_metrics_server()
+    shelf_infos = main.load_store_shelf_infos()
+    product_mapper = ProductMapper()
+    sql = connect_sql()
+    all_sessions = main.load_all_sessions(sql, Backtester())
+    print(f"All sessions = {all_sessions}")
+    session_loader = SessionLoader(sql)
+    dataset_path = main.build_dataset(session_loader.stream_sessions(all_sessions), product_mapper, shelf_infos, args.dataset_dir, args.version)
+    print(f"Dataset written to {dataset_path}")
+    dataset = DatasetReader(os.path.dirname(dataset_path), os.path.basename(dataset_path))
+    print(f"Dataset {dataset.manifest['version']} has {len(dataset.session_ids())} sessions in {len(dataset.manifest['shards'])} shards")
+    return 0
+
+def stream(args) -> int:
+    from Backtesting import Backtester
+    from Streaming import StreamingBacktester, StreamState, build_kafka_consumer
+    from Telemetry import start_metrics_server
+    if args.dry_run:
+        return 0
+    start_metrics_server()
+    backtester = Backtester()
+    consumer = build_kafka_consumer(args.topic)
+    state = StreamState(args.state)
+    try:
+        StreamingBacktester(backtester, connect_sql(), consumer, backtester.cart_versions, state).run()
+    finally:
+        consumer.close()
+        state.close()
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cli.py", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--run-to-completion", action="store_true", default=getenv("RUN_TO_COMPLETION", "0") == "1", help="exit when the command finishes instead of idling (for Kubernetes Jobs)")
+    parser.add_argument("--dry-run", action="store_true", help="load the command's modules and exit, used to measure startup time")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    config = argparse.ArgumentParser(add_help=False)
+    config.add_argument("--config", type=loads, default=loads(getenv("BACKTEST_CONFIG", "{}")), help="hyperparameter config as JSON (BACKTEST_CONFIG)")
+
+    command = subparsers.add_parser("backtest", parents=[config], help="backtest every stored session against the configured cart versions")
+    command.add_argument("--versions", action="store_true", help="backtest every cart version found in cart_predictions")
+    command.add_argument("--run-analysis", action="store_true", help="re-predict every session before backtesting")
+    command.add_argument("--sample", type=int, default=int(getenv("BACKTEST_SAMPLE_SIZE", 0)), help="backtest a stratified sample of about this many sessions, with confidence intervals")
+    command.add_argument("--sequential", action="store_true", help="keep drawing samples of --sample sessions until every version differs significantly from the first")
+    command.add_argument("--max-sample", type=int, default=int(getenv("BACKTEST_SAMPLE_MAX", 0)) or None, help="stop sequential sampling after this many sessions")
+    command.set_defaults(handler=backtest)
+
+    command = subparsers.add_parser("repredict", parents=[config], help="re-predict every stored session through cart-analyzer")
+    command.add_argument("--prod", action="store_true", help="use the production cart-analyzer instead of dev")
+    command.add_argument("--workers", type=int)
+    command.add_argument("--rate-limit", type=float)
+    command.set_defaults(handler=repredict)
+
+    command = subparsers.add_parser("sweep", parents=[config], help="hyperparameter sweep with successive halving")
+    command.add_argument("--param", type=parse_param, action="append", default=[], help="NAME=a,b,c or NAME=start:stop:step (NAME=low:high with --random)")
+    command.add_argument("--random", type=int, default=0, help="draw this many random configs instead of a grid")
+    command.add_argument("--base-version", default=f"{getenv('CART_BRANCH')}-v{getenv('CART_VERSION')}-p")
+    command.set_defaults(handler=sweep)
+
+    command = subparsers.add_parser("build-dataset", help="materialize preprocessed training data")
+    command.add_argument("--dataset-dir", default=getenv("DATASET_DIR", "datasets"))
+    command.add_argument("--version")
+    command.set_defaults(handler=build_dataset)
+
+    command = subparsers.add_parser("stream", help="streaming backtest over a Kafka topic")
+    command.add_argument("--topic", default=getenv("STREAM_TOPIC", "cart-review-completed"))
+    command.add_argument("--state", default=getenv("STREAM_STATE", "stream_state.db"))
+    command.set_defaults(handler=stream)
+    return parser
+
+def main(argv:list=None) -> int:
+    args = build_parser().parse_args(argv)
+    status = args.handler(args)
+    if args.dry_run or args.run_to_completion:
+        return status
+    # Deployments restart containers that exit, so idle once the work is done
+    print(f"{args.command} finished with status {status}, idling")
+    while True:
+        time.sleep(60)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,54 +1,45 @@
+import sys
 import numpy as np
 from os import getenv 
-from json import loads
-import pymysql
-from Backtesting import Backtester
-from ProductMapper import ProductMapper
-from hulearn.classification import FunctionClassifier
-from awm_connector.awm_connector import AWM_Connector
-from cart_tools.Toolkit import load_shelf_info
+from orjson import loads
+from SessionLoader import prediction_shelf, prediction_timestamp
+from Dataset import DatasetWriter
+from Telemetry import timed
 
 PRODUCT_LIMIT = 50
 R_W_L = 0 # Relative weight location
 W_D = 1 # Weight delta
+PRODUCT_WEIGHTS = 2 # Start of product GrossWeight slots
+PRODUCT_LEFTS = PRODUCT_WEIGHTS + PRODUCT_LIMIT # Start of product X_Left slots
+PRODUCT_RIGHTS = PRODUCT_LEFTS + PRODUCT_LIMIT # Start of product X_Right slots
 
 TEST_SESSION = "f9a44d34-642a-43ff-a202-0e3b04c8eda2"
 
 
-backtester = Backtester()
-sql = pymysql.connect(
-    host=getenv("SQL_ADDRESS"),
-    user=getenv("SQL_USERNAME"),
-    password=getenv("SQL_PASSWORD"),
-    database="frictionless",
-    port=4000
-)
+SESSION_FILTER = "num_grabs > 1 and num_grabs < 3 and num_putbacks = 0"
 
 
-def load_all_sessions(sql):
+def load_all_sessions(sql, backtester):
     """
-    
+    Find sessions matching SESSION_FILTER that the reference cart version predicted correctly
+    Backtest verdicts are requested concurrently (and reused from the result store when configured)
     """
-    returned_sessions = list()
-    with sql.cursor() as cursor:
-        cursor.execute(f"select DISTINCT session_id from frictionless.cart_predictions where num_grabs > 1 and num_grabs < 3 and num_putbacks = 0;")
-        sessions = cursor.fetchall()
-        for session in sessions:
-            session = session[0]
-            result = backtester.make_backtest_request(session, f"{getenv('CART_BRANCH')}-v3.2.0-p")
-            #print(result.headers)
-            if "is_correct" in result.headers:
-                if result.headers["is_correct"] == "True":
-                    returned_sessions.append(session)
-    return returned_sessions
+    with sql.cursor() as cursor, timed("sql"):
+        cursor.execute(f"select DISTINCT session_id from frictionless.cart_predictions where {SESSION_FILTER};")
+        sessions = [session[0] for session in cursor.fetchall()]
+    version = f"{getenv('CART_BRANCH')}-v3.2.0-p"
+    return [
+        session for session, version_info in backtester.iter_session_results(sessions, [version], backtester.result_store)
+        if version in version_info and version_info[version]["is_correct"]
+    ]
 
 def get_session(sql, session_id):
     """
-    
+    Load a single session's prediction inputs and reviewed cart row, see SessionLoader for bulk loading
     """
-    with sql.cursor() as cursor:
+    with sql.cursor() as cursor, timed("sql"):
       
-        cursor.execute(f"select * from frictionless.cart_predictions where session_id='{session_id}'")
+        cursor.execute("select * from frictionless.cart_predictions where session_id=%s", (session_id,))
         result = cursor.fetchone()
         metadata = loads(result[5])
         
@@ -57,48 +48,19 @@ def get_session(sql, session_id):
             "predictions" : metadata["predictions"],
             "products" : metadata["products"]
         }
-    with sql.cursor() as cursor:
-        cursor.execute(f"select * from frictionless.reviewed_cart where session_id='{session_id}'")
+    with sql.cursor() as cursor, timed("sql"):
+        cursor.execute("select * from frictionless.reviewed_cart where session_id=%s", (session_id,))
         outputs = cursor.fetchone()
         #print(outputs)
     return (inputs, outputs)
             
 
-def test_f(inp):
-    return np.array(inp)
-
-
-def preprocess_input(predictions, product_mapper, shelf_infos):
-    preds = list()
-    for prediction in predictions:
-        print(prediction)
-        store_id = prediction["store_id"]
-        slice_pmap = product_mapper.get_class_info(
-            shelf_info=shelf_infos[store_id], 
-            timestamp=slice["start"], 
-            use_realogram=False,
-        )
-        #print(prediction)
-        z = [0, 0] + [0] * 3 * PRODUCT_LIMIT
-        z[W_D] = prediction["sample_value"]
-        z[R_W_L] = prediction["weight_location_x"]
-        preds.append(z)
-        # Set product weight and boundary values
-
-    return np.array(preds)
-
-def postprocess_output(results):
-    entries = list()
-    contents = loads(results[3])
-    for item in contents["cart"]:
-        z = [0] * PRODUCT_LIMIT
-        z[int(item["shelf_location"])-1] = int(item["quantity"])
-        entries.append(z)
-    return np.array(entries)
-
-
-if __name__ == "__main__":
-    # Load shelf info
+def load_store_shelf_infos():
+    """
+    Load shelf info for every store through the AWM connector, the connector packages are only imported here
+    """
+    from awm_connector.awm_connector import AWM_Connector
+    from cart_tools.Toolkit import load_shelf_info
     connector = AWM_Connector(
         storage_address = getenv("STORAGE_ADDRESS"),
         storage_key = getenv("STORAGE_KEY"),
@@ -112,15 +74,89 @@ if __name__ == "__main__":
     )
     store_ids = list(loads(getenv("storeinfo")).keys()) # Load multiprod list of streaming stores
     print(f"Store ID list = {store_ids}")
-    shelf_infos = load_shelf_info(connector)
-    product_mapper = ProductMapper()
-
-    all_sessions = load_all_sessions(sql)
-    print(f"All sessions = {all_sessions}")
-    for session in all_sessions:
-        inputs, outputs = get_session(sql, session)
-        prepared_inputs = preprocess_input(inputs["predictions"])
-        prepared_outputs = postprocess_output(outputs)
-        print(prepared_outputs)
-
-    classifier = FunctionClassifier(test_f)
\ No newline at end of file
+    return load_shelf_info(connector)
+
+
+def get_class_arrays(product_mapper, shelf_infos, store_id, timestamp, class_info_cache):
+    """
+    Class info for a store as ShelfArrays, memoized per (store_id, planogram epoch)
+    A failed load (None) is not memoized, so the next prediction in the epoch tries again
+    """
+    key = (store_id, product_mapper.planogram_epoch(timestamp))
+    if key in class_info_cache:
+        return class_info_cache[key]
+    class_arrays = product_mapper.get_class_arrays(
+        shelf_info=shelf_infos[store_id],
+        timestamp=timestamp,
+        use_realogram=False,
+    )
+    if class_arrays is not None:
+        class_info_cache[key] = class_arrays
+    return class_arrays
+
+def preprocess_input(predictions, product_mapper, shelf_infos, class_info_cache=None):
+    """
+    Build one float32 feature row per prediction: weight location, weight delta, then the GrossWeight, X_Left and X_Right of the shelf's products in X order
+    Class info is memoized per (store_id, planogram epoch) across calls when class_info_cache is shared
+    """
+    if class_info_cache is None:
+        class_info_cache = dict()
+    preds = np.zeros((len(predictions), 2 + 3 * PRODUCT_LIMIT), dtype=np.float32)
+    for i, prediction in enumerate(predictions):
+        preds[i, W_D] = prediction["sample_value"]
+        preds[i, R_W_L] = prediction["weight_location_x"]
+
+        # Set product weight and boundary values
+        shelf = prediction_shelf(prediction)
+        timestamp = prediction_timestamp(prediction)
+        if shelf is None or timestamp is None:
+            continue
+        class_arrays = get_class_arrays(product_mapper, shelf_infos, prediction["store_id"], timestamp, class_info_cache)
+        if class_arrays is None or shelf not in class_arrays:
+            continue
+        shelf_arrays = class_arrays[shelf]
+        count = min(len(shelf_arrays), PRODUCT_LIMIT)
+        preds[i, PRODUCT_WEIGHTS:PRODUCT_WEIGHTS + count] = shelf_arrays.GrossWeight[:count]
+        preds[i, PRODUCT_LEFTS:PRODUCT_LEFTS + count] = shelf_arrays.X_Left[:count]
+        preds[i, PRODUCT_RIGHTS:PRODUCT_RIGHTS + count] = shelf_arrays.X_Right[:count]
+    return preds
+
+def iter_features(session_stream, product_mapper, shelf_infos):
+    """
+    Lazily turn a SessionLoader stream into (session_id, inputs matrix, outputs matrix, planogram epochs), sharing the class info cache across sessions
+    """
+    class_info_cache = dict()
+    for session, inputs, reviewed_cart in session_stream:
+        predictions = inputs["predictions"]
+        epochs = sorted({
+            product_mapper.planogram_epoch(prediction_timestamp(prediction))
+            for prediction in predictions if prediction_timestamp(prediction) is not None
+        })
+        yield session, preprocess_input(predictions, product_mapper, shelf_infos, class_info_cache), postprocess_cart(reviewed_cart), epochs
+
+def build_dataset(session_stream, product_mapper, shelf_infos, root, version=None):
+    """
+    Materialize preprocessed inputs and labels for a session stream into memory-mappable shards under root
+    Returns the dataset version directory
+    """
+    writer = DatasetWriter(root, PRODUCT_LIMIT, 2 + 3 * PRODUCT_LIMIT, version=version)
+    for session, inputs, outputs, epochs in iter_features(session_stream, product_mapper, shelf_infos):
+        writer.add(session, inputs, outputs, epochs)
+    return writer.close()
+
+def postprocess_output(results):
+    return postprocess_cart(loads(results[3]))
+
+def postprocess_cart(contents):
+    entries = list()
+    for item in contents["cart"]:
+        z = [0] * PRODUCT_LIMIT
+        z[int(item["shelf_location"])-1] = int(item["quantity"])
+        entries.append(z)
+    return np.array(entries)
+
+
+if __name__ == "__main__":
+    # Kept for the old entry point, same as `python3 cli.py build-dataset`
+    from cli import main
+    sys.exit(main(["build-dataset"]))
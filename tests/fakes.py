@@ -0,0 +1,208 @@
+"""
+In-process stand-ins for the external services the backtester talks to, used by the tests
+"""
+import time
+from threading import Lock
+import orjson
+from Sharding import shard_of
+from SharedCache import RELEASE_SCRIPT
+
+class FakeCursor:
+    """
+    Cursor over FakeSQL, answering the session id and session tag queries the backtester makes
+    """
+    def __init__(self, sql:"FakeSQL") -> None:
+        self.sql = sql
+        self.rows = list()
+        self.description = None
+
+    def __enter__(self) -> "FakeCursor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def execute(self, query:str, params=None) -> None:
+        if "upload_record_tables" in query:
+            self.description = (("session_id",), ("tags",))
+            self.rows = [(session, self.sql.session_tags[session]) for session in params if session in self.sql.session_tags]
+        elif "DISTINCT session_id" in query:
+            self.description = (("session_id",),)
+            self.rows = [(session,) for session in self.sql.sessions]
+        else:
+            raise NotImplementedError(f"FakeSQL does not answer {query}")
+
+    def fetchall(self) -> list:
+        return list(self.rows)
+
+class FakeSQL:
+    """
+    Stand-in for the frictionless database connection with a fixed set of sessions and their tags
+    """
+    def __init__(self, sessions:list, session_tags:dict=None) -> None:
+        self.sessions = list(sessions)
+        self.session_tags = session_tags or dict()
+
+    def cursor(self, *args) -> FakeCursor:
+        return FakeCursor(self)
+
+class Message:
+    """
+    The parts of a confluent_kafka Message the streaming backtester reads
+    """
+    def __init__(self, topic:str, partition:int, offset:int, value:bytes) -> None:
+        self._topic, self._partition, self._offset, self._value = topic, partition, offset, value
+
+    def topic(self) -> str:
+        return self._topic
+
+    def partition(self) -> int:
+        return self._partition
+
+    def offset(self) -> int:
+        return self._offset
+
+    def value(self) -> bytes:
+        return self._value
+
+    def error(self):
+        return None
+
+class InMemoryBroker:
+    """
+    Local stand-in for a Kafka cluster: partitioned topics plus committed offsets per consumer group
+    """
+    def __init__(self, partitions:int=1) -> None:
+        self.partitions = partitions
+        self.topics = dict()
+        self.committed = dict()
+        self.lock = Lock()
+
+    def produce(self, topic:str, value, key=None) -> None:
+        if not isinstance(value, bytes):
+            value = orjson.dumps(value)
+        with self.lock:
+            log = self.topics.setdefault(topic, [list() for _ in range(self.partitions)])
+            partition = shard_of(key, self.partitions) if key is not None else sum(len(messages) for messages in log) % self.partitions
+            log[partition].append(value)
+
+    def consumer(self, topic:str, group_id:str) -> "InMemoryConsumer":
+        return InMemoryConsumer(self, topic, group_id)
+
+class InMemoryConsumer:
+    """
+    Consumer over an InMemoryBroker with the poll/commit/close interface of confluent_kafka.Consumer
+    A new consumer of the same group resumes from the group's committed offsets, like a restarted pod would
+    """
+    def __init__(self, broker:InMemoryBroker, topic:str, group_id:str) -> None:
+        self.broker = broker
+        self.topic = topic
+        self.group_id = group_id
+        with broker.lock:
+            self.positions = [broker.committed.get((group_id, topic, partition), 0) for partition in range(broker.partitions)]
+        self.next_partition = 0
+
+    def poll(self, timeout:float=None) -> Message:
+        with self.broker.lock:
+            log = self.broker.topics.get(self.topic, [list() for _ in range(self.broker.partitions)])
+            for i in range(self.broker.partitions):
+                partition = (self.next_partition + i) % self.broker.partitions
+                if self.positions[partition] < len(log[partition]):
+                    offset = self.positions[partition]
+                    self.positions[partition] += 1
+                    self.next_partition = (partition + 1) % self.broker.partitions
+                    return Message(self.topic, partition, offset, log[partition][offset])
+        return None
+
+    def commit(self, message:Message=None, asynchronous:bool=True) -> None:
+        with self.broker.lock:
+            self.broker.committed[(self.group_id, message.topic(), message.partition())] = message.offset() + 1
+
+    def close(self) -> None:
+        pass
+
+class InMemoryRedis:
+    """
+    Thread-safe in-process stand-in for the subset of the redis client SharedCache and RedisPartialStore use
+    (get, set with nx/px/ex, delete, incr, hset, hgetall, expire, and eval of RELEASE_SCRIPT)
+    """
+    def __init__(self) -> None:
+        self.values = dict()
+        self.lock = Lock()
+
+    def entry(self, key:str):
+        '''
+        Live (value, expires) entry of a key, dropping it once expired, call with the lock held
+        '''
+        entry = self.values.get(key)
+        if entry is not None and entry[1] is not None and time.time() >= entry[1]:
+            del self.values[key]
+            return None
+        return entry
+
+    def get(self, key:str):
+        with self.lock:
+            entry = self.entry(key)
+            return entry[0] if entry is not None else None
+
+    def set(self, key:str, value, nx:bool=False, px:int=None, ex:int=None) -> bool:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        expires = time.time() + px / 1000 if px is not None else (time.time() + ex if ex is not None else None)
+        with self.lock:
+            entry = self.values.get(key)
+            if nx and entry is not None and (entry[1] is None or time.time() < entry[1]):
+                return None
+            self.values[key] = (value, expires)
+            return True
+
+    def delete(self, *keys) -> int:
+        with self.lock:
+            return sum(1 for key in keys if self.values.pop(key, None) is not None)
+
+    def eval(self, script:str, numkeys:int, *keys_and_args) -> int:
+        '''
+        Run RELEASE_SCRIPT under the lock, the only script the stand-in understands
+        '''
+        if script != RELEASE_SCRIPT or numkeys != 1:
+            raise NotImplementedError("InMemoryRedis only evaluates RELEASE_SCRIPT")
+        key, token = keys_and_args
+        if isinstance(token, str):
+            token = token.encode("utf-8")
+        with self.lock:
+            entry = self.entry(key)
+            if entry is None or entry[0] != token:
+                return 0
+            del self.values[key]
+            return 1
+
+    def incr(self, key:str) -> int:
+        with self.lock:
+            entry = self.entry(key)
+            value, expires = (int(entry[0]) + 1, entry[1]) if entry is not None else (1, None)
+            self.values[key] = (str(value).encode("utf-8"), expires)
+            return value
+
+    def hset(self, key:str, field:str, value) -> int:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        with self.lock:
+            entry = self.entry(key)
+            fields, expires = entry if entry is not None else (dict(), None)
+            added = int(field.encode("utf-8") not in fields)
+            fields[field.encode("utf-8")] = value
+            self.values[key] = (fields, expires)
+            return added
+
+    def hgetall(self, key:str) -> dict:
+        with self.lock:
+            entry = self.entry(key)
+            return dict(entry[0]) if entry is not None else dict()
+
+    def expire(self, key:str, seconds:int) -> bool:
+        with self.lock:
+            entry = self.entry(key)
+            if entry is None:
+                return False
+            self.values[key] = (entry[0], time.time() + seconds)
+            return True
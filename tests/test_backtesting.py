@@ -0,0 +1,32 @@
+import pytest
+from Backtesting import Backtester
+from ResultStore import ResultStore
+
+VERDICT = {"is_correct" : True, "num_fn" : 0, "num_fp" : 0, "prediction_tags" : []}
+
+@pytest.fixture
+def backtester(monkeypatch, tmp_path):
+    monkeypatch.delenv("REDIS_ADDRESS", raising=False)
+    backtester = Backtester(max_workers=1, retries=0)
+    backtester.result_store = ResultStore(str(tmp_path / "results.db"))
+    backtester.run_cart = lambda session_id, config, dev=True: "200"
+    for session in ("s1", "s2"):
+        for version in ("v1", "v2"):
+            backtester.result_store.put(session, version, VERDICT)
+    backtester.result_store.flush()
+    return backtester
+
+def stored(store:ResultStore) -> set:
+    return {(session, version) for session in ("s1", "s2") for version in ("v1", "v2") if store.get(session, version) is not None}
+
+def test_repredicting_a_named_version_only_invalidates_it(backtester):
+    backtester.run_sessions(["s1"], {"cart_version" : "v2"}, rate_limit=1000)
+    assert stored(backtester.result_store) == {("s1", "v1"), ("s2", "v1"), ("s2", "v2")}
+
+def test_repredicting_without_a_version_invalidates_every_version(backtester):
+    backtester.run_sessions(["s1"], {"QTY_DECAY" : 0.7}, rate_limit=1000)
+    assert stored(backtester.result_store) == {("s2", "v1"), ("s2", "v2")}
+
+def test_store_the_caller_does_not_score_against_is_kept(backtester):
+    backtester.run_sessions(["s1"], {"cart_version" : "v2"}, rate_limit=1000, invalidate_store=False)
+    assert len(stored(backtester.result_store)) == 4
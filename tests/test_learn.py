@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+import Learn
+from ProductIndex import ProductIndex
+from ShelfGeometry import ShelfGeometry, shelf_key
+
+class Predictor:
+    """
+    Minimal host object for the Learn prediction functions, which are written as methods
+    """
+    MIN_DISTANCE_SCALAR = 2.0
+    build_product_points = Learn.build_product_points
+    calculate_2d_distance = Learn.calculate_2d_distance
+    calculate_2d_distance_pruned = Learn.calculate_2d_distance_pruned
+    prune_products = Learn.prune_products
+
+def make_shelf(num_products:int, rng:np.random.Generator) -> list:
+    '''
+    One densely faced shelf of product dicts, some facings overlapping, X_Left/X_Right in feet
+    '''
+    widths = rng.uniform(0.2, 0.6, num_products)
+    lefts = np.concatenate([[0], np.cumsum(widths)[:-1]]) - rng.uniform(0, 0.1, num_products)
+    weights = rng.uniform(50, 900, num_products).round(1)
+    return [
+        {"Upc": f"upc-{i}", "gondola_id": 1, "shelf_id": 1, "X_Left": float(lefts[i]), "X_Right": float(lefts[i] + widths[i]), "GrossWeight": float(weights[i])}
+        for i in range(num_products)
+    ]
+
+def candidates(result:tuple) -> list:
+    return [(id(candidate["product"]), candidate["distance"], candidate["qty"]) for candidate in result[0]]
+
+@pytest.mark.parametrize("scalar", [1.0, 1.25, 2.0, 4.0])
+@pytest.mark.parametrize("shuffled", [False, True])
+def test_pruned_matches_full_scan(scalar, shuffled):
+    rng = np.random.default_rng(0)
+    products = make_shelf(120, rng)
+    if shuffled:
+        # class_info lists are not guaranteed to be in X_Left order
+        products = [products[i] for i in rng.permutation(len(products))]
+    predictor = Predictor()
+    predictor.MIN_DISTANCE_SCALAR = scalar
+    shelf_length = max(product["X_Right"] for product in products)
+    for product_index in (None, ProductIndex({(1, 1): products})):
+        for _ in range(200):
+            product = products[int(rng.integers(0, len(products)))]
+            location = float(np.clip(rng.uniform(product["X_Left"], product["X_Right"]), 0, shelf_length))
+            delta = -product["GrossWeight"] * int(rng.integers(1, 4)) + float(rng.normal(0, 5))
+            full = predictor.calculate_2d_distance((location, abs(delta)), predictor.build_product_points(products, location, abs(delta)))
+            pruned = predictor.calculate_2d_distance_pruned(products, location, {"weight_delta": delta}, product_index)
+            assert candidates(pruned) == candidates(full)
+
+def test_pruning_drops_far_products():
+    rng = np.random.default_rng(1)
+    products = make_shelf(200, rng)
+    predictor = Predictor()
+    product = products[100]
+    kept = predictor.prune_products(products, (product["X_Left"] + product["X_Right"]) / 2, product["GrossWeight"])
+    assert product in kept
+    assert len(kept) < len(products)
+    # Kept products stay in their input order
+    assert kept == [candidate for candidate in products if any(candidate is k for k in kept)]
+
+def test_shelf_geometry_keeps_systems_apart():
+    shelf_infos = {"store-1" : {
+        "system-a" : {"1" : {"2" : {"x_front_left" : 0, "y_front_left" : 0, "x_front_right" : 3, "y_front_right" : 4}}},
+        "system-b" : {"1" : {"2" : {"x_front_left" : 0, "y_front_left" : 0, "x_front_right" : 6, "y_front_right" : 8}}}
+    }}
+    geometry = ShelfGeometry(shelf_infos)
+    assert geometry.shelf_length("store-1", shelf_key("system-a", 1, 2)) == 5
+    assert geometry.shelf_length("store-1", shelf_key("system-b", "1", "2")) == 10
+    class_info = {(1, 2) : [{"smart_system_id" : "system-b", "GrossWeight" : 40.0}, {"smart_system_id" : "system-b", "GrossWeight" : 25.0}]}
+    assert dict(geometry.min_weights(class_info)) == {shelf_key("system-b", 1, 2) : 25.0}
+
+def test_pruning_only_returns_given_products():
+    rng = np.random.default_rng(2)
+    shelf = make_shelf(120, rng)
+    products = shelf[::2]
+    product_index = ProductIndex({(1, 1): shelf})
+    predictor = Predictor()
+    for product in shelf[40:80]:
+        location = (product["X_Left"] + product["X_Right"]) / 2
+        kept = predictor.prune_products(products, location, product["GrossWeight"], product_index)
+        assert all(any(candidate is given for given in products) for candidate in kept)
+        assert kept == predictor.prune_products(products, location, product["GrossWeight"])
+        full = predictor.calculate_2d_distance((location, product["GrossWeight"]), predictor.build_product_points(products, location, product["GrossWeight"]))
+        pruned = predictor.calculate_2d_distance_pruned(products, location, {"weight_delta": -product["GrossWeight"]}, product_index)
+        assert candidates(pruned) == candidates(full)
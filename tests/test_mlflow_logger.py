@@ -0,0 +1,52 @@
+import os
+import pytest
+import MlflowLogger as mlflow_logger_module
+from MlflowLogger import MlflowLogger
+
+@pytest.fixture(autouse=True)
+def file_store(monkeypatch):
+    monkeypatch.setenv("MLFLOW_ALLOW_FILE_STORE", "true")
+    monkeypatch.setenv("MLFLOW_HTTP_REQUEST_MAX_RETRIES", "0")
+    monkeypatch.setenv("MLFLOW_HTTP_REQUEST_TIMEOUT", "2")
+
+def logged_runs(tracking_uri:str, experiment_name:str) -> dict:
+    from mlflow.tracking import MlflowClient
+    client = MlflowClient(tracking_uri=tracking_uri)
+    experiment = client.get_experiment_by_name(experiment_name)
+    runs = client.search_runs([experiment.experiment_id]) if experiment is not None else list()
+    return {run.info.run_name : (run.data.params, run.data.metrics, run.info.status) for run in runs}
+
+def test_queued_runs_are_written_to_the_tracking_store(tmp_path):
+    tracking_uri = (tmp_path / "mlruns").as_uri()
+    logger = MlflowLogger(experiment_name="backtest", tracking_uri=tracking_uri, fallback_dir=str(tmp_path / "spool"), retries=0)
+    logger.log_run("backtest_v1", {"QTY_DECAY" : 0.7}, {"general_score" : 0.9})
+    logger.log_run("backtest_v2", {"QTY_DECAY" : 0.8}, {"general_score" : 0.8})
+    logger.close()
+    assert logged_runs(tracking_uri, "backtest") == {
+        "backtest_v1" : ({"QTY_DECAY" : "0.7"}, {"general_score" : 0.9}, "FINISHED"),
+        "backtest_v2" : ({"QTY_DECAY" : "0.8"}, {"general_score" : 0.8}, "FINISHED"),
+    }
+    assert not os.path.exists(tmp_path / "spool")
+
+def test_runs_are_spooled_while_the_server_is_down_and_replayed(tmp_path):
+    spool = tmp_path / "spool"
+    # Nothing listens on the discard port, every write fails
+    down = MlflowLogger(experiment_name="backtest", tracking_uri="http://127.0.0.1:9", fallback_dir=str(spool), retries=0)
+    down.log_run("backtest_v1", {"QTY_DECAY" : 0.7}, {"general_score" : 0.9})
+    down.close()
+    assert len(os.listdir(spool)) == 1
+
+    tracking_uri = (tmp_path / "mlruns").as_uri()
+    up = MlflowLogger(experiment_name="backtest", tracking_uri=tracking_uri, fallback_dir=str(spool), retries=0)
+    assert up.replay_fallback() == 1
+    assert os.listdir(spool) == []
+    assert logged_runs(tracking_uri, "backtest") == {"backtest_v1" : ({"QTY_DECAY" : "0.7"}, {"general_score" : 0.9}, "FINISHED")}
+
+def test_close_is_registered_once(monkeypatch, tmp_path):
+    registered = list()
+    monkeypatch.setattr(mlflow_logger_module.atexit, "register", registered.append)
+    logger = MlflowLogger(tracking_uri=(tmp_path / "mlruns").as_uri(), fallback_dir=str(tmp_path / "spool"), retries=0)
+    for i in range(3):
+        logger.log_run(f"run-{i}", dict(), dict())
+        logger.close()
+    assert registered == [logger.close]
@@ -0,0 +1,25 @@
+import os
+import time
+from PlanogramCache import PlanogramCache
+
+def age(cache:PlanogramCache, key:tuple, seconds:float) -> None:
+    then = time.time() - seconds
+    os.utime(cache.path(key), (then, then))
+
+def test_expired_disk_entries_are_pruned_on_start(tmp_path):
+    cache = PlanogramCache(cache_dir=str(tmp_path), ttl=60)
+    cache.put(("system-0", False, 1), [{"upc" : "a"}])
+    cache.put(("system-1", False, 1), [{"upc" : "b"}])
+    age(cache, ("system-0", False, 1), 120)
+    PlanogramCache(cache_dir=str(tmp_path), ttl=60)
+    assert os.listdir(tmp_path) == [os.path.basename(cache.path(("system-1", False, 1)))]
+
+def test_expired_disk_entries_are_pruned_every_few_puts(tmp_path):
+    cache = PlanogramCache(cache_dir=str(tmp_path), ttl=60, prune_every=3)
+    cache.put(("system-0", False, 1), [{"upc" : "a"}])
+    age(cache, ("system-0", False, 1), 120)
+    cache.put(("system-0", False, 2), [{"upc" : "a"}])
+    assert os.path.exists(cache.path(("system-0", False, 1)))
+    cache.put(("system-0", False, 3), [{"upc" : "a"}])
+    assert not os.path.exists(cache.path(("system-0", False, 1)))
+    assert len(os.listdir(tmp_path)) == 2
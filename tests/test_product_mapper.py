@@ -0,0 +1,38 @@
+import ProductMapper as product_mapper_module
+from ProductIndex import ProductIndex
+from ProductMapper import ProductMapper
+
+SHELF_INFO = {"system-0" : {"1" : {"1" : {
+    "x_front_left" : "0", "y_front_left" : "0", "x_front_right" : "2", "y_front_right" : "0",
+    "height" : "1", "shelf" : "1", "gondola_id" : "1", "smart_system_name" : "system-0"
+}}}}
+PLANOGRAM = [
+    {"frictionlessGondolaId" : 1, "shelf" : 1, "price" : 1.0, "name" : f"product-{i}", "upc" : f"upc-{i}", "grossWeight" : "100",
+     "netWeight" : None, "depth" : 6, "x" : i * 12.0, "widthOnShelf" : 12.0, "section" : 1}
+    for i in range(2)
+]
+
+def test_class_arrays_index_is_built_on_first_lookup(monkeypatch, tmp_path):
+    monkeypatch.setenv("PLANOGRAM_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(ProductMapper, "fetchPlanogram", lambda self, system_id, timestamp, realogram=False, use_timestamp=True: PLANOGRAM)
+    builds = list()
+    monkeypatch.setattr(product_mapper_module, "ProductIndex", lambda class_info: builds.append(class_info) or ProductIndex(class_info))
+    product_mapper = ProductMapper(use_cache=False)
+
+    class_arrays = product_mapper.get_class_arrays(SHELF_INFO, "1000")
+    assert builds == []
+    assert product_mapper.find_by_upc("upc-1")["Upc"] == "upc-1"
+    assert product_mapper.find_by_gondola_upc(1, "upc-0")["Upc"] == "upc-0"
+    assert builds == [class_arrays]
+
+def test_foreign_class_info_keeps_own_index(monkeypatch):
+    product_mapper = ProductMapper(use_cache=False)
+    own = {(1, 1) : [{"Upc" : "a", "gondola_id" : 1, "shelf_id" : 1, "X_Left" : 0.0, "X_Right" : 1.0}]}
+    foreign = {(2, 1) : [{"Upc" : "b", "gondola_id" : 2, "shelf_id" : 1, "X_Left" : 0.0, "X_Right" : 1.0}]}
+    product_mapper.set_class_info(own)
+    builds = list()
+    monkeypatch.setattr(product_mapper_module, "ProductIndex", lambda class_info: builds.append(class_info) or ProductIndex(class_info))
+    for _ in range(3):
+        assert product_mapper.lookup_by_upc("b", foreign, 2)["Upc"] == "b"
+    assert product_mapper.find_by_upc("a")["Upc"] == "a"
+    assert builds == [foreign, own]
@@ -0,0 +1,102 @@
+import pytest
+from Backtesting import Backtester
+from ProductMapper import ProductMapper
+from Replay import ReplayBacktester, score_cart
+
+SESSION_TAGS = ["multi-product-grab", "incomplete-reach"]
+PREDICTION_TAGS = ["false-negative", "false-positive"]
+WIDTH = 12.0 # inches, one foot per facing
+
+def make_store():
+    '''
+    One system with two three-product shelves on gondola 1, as load_shelf_info returns it, and the product map stored with predictions
+    '''
+    shelf_info = {"system-0" : {"1" : {
+        str(shelf) : {
+            "x_front_left" : "0",
+            "y_front_left" : "0",
+            "x_front_right" : "3",
+            "y_front_right" : "0",
+            "height" : str(shelf),
+            "shelf" : str(shelf),
+            "gondola_id" : "1",
+            "smart_system_name" : "system-0"
+        }
+        for shelf in (1, 2)
+    }}}
+    planogram = [
+        {"frictionlessGondolaId" : 1, "shelf" : shelf, "price" : 1.0, "name" : f"product-{shelf}-{i}", "upc" : f"upc-{shelf}-{i}", "grossWeight" : str(weight),
+         "netWeight" : None, "depth" : 6, "x" : i * WIDTH, "widthOnShelf" : WIDTH, "section" : 1}
+        for shelf, weights in ((1, [100.0, 250.0, 400.0]), (2, [120.0, 300.0, 500.0]))
+        for i, weight in enumerate(weights)
+    ]
+    class_info = ProductMapper(use_cache=False).dataMapping(shelf_info, {"system-0" : planogram})
+    products = [product for shelf_products in class_info.values() for product in shelf_products]
+    return shelf_info, products
+
+def grab(position:int, weight:float, shelf:int=1) -> dict:
+    '''
+    Stored prediction row for a grab of the product at a 1-based shelf position, at the center of its facing
+    '''
+    return {"store_id" : "store", "gondola_id" : 1, "shelf" : shelf, "start" : "1000", "sample_value" : -weight, "weight_location_x" : (position - 0.5) / 3}
+
+def item(position:int, shelf:int=1) -> dict:
+    return {"gondola_id" : 1, "shelf" : shelf, "shelf_location" : position, "quantity" : 1}
+
+@pytest.fixture
+def stored_sessions(monkeypatch):
+    shelf_info, products = make_store()
+    # Replay is offline, any planogram request is a bug
+    monkeypatch.setattr(ProductMapper, "fetchPlanogram", lambda *args, **kwargs: pytest.fail("replay fetched a planogram"))
+    sessions = [
+        # Reviewed cart matches the grabs
+        ("correct", {"predictions" : [grab(2, 250.0), grab(3, 400.0)], "products" : products}, {"cart" : [item(2), item(3)]}),
+        # Reviewer found an item no weight event explains
+        ("missed", {"predictions" : [grab(1, 100.0)], "products" : products}, {"cart" : [item(1), item(2)]}),
+        # Same position, other shelf: must not count as the reviewed item
+        ("wrong-shelf", {"predictions" : [grab(1, 120.0, shelf=2)], "products" : products}, {"cart" : [item(1)]}),
+    ]
+    return {"store" : shelf_info}, sessions
+
+class StubResponse:
+    def __init__(self, headers:dict) -> None:
+        self.headers = headers
+        self.status_code = 200
+
+def test_replay_matches_cart_metrics(stored_sessions):
+    shelf_infos, sessions = stored_sessions
+    all_session_tags = {"missed" : ["incomplete-reach"]}
+    replayed = ReplayBacktester(shelf_infos, SESSION_TAGS, PREDICTION_TAGS, max_workers=1).run(iter(sessions), {"replay-p" : dict()}, all_session_tags)
+
+    # What cart-metrics answers for the same sessions
+    verdicts = {
+        "correct" : {"is_correct" : "True", "num_fn" : "0", "num_fp" : "0", "num_reviews" : "1"},
+        "missed" : {"is_correct" : "False", "num_fn" : "1", "num_fp" : "0", "num_reviews" : "1"},
+        "wrong-shelf" : {"is_correct" : "False", "num_fn" : "1", "num_fp" : "1", "num_reviews" : "1"},
+    }
+    backtester = Backtester(max_workers=1)
+    backtester.session_tags = SESSION_TAGS
+    backtester.prediction_tags = PREDICTION_TAGS
+    backtester.make_backtest_request = lambda session, version: StubResponse(verdicts[session])
+    expected = backtester.score_sessions([session_id for session_id, _, _ in sessions], ["replay-p"], all_session_tags).to_version_results()
+
+    assert replayed == expected
+    assert replayed["replay-p"]["correct"] == 1
+    assert replayed["replay-p"]["total"] == 3
+    assert replayed["replay-p"]["session_tags"]["incomplete-reach"] == {"correct" : 0, "total" : 1}
+
+def test_sessions_without_a_stored_product_map_are_skipped(stored_sessions):
+    shelf_infos, sessions = stored_sessions
+    session_id, inputs, reviewed_cart = sessions[0]
+    replayed = ReplayBacktester(shelf_infos, SESSION_TAGS, PREDICTION_TAGS, max_workers=1).run(iter([(session_id, {"predictions" : inputs["predictions"]}, reviewed_cart)]), {"replay-p" : dict()})
+    assert replayed["replay-p"]["total"] == 0
+
+def test_score_cart_requires_item_location():
+    with pytest.raises(ValueError):
+        score_cart({(1, 1, 1) : 1}, {"cart" : [{"upc" : "upc-0", "quantity" : 1}]})
+    with pytest.raises(ValueError):
+        score_cart({(1, 1, 1) : 1}, {"cart" : [{"shelf_location" : 1, "quantity" : 1}]})
+
+def test_score_cart_counts_misses_and_extras():
+    result = score_cart({(1, 1, 1) : 2, (1, 1, 3) : 1}, {"cart" : [item(1), item(2)]})
+    assert result == {"is_correct" : False, "num_fn" : 1, "num_fp" : 2, "prediction_tags" : ["false-negative", "false-positive"]}
@@ -0,0 +1,80 @@
+import multiprocessing
+import threading
+import pytest
+import Backtesting
+from Backtesting import Backtester
+from Sharding import RedisPartialStore, shard_sessions
+from SharedCache import SharedCache
+from fakes import FakeSQL, InMemoryRedis
+
+SESSIONS = [f"session-{i}" for i in range(60)]
+SESSION_TAGS = {session : ["multi-product-grab"] if i % 4 == 0 else ["incomplete-reach"] for i, session in enumerate(SESSIONS)}
+VERSIONS = ["v1", "v2"]
+
+class StubResponse:
+    status_code = 200
+    def __init__(self, session:str, version:str) -> None:
+        i = int(session.split("-")[1])
+        is_correct = (i + len(version) * (version == "v2")) % 3 != 0
+        self.headers = {"is_correct" : str(is_correct), "num_fn" : "0" if is_correct else "1", "num_fp" : "1" if i % 5 == 0 else "0", "num_reviews" : "1"}
+
+def make_backtester() -> Backtester:
+    backtester = Backtester(max_workers=2, retries=0)
+    backtester.result_store = None
+    backtester.shared_cache = None
+    backtester.cart_versions = VERSIONS
+    backtester.session_tags = ["multi-product-grab", "incomplete-reach"]
+    backtester.prediction_tags = ["false-negative", "false-positive"]
+    backtester.make_backtest_request = StubResponse
+    backtester.run_mlflow_experiment = lambda version_results, config: None
+    return backtester
+
+def run_shard(shard_index:int, shard_count:int, results) -> None:
+    version_results = make_backtester().backtest_all_sessions(FakeSQL(SESSIONS, SESSION_TAGS), dict(), shard_index=shard_index, shard_count=shard_count)
+    results.put((shard_index, version_results))
+
+def expected_results() -> dict:
+    backtester = make_backtester()
+    return backtester.score_sessions(SESSIONS, VERSIONS, backtester.load_session_tags(FakeSQL(SESSIONS, SESSION_TAGS), SESSIONS)).to_version_results()
+
+@pytest.fixture
+def shard_env(monkeypatch, tmp_path):
+    monkeypatch.delenv("REDIS_ADDRESS", raising=False)
+    monkeypatch.setenv("BACKTEST_PARTIAL_STORE", str(tmp_path / "partials.db"))
+    monkeypatch.setenv("BACKTEST_RUN_ID", "run-1")
+    monkeypatch.setenv("BACKTEST_MERGE_TIMEOUT", "60")
+    monkeypatch.setenv("BACKTEST_MERGE_POLL", "0.05")
+
+def test_every_session_belongs_to_exactly_one_shard():
+    shards = [shard_sessions(SESSIONS, shard_index, 3) for shard_index in range(3)]
+    assert sorted(session for shard in shards for session in shard) == sorted(SESSIONS)
+    assert all(shards)
+
+@pytest.mark.parametrize("shard_count", [2, 3])
+def test_shard_processes_merge_to_the_single_process_totals(shard_env, shard_count):
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    # The coordinator starts first, so it has to wait for the other shards' partials
+    processes = [context.Process(target=run_shard, args=(shard_index, shard_count, results)) for shard_index in range(shard_count)]
+    for process in processes:
+        process.start()
+    shard_results = dict(results.get(timeout=60) for _ in processes)
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+    assert all(shard_results[shard_index] is None for shard_index in range(1, shard_count))
+    assert shard_results[0] == expected_results()
+
+def test_redis_partial_store_merges_shards(shard_env, monkeypatch):
+    client = InMemoryRedis()
+    monkeypatch.setattr(Backtesting, "partial_store_from_env", lambda: RedisPartialStore(SharedCache(client)))
+    results = dict()
+    def run(shard_index):
+        results[shard_index] = make_backtester().backtest_all_sessions(FakeSQL(SESSIONS, SESSION_TAGS), dict(), shard_index=shard_index, shard_count=3)
+    threads = [threading.Thread(target=run, args=(shard_index,)) for shard_index in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    assert results[0] == expected_results()
+    assert results[1] is None and results[2] is None
@@ -0,0 +1,82 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier, Lock
+import pytest
+from Backtesting import Backtester
+from SharedCache import SharedCache
+from fakes import InMemoryRedis
+
+def test_concurrent_misses_fetch_once():
+    cache = SharedCache(InMemoryRedis(), lock_ttl=5)
+    workers = 16
+    barrier = Barrier(workers)
+    calls = list()
+    calls_lock = Lock()
+    def fetch():
+        with calls_lock:
+            calls.append(1)
+        time.sleep(0.2)
+        return {"is_correct" : True}
+    def miss(_):
+        barrier.wait()
+        return cache.get_or_fetch(cache.key("verdict", "v1", "s1"), fetch, ttl=60)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        values = list(executor.map(miss, range(workers)))
+    assert len(calls) == 1
+    assert values == [{"is_correct" : True}] * workers
+
+def test_lock_owned_by_someone_else_is_not_released():
+    client = InMemoryRedis()
+    cache = SharedCache(client)
+    client.set("key:lock", "their-token", nx=True, px=60000)
+    cache.release("key:lock", "our-token")
+    assert client.get("key:lock") == b"their-token"
+    cache.release("key:lock", "their-token")
+    assert client.get("key:lock") is None
+
+def test_expired_lock_taken_over_is_kept_by_its_new_owner():
+    client = InMemoryRedis()
+    cache = SharedCache(client, lock_ttl=0.05)
+    def slow_fetch():
+        # Our lock expires while we fetch and another worker takes it over
+        time.sleep(0.1)
+        assert client.set("key:lock", "new-owner", nx=True, px=60000)
+        return "value"
+    assert cache.get_or_fetch("key", slow_fetch, ttl=60) == "value"
+    assert client.get("key:lock") == b"new-owner"
+
+class StubResponse:
+    status_code = 200
+    def __init__(self, is_correct:bool) -> None:
+        self.headers = {"is_correct" : str(is_correct), "num_fn" : "0", "num_fp" : "0", "num_reviews" : "1"}
+
+@pytest.fixture
+def backtester():
+    backtester = Backtester(max_workers=1, retries=0)
+    backtester.result_store = None
+    backtester.shared_cache = SharedCache(InMemoryRedis())
+    backtester.verdicts = {"v1" : True, "v2" : True}
+    backtester.requests = list()
+    def make_backtest_request(session, version):
+        backtester.requests.append((session, version))
+        return StubResponse(backtester.verdicts[version])
+    backtester.make_backtest_request = make_backtest_request
+    return backtester
+
+def verdicts(backtester) -> dict:
+    return {version : info["is_correct"] for version, info in backtester.backtest_session("s1", ["v1", "v2"]).items()}
+
+def test_generation_bump_hides_stale_verdicts(backtester):
+    assert verdicts(backtester) == {"v1" : True, "v2" : True}
+    backtester.verdicts = {"v1" : False, "v2" : False}
+    # Cached until the session is re-predicted
+    assert verdicts(backtester) == {"v1" : True, "v2" : True}
+    assert len(backtester.requests) == 2
+
+    backtester.invalidate_verdicts(["s1"], versions=["v2"])
+    assert verdicts(backtester) == {"v1" : True, "v2" : False}
+    assert backtester.requests[2:] == [("s1", "v2")]
+
+    backtester.invalidate_verdicts(["s1"])
+    assert verdicts(backtester) == {"v1" : False, "v2" : False}
+    assert backtester.requests[3:] == [("s1", "v1"), ("s1", "v2")]
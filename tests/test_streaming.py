@@ -0,0 +1,112 @@
+import sqlite3
+import time
+import pytest
+from Backtesting import Backtester
+from Streaming import StreamingBacktester, StreamState
+from fakes import InMemoryBroker
+
+SESSIONS = [f"s{i}" for i in range(12)]
+
+class StubResponse:
+    def __init__(self, is_correct:bool) -> None:
+        self.headers = {"is_correct" : str(is_correct), "num_fn" : "0", "num_fp" : "0" if is_correct else "1", "num_reviews" : "1"}
+        self.status_code = 200
+
+@pytest.fixture
+def backtester(monkeypatch):
+    monkeypatch.delenv("REDIS_ADDRESS", raising=False)
+    monkeypatch.setenv("STREAM_RETRY_DELAY", "0")
+    backtester = Backtester(max_workers=1, retries=0)
+    backtester.result_store = None
+    backtester.session_tags = ["multi-product-grab"]
+    backtester.prediction_tags = ["false-positive"]
+    backtester.load_session_tags = lambda sql, sessions: dict()
+    backtester.requests = list()
+    def make_backtest_request(session, version):
+        backtester.requests.append((session, version))
+        return StubResponse(int(session[1:]) % 3 != 0)
+    backtester.make_backtest_request = make_backtest_request
+    return backtester
+
+def produce(broker:InMemoryBroker, sessions:list) -> None:
+    for session in sessions:
+        broker.produce("reviews", {"session_id" : session}, key=session)
+
+def streaming(backtester, broker, path, **kwargs) -> StreamingBacktester:
+    return StreamingBacktester(backtester, None, broker.consumer("reviews", "group"), ["v1", "v2"], StreamState(str(path)), **kwargs)
+
+def test_redelivered_events_are_not_scored_twice(backtester, tmp_path):
+    broker = InMemoryBroker(partitions=3)
+    produce(broker, SESSIONS + SESSIONS[:4])
+    first = streaming(backtester, broker, tmp_path / "state.db", checkpoint_every=5)
+    # The pod dies after checkpointing but before Kafka sees the commits, so every event is delivered again
+    first.consumer.commit = lambda message=None, asynchronous=True: None
+    results = first.run(idle_timeout=0.05, poll_timeout=0.01)
+    assert len(backtester.requests) == 2 * len(SESSIONS)
+    assert results["totals"]["v1"]["total"] == len(SESSIONS)
+
+    restarted = streaming(backtester, broker, tmp_path / "state.db", checkpoint_every=5)
+    assert restarted.run(idle_timeout=0.05, poll_timeout=0.01)["totals"] == results["totals"]
+    assert len(backtester.requests) == 2 * len(SESSIONS)
+
+def test_failed_events_are_retried_up_to_the_limit_then_dropped(backtester, monkeypatch, tmp_path):
+    monkeypatch.setenv("STREAM_MAX_ATTEMPTS", "3")
+    scored = backtester.make_backtest_request
+    def make_backtest_request(session, version):
+        if session == "s1" and version == "v2":
+            backtester.requests.append((session, version))
+            # What make_backtest_request returns once its retries are used up
+            return dict()
+        return scored(session, version)
+    backtester.make_backtest_request = make_backtest_request
+    broker = InMemoryBroker()
+    produce(broker, SESSIONS)
+    stream = streaming(backtester, broker, tmp_path / "state.db", checkpoint_interval=0.001)
+    results = stream.run(idle_timeout=0.3, poll_timeout=0.01)
+    assert backtester.requests.count(("s1", "v2")) == 3
+    assert backtester.requests.count(("s1", "v1")) == 1
+    assert results["failed"] == 0
+    assert results["dropped"] == 1
+    assert results["totals"]["v1"]["total"] == len(SESSIONS)
+    assert results["totals"]["v2"]["total"] == len(SESSIONS) - 1
+
+def test_failed_events_recover_on_retry(backtester, tmp_path):
+    down = [True]
+    scored = backtester.make_backtest_request
+    def make_backtest_request(session, version):
+        if session == "s1" and down[0]:
+            down[0] = False
+            raise ConnectionError("cart-metrics is down")
+        return scored(session, version)
+    backtester.make_backtest_request = make_backtest_request
+    broker = InMemoryBroker()
+    produce(broker, SESSIONS)
+    results = streaming(backtester, broker, tmp_path / "state.db", checkpoint_interval=0.001).run(idle_timeout=0.2, poll_timeout=0.01)
+    assert results["failed"] == 0 and results["dropped"] == 0
+    assert results["totals"]["v2"]["total"] == len(SESSIONS)
+
+def test_window_expiry_removes_old_results(backtester, tmp_path):
+    broker = InMemoryBroker()
+    produce(broker, SESSIONS)
+    path = tmp_path / "state.db"
+    results = streaming(backtester, broker, path, window=4, checkpoint_every=3).run(idle_timeout=0.05, poll_timeout=0.01)
+    # s8..s11 are the last four sessions, s9 is the only wrong one
+    assert results["rolling"]["v1"]["total"] == 4
+    assert results["rolling"]["v1"]["correct"] == 3
+    assert results["totals"]["v1"]["total"] == len(SESSIONS)
+    rows = sqlite3.connect(str(path)).execute("SELECT COUNT(*) FROM stream_window").fetchone()[0]
+    assert rows == 4 * 2
+
+    produce(broker, ["s12"])
+    restarted = streaming(backtester, broker, path, window=4).run(idle_timeout=0.05, poll_timeout=0.01)
+    # s12 pushes s8 out of the restored window
+    assert restarted["rolling"]["v1"] == {**restarted["rolling"]["v1"], "total" : 4, "correct" : 2}
+
+def test_scored_pairs_expire_after_the_retention(tmp_path):
+    state = StreamState(str(tmp_path / "state.db"), retention=0.05)
+    state.checkpoint(dict(), {("s1", "v1")}, dict())
+    assert state.is_scored("s1", "v1")
+    time.sleep(0.1)
+    state.checkpoint(dict(), {("s2", "v1")}, dict())
+    assert not state.is_scored("s1", "v1")
+    assert state.is_scored("s2", "v1")